@@ -1,2 +1,2 @@
 #!/bin/bash
-if [ -n "$TEXTBLOB" ] ; then apt-get update && apt-get install -y python3-pip && pip install textblob ; fi
\ No newline at end of file
+if [ -n "$TEXTBLOB" ] ; then apt-get update && apt-get install -y python3-pip && pip install textblob numpy ; fi
\ No newline at end of file
@@ -1,4 +1,3 @@
-import hashlib
 import os
 from time import sleep
 import pika
@@ -7,10 +6,14 @@ import pika.exceptions
 from queue import Queue, Empty
 
 import pika.spec
-from utils.Batch import Batch
+import threading
+from utils.Batch import Batch, ROW_BATCH_FORMAT
+from CommunicationMiddleware.sharding import get_sharded_batchs, report_routing_caches, DEFAULT_SHARD_HASH
 
 STARTING_RABBIT_WAIT = 1
 MAX_ATTEMPTS = 6
+NO_PUBLISH_WINDOW = 0
+CONSUME_TIMED_OUT = 'timed out'
 MIDDLEWARE_EXCEPTIONS = (pika.exceptions.AMQPError,
             pika.exceptions.AMQPConnectionError,
             pika.exceptions.AMQPChannelError,
@@ -31,9 +34,15 @@ class ConsumerQueues():
         self.queues[queue_name] = generator
 
     def recv_from(self, queue_name):
+        """
+        Returns the body and method frame of the next message, (None, None) if the connection 
+        was closed or (None, CONSUME_TIMED_OUT) if the consumer inactivity timeout expired
+        """
         try:
             generator = self.queues[queue_name]
             method_frame, _header_frame, body = next(generator)
+            if method_frame == None:
+                return None, CONSUME_TIMED_OUT
             
             return body, method_frame
         except MIDDLEWARE_EXCEPTIONS:
@@ -65,26 +74,200 @@ class ProducerGroup():
     def __repr__(self):
         return f"{self.producer_queues}"
         
+class UnconfirmedPublishes():
+    """
+    Publishes sent in confirm mode that the broker has not acked yet, by delivery tag.
+    The ones the broker nacks are kept to be published again
+    """
+    def __init__(self):
+        self.publishes = {}
+        self.last_delivery_tag = 0
+        self.nacked = []
+
+    def add(self, message, queue_name):
+        self.last_delivery_tag += 1
+        self.publishes[self.last_delivery_tag] = (message, queue_name)
+
+    def confirm(self, method_frame):
+        """
+        Removes the publishes confirmed by method_frame. Returns how many of them were acked
+        """
+        method = method_frame.method
+        if method.multiple:
+            delivery_tags = [tag for tag in self.publishes if tag <= method.delivery_tag]
+        else:
+            delivery_tags = [method.delivery_tag]
+        acked = 0
+        for delivery_tag in delivery_tags:
+            publish = self.publishes.pop(delivery_tag, None)
+            if publish == None:
+                continue
+            if isinstance(method, pika.spec.Basic.Nack):
+                self.nacked.append(publish)
+            else:
+                acked += 1
+        return acked
+
+    def pop_nacked(self):
+        nacked = self.nacked
+        self.nacked = []
+        return nacked
+
+    def __len__(self):
+        return len(self.publishes)
+
+class WindowedPublisher():
+    """
+    Publishes with publisher confirms on its own asynchronous connection, whose ioloop runs in a
+    thread, so up to window messages wait for their confirmation at the same time. The acks and
+    nacks are reconciled with the delivery tags of the publishes as they arrive, and the nacked
+    messages are published again. Once the connection or its channel is closed every publish fails
+    """
+    def __init__(self, window):
+        self.window = window
+        self.connection = None
+        self.channel = None
+        self.thread = None
+        self.unconfirmed = UnconfirmedPublishes()
+        # Messages published and not acked yet, including the ones the ioloop did not publish yet
+        self.in_flight = 0
+        self.failed = False
+        self.condition = threading.Condition()
+
+    @classmethod
+    def new(cls, parameters, window):
+        publisher = WindowedPublisher(window)
+        try:
+            publisher.connection = pika.SelectConnection(parameters, 
+                                                        on_open_callback=publisher.on_connection_open, 
+                                                        on_open_error_callback=publisher.on_connection_closed, 
+                                                        on_close_callback=publisher.on_connection_closed)
+        except MIDDLEWARE_EXCEPTIONS as e:
+            print(f"[Communicator] Could not open the publishing connection: {e}")
+            return None
+        publisher.thread = threading.Thread(target=publisher.connection.ioloop.start, daemon=True)
+        publisher.thread.start()
+        with publisher.condition:
+            publisher.condition.wait_for(lambda: publisher.channel != None or publisher.failed)
+        if publisher.failed:
+            print("[Communicator] Could not open the publishing channel")
+            return None
+        return publisher
+
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_channel_open(self, channel):
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.confirm_delivery(ack_nack_callback=self.on_confirmation, callback=lambda _frame: self.set_channel(channel))
+
+    def set_channel(self, channel):
+        with self.condition:
+            self.channel = channel
+            self.condition.notify_all()
+
+    def on_channel_closed(self, _channel, reason):
+        print(f"[Communicator] Publishing channel closed: {reason}")
+        self.fail()
+        if self.connection.is_open:
+            self.connection.close()
+
+    def on_connection_closed(self, _connection, reason):
+        print(f"[Communicator] Publishing connection closed: {reason}")
+        self.fail()
+        self.connection.ioloop.stop()
+
+    def fail(self):
+        with self.condition:
+            self.failed = True
+            self.condition.notify_all()
+
+    def on_confirmation(self, method_frame):
+        with self.condition:
+            self.in_flight -= self.unconfirmed.confirm(method_frame)
+            nacked = self.unconfirmed.pop_nacked()
+            self.condition.notify_all()
+        for message, queue_name in nacked:
+            print("\n\nRabbit perdio un mensaje, reenviando\n\n")
+            self.publish_in_loop(message, queue_name)
+
+    def publish_in_loop(self, message, queue_name):
+        """
+        Publishes message from the ioloop thread, the only one that uses the channel
+        """
+        if self.failed:
+            return
+        try:
+            self.channel.basic_publish(exchange="", routing_key=queue_name, body=message)
+            with self.condition:
+                self.unconfirmed.add(message, queue_name)
+        except MIDDLEWARE_EXCEPTIONS as e:
+            print(f"[Communicator] Could not publish: {e}")
+            self.fail()
+
+    def publish(self, message, queue_name):
+        """
+        Hands message to the ioloop to be published, waiting first while the window is full.
+        Returns False if the publisher failed
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.failed or self.in_flight < self.window)
+            if self.failed:
+                return False
+            self.in_flight += 1
+        try:
+            self.connection.ioloop.add_callback_threadsafe(lambda: self.publish_in_loop(message, queue_name))
+        except MIDDLEWARE_EXCEPTIONS:
+            self.fail()
+            return False
+        return True
+
+    def flush(self):
+        """
+        Waits until the broker acks every message published. Returns False if the publisher failed,
+        in which case the ones not acked must be considered not sent
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.failed or self.in_flight == 0)
+            return not self.failed
+
+    def close(self):
+        if self.thread == None or not self.thread.is_alive():
+            return
+        try:
+            self.connection.ioloop.add_callback_threadsafe(self.connection.close)
+        except MIDDLEWARE_EXCEPTIONS:
+            return
+        self.thread.join()
+
 class Communicator():
         
-    def __init__(self, connection, producer_groups={}, auto_ack = True, prefetch_count=1):
+    def __init__(self, connection, producer_groups={}, auto_ack = True, prefetch_count=1, publisher=None, inactivity_timeout=None):
+        """
+        With a WindowedPublisher, messages are published through its window without waiting for
+        the broker confirmation, and flush must be called to wait for them.
+        With an inactivity_timeout, consume_message can return without a message
+        """
         self.connection = connection
         self.consumer_queues = ConsumerQueues()     
         self.producer_groups = {group:ProducerGroup(members) for group, members in producer_groups.items() }
         self.channel = self.connection.channel()
         self.auto_ack = auto_ack
+        self.inactivity_timeout = inactivity_timeout
         self.last_delivery_tag = None
         self.channel.basic_qos(prefetch_count=prefetch_count)
         self.set_producer_queues()
         self.channel.confirm_delivery()
+        self.publisher = publisher
         self.closed = False
 
     @classmethod
-    def new(cls, signal_queue: Queue, producer_groups={}, auto_ack = True, prefetch_count=1):
+    def new(cls, signal_queue: Queue, producer_groups={}, auto_ack = True, prefetch_count=1, publish_window=None, inactivity_timeout=None):
         i = STARTING_RABBIT_WAIT
+        parameters = pika.ConnectionParameters(host='rabbitmq')
         while True:
             try:
-                connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq'))
+                connection = pika.BlockingConnection(parameters)
                 break
             except:
                 if i > 2**MAX_ATTEMPTS:
@@ -97,7 +280,15 @@ class Communicator():
                     return None
                 except Empty:   
                     i *= 2
-        return Communicator(connection, producer_groups, auto_ack, prefetch_count)        
+        if publish_window == None:
+            publish_window = publish_window_from_env()
+        publisher = None
+        if publish_window != NO_PUBLISH_WINDOW:
+            publisher = WindowedPublisher.new(parameters, publish_window)
+            if publisher == None:
+                connection.close()
+                return None
+        return Communicator(connection, producer_groups, auto_ack, prefetch_count, publisher, inactivity_timeout)        
 
     def set_producer_queues(self):
         for members in self.producer_groups.values():
@@ -106,10 +297,14 @@ class Communicator():
 
     def set_consumer_queue(self, queue_name):
         self.channel.queue_declare(queue=queue_name, durable=True)
-        generator = self.channel.consume(queue=queue_name)
+        generator = self.channel.consume(queue=queue_name, inactivity_timeout=self.inactivity_timeout)
         self.consumer_queues.add_queue(queue_name, generator)
 
-    def produce_message(self, message, group, queue_pos=None):
+    def produce_message(self, message, group, queue_pos=None, flush=True):
+        """
+        Publishes message to a member of group. With a publish window, it only waits 
+        for the broker confirmations if flush is True
+        """
         if self.connection.is_closed:
             return False
         group_to_send = self.producer_groups[group]
@@ -117,6 +312,11 @@ class Communicator():
             queue_name = group_to_send.next()
         else:
             queue_name = group_to_send.producer_queues[queue_pos]
+
+        if self.publisher != None:
+            if not self.publisher.publish(message, queue_name):
+                return False
+            return self.flush() if flush else True
         
         acked = False
         while not acked:
@@ -128,36 +328,56 @@ class Communicator():
             except MIDDLEWARE_EXCEPTIONS:
                 return False 
         return True
+
+    def flush(self):
+        """
+        Waits until the broker confirms every message published in the window. 
+        Returns False if the connection was lost, in which case they must be considered not sent
+        """
+        if self.publisher == None:
+            return True
+        return self.publisher.flush()
     
-    def produce_batch_of_messages(self, batch, group, shard_by=None):
+    def produce_batch_of_messages(self, batch, group, shard_by=None, batch_format=ROW_BATCH_FORMAT, shard_hash=DEFAULT_SHARD_HASH, flush=True):
         """
-        Produces a batch into the group sharding it first by the field shard_by. 
+        Produces a batch encoded in batch_format into the group sharding it first by the field shard_by
+        with the shard_hash function. With a publish window, it only waits for the broker confirmations if flush is True. 
         Objects inside of batch must implement get_attribute_to_hash method that returns a string
         """
         if shard_by == None:
-            return self.produce_message(batch.to_bytes(), group, None)
-        hashed_batchs = get_sharded_batchs(batch, shard_by, self.amount_of_producer_group(group))
+            return self.produce_message(batch.to_bytes(batch_format), group, None, flush)
+        hashed_batchs = get_sharded_batchs(batch, shard_by, self.amount_of_producer_group(group), shard_hash)
         for batch_destination, batch in hashed_batchs.items():
             if not batch.is_empty():
-                if not self.produce_message(batch.to_bytes(), group, batch_destination):
+                if not self.produce_message(batch.to_bytes(batch_format), group, batch_destination, False):
                     return False
-        return True
+        return self.flush() if flush else True
 
 
     def produce_to_all_group_members(self, message):
         for group, members in self.producer_groups.items():
             for _member in members:
-                if not self.produce_message(message, group):
+                if not self.produce_message(message, group, flush=False):
                     return False
-        return True
+        return self.flush()
 
-    def consume_message(self, queue_name):
+    def consume_message(self, queue_name, wait=True):
+        """
+        Returns the next message of queue_name, or an empty bytearray if the connection was lost. 
+        If wait is False and the inactivity timeout expires without a message, returns None
+        """
         if self.connection.is_closed:
             return bytearray([])
         try:
             if not self.consumer_queues.contains(queue_name):
                 self.set_consumer_queue(queue_name)
             message, method = self.consumer_queues.recv_from(queue_name)
+            while method == CONSUME_TIMED_OUT:
+                if not wait:
+                    return None
+                if self.closed:
+                    return bytearray([])
+                message, method = self.consumer_queues.recv_from(queue_name)
             if message == None:
                 return bytearray([])
             
@@ -187,6 +407,16 @@ class Communicator():
             return False
         return True
     
+    def acknowledge_messages_until(self, delivery_tag):
+        """
+        Acknowledges every unacknowledged message received up to delivery_tag included
+        """
+        try:
+            self.channel.basic_ack(delivery_tag=delivery_tag, multiple=True)
+        except MIDDLEWARE_EXCEPTIONS:
+            return False
+        return True
+    
     def nack_last_message(self):
         if self.last_delivery_tag == None:
             return True
@@ -205,14 +435,138 @@ class Communicator():
     def close_connection(self):
         if not self.closed:
             self.closed = True
+            report_routing_caches()
+            if self.publisher != None:
+                self.publisher.close()
             self.connection.close()
 
-def get_sharded_batchs(batch, shard_by, amount_of_shards):
-    hashed_messages = {}
-    for msg in batch:
-        string_to_hash = msg.get_attribute_to_hash(shard_by)
-        hash_object = hashlib.sha256(string_to_hash.lower().encode())
-        msg_destination = int(hash_object.hexdigest(), 16) % amount_of_shards
-        hashed_messages[msg_destination] = hashed_messages.get(msg_destination, []) + [msg]
-    
-    return {w:Batch(batch.client_id, batch.sender_id, batch.seq_num, messages) for w, messages in hashed_messages.items()}
\ No newline at end of file
+def publish_window_from_env():
+    publish_window = os.getenv("PUBLISH_WINDOW")
+    if not publish_window:
+        return NO_PUBLISH_WINDOW
+    try:
+        return max(int(publish_window), NO_PUBLISH_WINDOW)
+    except ValueError as e:
+        print(f"[Communicator] Invalid PUBLISH_WINDOW, waiting for every confirmation: {e}")
+        return NO_PUBLISH_WINDOW
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+    from pika.frame import Method
+
+    class TestChannel():
+        """
+        Keeps the messages published instead of sending them to a broker
+        """
+        def __init__(self):
+            self.published = []
+
+        def basic_publish(self, exchange, routing_key, body):
+            self.published.append((routing_key, body))
+
+    class TestIOLoop():
+        def add_callback_threadsafe(self, callback):
+            callback()
+
+    class TestConnection():
+        def __init__(self):
+            self.ioloop = TestIOLoop()
+            self.is_open = True
+
+        def close(self):
+            self.is_open = False
+
+    def confirmation(method_class, delivery_tag, multiple=False):
+        return Method(1, method_class(delivery_tag=delivery_tag, multiple=multiple))
+
+    class TestUnconfirmedPublishes(TestCase):
+        def test_ack_confirms_publish(self):
+            unconfirmed = UnconfirmedPublishes()
+            unconfirmed.add(b'1', 'queue')
+            unconfirmed.add(b'2', 'queue')
+            self.assertEqual(unconfirmed.confirm(confirmation(pika.spec.Basic.Ack, 2)), 1)
+            self.assertEqual(len(unconfirmed), 1)
+            self.assertEqual(unconfirmed.pop_nacked(), [])
+
+        def test_multiple_ack_confirms_previous_publishes(self):
+            unconfirmed = UnconfirmedPublishes()
+            for i in range(4):
+                unconfirmed.add(bytes([i]), 'queue')
+            self.assertEqual(unconfirmed.confirm(confirmation(pika.spec.Basic.Ack, 3, multiple=True)), 3)
+            self.assertEqual(len(unconfirmed), 1)
+
+        def test_nacked_publishes_are_kept(self):
+            unconfirmed = UnconfirmedPublishes()
+            unconfirmed.add(b'1', 'queue1')
+            unconfirmed.add(b'2', 'queue2')
+            self.assertEqual(unconfirmed.confirm(confirmation(pika.spec.Basic.Nack, 2, multiple=True)), 0)
+            self.assertEqual(len(unconfirmed), 0)
+            self.assertEqual(unconfirmed.pop_nacked(), [(b'1', 'queue1'), (b'2', 'queue2')])
+            self.assertEqual(unconfirmed.pop_nacked(), [])
+
+    class TestWindowedPublisher(TestCase):
+        def publisher(self, window):
+            publisher = WindowedPublisher(window)
+            publisher.connection = TestConnection()
+            publisher.set_channel(TestChannel())
+            return publisher
+
+        def test_publishes_do_not_wait_for_confirmations_inside_the_window(self):
+            publisher = self.publisher(3)
+            for i in range(3):
+                self.assertTrue(publisher.publish(bytes([i]), 'queue'))
+            self.assertEqual(len(publisher.channel.published), 3)
+            self.assertEqual(publisher.in_flight, 3)
+            publisher.on_confirmation(confirmation(pika.spec.Basic.Ack, 3, multiple=True))
+            self.assertEqual(publisher.in_flight, 0)
+            self.assertTrue(publisher.flush())
+
+        def test_full_window_waits_for_an_ack(self):
+            publisher = self.publisher(1)
+            publisher.publish(b'1', 'queue')
+            blocked = threading.Thread(target=publisher.publish, args=(b'2', 'queue'))
+            blocked.start()
+            blocked.join(timeout=0.1)
+            self.assertTrue(blocked.is_alive())
+            self.assertEqual(publisher.channel.published, [('queue', b'1')])
+            publisher.on_confirmation(confirmation(pika.spec.Basic.Ack, 1))
+            blocked.join()
+            self.assertEqual(publisher.channel.published, [('queue', b'1'), ('queue', b'2')])
+
+        def test_nacked_publishes_are_sent_again(self):
+            publisher = self.publisher(2)
+            publisher.publish(b'1', 'queue1')
+            publisher.publish(b'2', 'queue2')
+            publisher.on_confirmation(confirmation(pika.spec.Basic.Ack, 1))
+            publisher.on_confirmation(confirmation(pika.spec.Basic.Nack, 2))
+            self.assertEqual(publisher.channel.published[-1], ('queue2', b'2'))
+            self.assertEqual(publisher.in_flight, 1)
+            publisher.on_confirmation(confirmation(pika.spec.Basic.Ack, 3))
+            self.assertTrue(publisher.flush())
+
+        def test_closed_channel_fails_publishes_not_acked(self):
+            publisher = self.publisher(2)
+            publisher.publish(b'1', 'queue')
+            publisher.on_channel_closed(publisher.channel, "connection lost")
+            self.assertFalse(publisher.connection.is_open)
+            self.assertFalse(publisher.flush())
+            self.assertFalse(publisher.publish(b'2', 'queue'))
+            self.assertEqual(publisher.channel.published, [('queue', b'1')])
+
+    class TestPublishWindowFromEnv(TestCase):
+        def publish_window(self, value):
+            os.environ["PUBLISH_WINDOW"] = value
+            try:
+                return publish_window_from_env()
+            finally:
+                del os.environ["PUBLISH_WINDOW"]
+
+        def test_publish_window(self):
+            self.assertEqual(self.publish_window("64"), 64)
+
+        def test_invalid_publish_windows_wait_for_every_confirmation(self):
+            self.assertEqual(self.publish_window("-5"), NO_PUBLISH_WINDOW)
+            self.assertEqual(self.publish_window("mucho"), NO_PUBLISH_WINDOW)
+
+    unittest.main()
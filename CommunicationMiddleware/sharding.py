@@ -0,0 +1,162 @@
+from functools import lru_cache
+import hashlib
+import os
+import zlib
+import unittest
+from unittest import TestCase
+from utils.Batch import Batch
+
+SHA256_SHARD_HASH = 'sha256'
+CRC32_SHARD_HASH = 'crc32'
+DEFAULT_SHARD_HASH = SHA256_SHARD_HASH
+DEFAULT_ROUTING_CACHE_SIZE = 2**16
+ROUTING_CACHE_REPORT_INTERVAL = 2**20
+
+def sha256_hash(key_bytes):
+    return int.from_bytes(hashlib.sha256(key_bytes).digest(), 'big')
+
+def crc32_hash(key_bytes):
+    return zlib.crc32(key_bytes)
+
+"""
+Every sender to a pool must use the same hash, so changing the one of a pool 
+that accumulates by key is only safe with no clients in the system
+"""
+SHARD_HASHES = {
+    SHA256_SHARD_HASH: sha256_hash,
+    CRC32_SHARD_HASH: crc32_hash,
+}
+
+def routing_cache_size_from_env():
+    routing_cache_size = os.getenv("SHARD_CACHE_SIZE")
+    if not routing_cache_size:
+        return DEFAULT_ROUTING_CACHE_SIZE
+    try:
+        return int(routing_cache_size)
+    except ValueError as e:
+        print(f"[Sharder] Invalid SHARD_CACHE_SIZE, using {DEFAULT_ROUTING_CACHE_SIZE}: {e}")
+        return DEFAULT_ROUTING_CACHE_SIZE
+
+class Sharder():
+    def __init__(self, hash_function, name=DEFAULT_SHARD_HASH, routing_cache_size=0):
+        """
+        If routing_cache_size is not 0 the destination of the last routing_cache_size 
+        used (normalized key, amount of shards) pairs is kept in a LRU cache
+        """
+        self.hash_function = hash_function
+        self.name = name
+        self.routing_cache_size = routing_cache_size
+        self.destination_of = self.hashed_destination
+        if routing_cache_size:
+            self.destination_of = lru_cache(maxsize=routing_cache_size)(self.hashed_destination)
+
+    @classmethod
+    def new(cls, shard_hash=DEFAULT_SHARD_HASH, routing_cache_size=0):
+        hash_function = SHARD_HASHES.get(shard_hash, None)
+        if hash_function == None:
+            print(f"[Sharder] Invalid shard hash: {shard_hash}")
+            return None
+        return Sharder(hash_function, shard_hash, routing_cache_size)
+
+    def hashed_destination(self, normalized_key, amount_of_shards):
+        return self.hash_function(normalized_key.encode()) % amount_of_shards
+
+    def shard_of(self, key, amount_of_shards):
+        return self.destination_of(key.lower(), amount_of_shards)
+
+    def routing_cache_stats(self):
+        """
+        Returns hits, misses and current size of the routing cache, or None if there is no cache
+        """
+        if not self.routing_cache_size:
+            return None
+        info = self.destination_of.cache_info()
+        return info.hits, info.misses, info.currsize
+
+    def report_routing_cache(self):
+        stats = self.routing_cache_stats()
+        if stats == None:
+            return
+        hits, misses, size = stats
+        hit_rate = hits / (hits + misses) if hits + misses else 0
+        print(f"[Sharder] {self.name} routing cache: {hits} hits, {misses} misses ({hit_rate:.1%} hit rate), {size}/{self.routing_cache_size} entries")
+
+    def shard(self, batch, shard_by, amount_of_shards):
+        """
+        Splits the messages of batch by the hash of their shard_by field. 
+        Returns a dict with the non empty batch of each destination
+        """
+        if amount_of_shards == 1:
+            return {0: batch} if not batch.is_empty() else {}
+        buckets = [[] for _ in range(amount_of_shards)]
+        for msg in batch:
+            buckets[self.shard_of(msg.get_attribute_to_hash(shard_by), amount_of_shards)].append(msg)
+        self.report_routing_cache_periodically(batch.size())
+        return {w:Batch(batch.client_id, batch.sender_id, batch.seq_num, messages) for w, messages in enumerate(buckets) if messages}
+
+    def report_routing_cache_periodically(self, lookups):
+        stats = self.routing_cache_stats()
+        if stats == None:
+            return
+        hits, misses, _size = stats
+        if (hits + misses) // ROUTING_CACHE_REPORT_INTERVAL != (hits + misses - lookups) // ROUTING_CACHE_REPORT_INTERVAL:
+            self.report_routing_cache()
+
+SHARDERS = {}
+
+def sharder_of(shard_hash):
+    """
+    Returns the process wide Sharder of shard_hash, so the routing cache is shared by all pools
+    """
+    if not shard_hash in SHARDERS:
+        SHARDERS[shard_hash] = Sharder.new(shard_hash, routing_cache_size_from_env())
+    return SHARDERS[shard_hash]
+
+def get_sharded_batchs(batch, shard_by, amount_of_shards, shard_hash=DEFAULT_SHARD_HASH):
+    return sharder_of(shard_hash).shard(batch, shard_by, amount_of_shards)
+
+def report_routing_caches():
+    for sharder in SHARDERS.values():
+        sharder.report_routing_cache()
+
+class TestSharder(TestCase):
+    def legacy_shard_of(self, key, amount_of_shards):
+        return int(hashlib.sha256(key.lower().encode()).hexdigest(), 16) % amount_of_shards
+
+    def test_sha256_keeps_destinations(self):
+        sharder = Sharder.new(SHA256_SHARD_HASH)
+        for key in ['Titulo', 'otro titulo', 'Pride and Prejudice', 'ñandú', '']:
+            for amount_of_shards in [1, 2, 3, 5]:
+                self.assertEqual(sharder.shard_of(key, amount_of_shards), self.legacy_shard_of(key, amount_of_shards))
+
+    def test_shard_ignores_case(self):
+        sharder = Sharder.new(CRC32_SHARD_HASH)
+        self.assertEqual(sharder.shard_of('TITULO', 5), sharder.shard_of('titulo', 5))
+
+    def test_shard_batch(self):
+        from utils.QueryMessage import QueryMessage, BOOK_MSG_TYPE
+        from utils.SenderID import SenderID
+        messages = [QueryMessage(BOOK_MSG_TYPE, title=f'titulo{i}') for i in range(20)]
+        batch = Batch(1, SenderID(1,1,1), 7, messages)
+        sharder = Sharder.new()
+        sharded_batchs = sharder.shard(batch, 'title', 3)
+        self.assertEqual(sum(sharded.size() for sharded in sharded_batchs.values()), 20)
+        for destination, sharded in sharded_batchs.items():
+            self.assertEqual(sharded.seq_num, 7)
+            for message in sharded:
+                self.assertEqual(sharder.shard_of(message.title, 3), destination)
+
+    def test_routing_cache_keeps_destinations(self):
+        sharder = Sharder.new(SHA256_SHARD_HASH)
+        cached_sharder = Sharder.new(SHA256_SHARD_HASH, routing_cache_size=2)
+        for key in ['Titulo', 'titulo', 'otro', 'TITULO', 'tercero', 'titulo']:
+            self.assertEqual(cached_sharder.shard_of(key, 5), sharder.shard_of(key, 5))
+        hits, misses, size = cached_sharder.routing_cache_stats()
+        self.assertEqual((hits, misses, size), (3, 3, 2))
+        self.assertEqual(sharder.routing_cache_stats(), None)
+
+    def test_invalid_shard_hash(self):
+        self.assertEqual(Sharder.new('md5'), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -123,9 +123,12 @@ class GatewayIn():
                     append_extend(query_messages, query_message)
             pool = f'{query_number}.{FIRST_POOL}'
             batch = Batch(self.client_id, self.id, seq_num, query_messages)
-            if not self.com.produce_batch_of_messages(batch, pool, self.next_pools.shard_by_of_pool(pool)):
+            shard_by = self.next_pools.shard_by_of_pool(pool)
+            batch_format = self.next_pools.batch_format_of_pool(pool)
+            shard_hash = self.next_pools.shard_hash_of_pool(pool)
+            if not self.com.produce_batch_of_messages(batch, pool, shard_by, batch_format, shard_hash, flush=False):
                 return False
-        return True
+        return self.com.flush()
 
     def get_object_from_line(self, datasetLine):
         if datasetLine.is_book():
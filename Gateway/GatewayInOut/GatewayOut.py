@@ -235,11 +235,7 @@ class GatewayOut():
         return True
     
     def intialize_based_on_log_changing_file(self, log):
-        for key, old_entry in zip(log.keys, log.entries):
-            if old_entry == None:
-                self.metadata_handler.storage.remove(key)
-            else:
-                self.metadata_handler.storage.store(key, old_entry)
+        self.metadata_handler.storage.apply(log.keys, log.entries)
 
         self.set_previouse_metadata()
         self.send_last_execution_clients()
@@ -1,7 +1,11 @@
 from abc import ABC, abstractmethod
+import mmap
 import os
 import struct
 from Persistance.storage_errors import *
+from Persistance.log import sync_file
+from Persistance.RecordStorage import RecordStorage
+from Persistance.SnapshotStorage import SnapshotStorage
 from utils.auxiliar_functions import integer_to_big_endian_byte_array, byte_array_to_big_endian_integer, remove_bytes
 import io
 
@@ -12,6 +16,11 @@ LAST_FILE_POS = io.SEEK_END
 STR_PADDING = bytes([0xff])
 CROSS_OUT_BYTE = bytes([0xfe])
 
+FILE_STORAGE_BACKEND = 'file'
+MMAP_STORAGE_BACKEND = 'mmap'
+RECORD_STORAGE_BACKEND = 'records'
+SNAPSHOT_STORAGE_BACKEND = 'snapshot'
+
 class StorableTypes(ABC):
     @abstractmethod
     def to_bytes(self):
@@ -194,6 +203,26 @@ class KeyValueStorage():
     def is_mid_removal_entry_bytes(self, entry_bytes):
         return CROSS_OUT_BYTE[0] in entry_bytes
 
+    def entry_from_bytes(self, byte_array):
+        """
+        Returns the key and values of a complete entry, or None if its key was being crossed out
+        """
+        key_size = self.key_type.get_size_in_bytes(self.fixed_key_size)
+        key_bytes = byte_array[:key_size]
+        if self.is_mid_removal_entry_bytes(key_bytes):
+            return None
+        key = self.key_type.from_bytes(key_bytes)
+
+        values = []
+        offset = key_size
+        for value_type, value_size in zip(self.value_types, self.value_sizes):
+            value_end = offset + value_type.get_size_in_bytes(value_size)
+            values.append(value_type.from_bytes(byte_array[offset:value_end]).value)
+            offset = value_end
+        if len(values) == 1:
+            return key, values[0]
+        return key, values
+
     def get_entry(self):
         byte_array = bytearray(self.file.read(self.entry_byte_size))
         if len(byte_array) == 0:
@@ -203,31 +232,55 @@ class KeyValueStorage():
             #os.sync(self.file.fileno())
             return None
 
-        key_bytes = remove_bytes(byte_array, self.key_type.get_size_in_bytes(self.fixed_key_size))
-        if self.is_mid_removal_entry_bytes(key_bytes):
+        entry = self.entry_from_bytes(byte_array)
+        if entry == None:
             return self.get_entry()
-        key = self.key_type.from_bytes(key_bytes)
-        
-        values = []
-        for value_type, value_size in zip(self.value_types, self.value_sizes):
-            values.append(value_type.from_bytes(remove_bytes(byte_array, value_type.get_size_in_bytes(value_size))).value)
-        if len(values) == 1:
-            return key, values[0]
-        return key, values
+        return entry
 
-    def get_all_entries(self):
+    def read_entry(self, pos):
+        return self.entry_from_bytes(bytearray(self.read_at(pos * self.entry_byte_size, self.entry_byte_size)))
+
+    def read_all(self):
+        """
+        Returns a memoryview over all the bytes of the storage
+        """
         self.file.seek(STARTING_FILE_POS)
+        return memoryview(self.file.read())
+
+    def get_all_entries(self):
+        """
+        Loads all the entries. If a change was interrupted, the storage is rewritten without 
+        crossed out entries and with each key in its first position, with the values of its last one
+        """
         all_entries = {}
-        i = 0
-        while True:
-            entry = self.get_entry()
-            if entry == None:
-                break
-            all_entries[entry[0].value] = entry[1]
-            self.key_pos[entry[0]] = self.key_pos.get(entry[0],i)
-            if self.key_pos[entry[0]] == i:
-                i+=1
-        self.next_pos = i
+        self.key_pos = {}
+        entries_bytes = []
+        misplaced_entries = False
+        with self.read_all() as buffer:
+            storage_size = len(buffer)
+            complete_size = storage_size - storage_size % self.entry_byte_size
+            for offset in range(0, complete_size, self.entry_byte_size):
+                entry_bytes = bytearray(buffer[offset:offset + self.entry_byte_size])
+                entry = self.entry_from_bytes(entry_bytes)
+                if entry == None:
+                    misplaced_entries = True
+                    continue
+                all_entries[entry[0].value] = entry[1]
+                pos = self.key_pos.get(entry[0], len(entries_bytes))
+                if pos == len(entries_bytes):
+                    self.key_pos[entry[0]] = pos
+                    entries_bytes.append(entry_bytes)
+                else:
+                    entries_bytes[pos] = entry_bytes
+                    misplaced_entries = True
+        self.next_pos = len(entries_bytes)
+        if misplaced_entries:
+            self.write_at(0, b"".join(entries_bytes))
+            self.truncate(self.next_pos * self.entry_byte_size)
+            self.sync()
+        elif complete_size < storage_size:
+            # An entry was being added when the process stopped
+            self.del_last_bytes(storage_size - complete_size)
         return all_entries
 
     def get_key_pos(self, key):
@@ -236,21 +289,111 @@ class KeyValueStorage():
     def get_values_pos(self, key):
         return self.get_key_pos(key) + self.fixed_key_size
 
+    def read_at(self, offset, amount_of_bytes):
+        self.file.seek(offset, STARTING_FILE_POS)
+        return self.file.read(amount_of_bytes)
+
+    def write_at(self, offset, byte_array):
+        self.file.seek(offset, STARTING_FILE_POS)
+        self.file.write(byte_array)
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        sync_file(self.file)
+
     def write_key(self, key):
-        self.file.seek(self.get_key_pos(key), STARTING_FILE_POS)
-        self.file.write(key.to_bytes())
+        self.write_at(self.get_key_pos(key), key.to_bytes())
     
     def write_values(self, key, values):
-        self.file.seek(self.get_values_pos(key), STARTING_FILE_POS)
         byte_array = bytearray()
         for value in values:
             byte_array.extend(value.to_bytes())
-        self.file.write(byte_array)
+        self.write_at(self.get_values_pos(key), byte_array)
 
     def store_all(self, keys, list_of_values):
         for key, values in zip(keys, list_of_values):
             self.store(key, values, True)
-            os.fsync(self.file.fileno())
+            self.sync()
+
+    def apply(self, keys, list_of_values):
+        """
+        Stores each key with its values, or removes it if its values are None, with a single sync.
+        Removals move the last entry in memory, and the resulting entries are written in order 
+        of position. As entries only move to lower positions, an entry that is not updated is 
+        always written in its new position before its previous one is overwritten or truncated
+        """
+        pending_entries = {}
+        for key, values in zip(keys, list_of_values):
+            key = self.key_type(key, self.fixed_key_size)
+            if values == None:
+                self._remove_pending(key, pending_entries)
+                continue
+            self._check_values(values)
+            pos = self.key_pos.get(key, self.next_pos)
+            if pos == self.next_pos:
+                self.key_pos[key] = pos
+                self.next_pos += 1
+            pending_entries[pos] = self._entry_to_bytes(pos, key, self._convert_values(values), pending_entries)
+
+        self._write_entries(pending_entries)
+        if self.next_pos * self.entry_byte_size < self.size():
+            self.truncate(self.next_pos * self.entry_byte_size)
+        self.sync()
+
+    def _entry_bytes_in_pos(self, pos, pending_entries):
+        entry_bytes = pending_entries.get(pos)
+        if entry_bytes == None:
+            entry_bytes = bytearray(self.read_at(pos * self.entry_byte_size, self.entry_byte_size))
+        return entry_bytes
+
+    def _entry_to_bytes(self, pos, key, values, pending_entries):
+        byte_array = bytearray(key.to_bytes())
+        for value in values:
+            byte_array.extend(value.to_bytes())
+        if len(byte_array) < self.entry_byte_size:
+            # Storing a key without values keeps the ones it had
+            previous_bytes = self._entry_bytes_in_pos(pos, pending_entries)
+            byte_array.extend(previous_bytes[len(byte_array):self.entry_byte_size])
+        return byte_array.ljust(self.entry_byte_size, bytes([0]))
+
+    def _remove_pending(self, key, pending_entries):
+        pos = self.key_pos.pop(key, None)
+        if pos == None:
+            return
+        self.next_pos -= 1
+        if pos == self.next_pos:
+            pending_entries.pop(pos, None)
+            return
+        last_entry_bytes = self._entry_bytes_in_pos(self.next_pos, pending_entries)
+        pending_entries.pop(self.next_pos, None)
+        last_key = self.key_type.from_bytes(last_entry_bytes[:self.key_type.get_size_in_bytes(self.fixed_key_size)])
+        self.key_pos[last_key] = pos
+        pending_entries[pos] = last_entry_bytes
+
+    def _write_entries(self, pending_entries):
+        """
+        Writes the entries by position, with a single write for each run of consecutive positions
+        """
+        run_start = None
+        run_bytes = bytearray()
+        for pos in sorted(pending_entries):
+            if run_start != None and pos != run_start + len(run_bytes) // self.entry_byte_size:
+                self.write_at(run_start * self.entry_byte_size, run_bytes)
+                run_start = None
+                run_bytes = bytearray()
+            if run_start == None:
+                run_start = pos
+            run_bytes.extend(pending_entries[pos])
+        if run_start != None:
+            self.write_at(run_start * self.entry_byte_size, run_bytes)
+        self.flush()
+
+    def _check_values(self, values):
+        if (len(values) != len(self.value_types)) and len(values) != 0 and values != [list]:
+            print(f"values: {values} , values_types: {self.value_types}")
+            raise KeysMustBeEqualToValuesOr0
 
     def _convert_values(self, values):
         converted_values = []
@@ -259,9 +402,7 @@ class KeyValueStorage():
         return converted_values
 
     def store(self, key, values, store_all=False): 
-        if (len(values) != len(self.value_types)) and len(values) != 0 and values != [list]:
-            print(f"values: {values} , values_types: {self.value_types}")
-            raise KeysMustBeEqualToValuesOr0
+        self._check_values(values)
         
         converted_values = self._convert_values(values)
 
@@ -270,7 +411,7 @@ class KeyValueStorage():
         self._store_in_pos(pos, key, converted_values)
         
         if not store_all:
-            os.fsync(self.file.fileno())
+            self.sync()
         
     def _store_in_pos(self, pos, key, values, stepping=False):
         if pos == self.next_pos:
@@ -281,7 +422,7 @@ class KeyValueStorage():
             self.write_key(key)
 
         self.write_values(key, values)
-        self.file.flush()
+        self.flush()
 
     def remove(self, key):
         key = self.key_type(key, self.fixed_key_size)
@@ -293,8 +434,7 @@ class KeyValueStorage():
         if self.next_pos != pos_to_remove:
             self.cross_out_key(pos_to_remove)
 
-            self.file.seek(self.next_pos * self.entry_byte_size, STARTING_FILE_POS)
-            entry = self.get_entry()
+            entry = self.read_entry(self.next_pos)
             last_key = entry[0].value
             last_values = entry[1]
 
@@ -306,17 +446,21 @@ class KeyValueStorage():
             self._store_in_pos(pos_to_remove, last_key, last_values, stepping=True)
         self.del_last_line()
         
-        os.fsync(self.file.fileno())
+        self.sync()
 
     def cross_out_key(self, key_pos):
-        self.file.seek(key_pos*self.entry_byte_size, STARTING_FILE_POS)
-        self.file.write(CROSS_OUT_BYTE *self.fixed_key_size)
+        self.write_at(key_pos*self.entry_byte_size, CROSS_OUT_BYTE *self.fixed_key_size)
+        self.flush()
+
+    def size(self):
+        return self.file.seek(0, LAST_FILE_POS)
+
+    def truncate(self, size):
+        self.file.truncate(size)
         self.file.flush()
 
     def del_last_bytes(self, amount_of_bytes):
-        size = self.file.seek(0, LAST_FILE_POS)
-        self.file.truncate(max(0,size - amount_of_bytes))
-        self.file.flush()
+        self.truncate(max(0, self.size() - amount_of_bytes))
 
     def del_last_line(self):
         self.del_last_bytes(self.entry_byte_size)
@@ -325,7 +469,7 @@ class KeyValueStorage():
         self.file.close()
 
     def delete(self):
-        self.file.close()
+        self.close()
         filename = self.file.name
         try:
             os.remove(filename)
@@ -333,13 +477,106 @@ class KeyValueStorage():
             pass
         except:
             print("Could not remove ", filename)
+
+class MmapKeyValueStorage(KeyValueStorage):
+    """
+    KeyValueStorage with the same file layout, read and written through a shared memory 
+    map of the file. Stores are slice assignments and only reach the disk with sync
+    """
+    def __init__(self, file, key_type, fixed_key_size, value_types, values_fixed_size):
+        super().__init__(file, key_type, fixed_key_size, value_types, values_fixed_size)
+        self.map = None
+        self.resized = False
+        self.map_file()
+
+    def map_file(self):
+        size = self.file.seek(0, LAST_FILE_POS)
+        if size > 0:
+            self.map = mmap.mmap(self.file.fileno(), size)
+
+    def size(self):
+        if self.map == None:
+            return 0
+        return len(self.map)
+
+    def truncate(self, size):
+        if size == self.size():
+            return
+        self.resized = True
+        if size == 0:
+            self.map.close()
+            self.map = None
+            self.file.truncate(0)
+        elif self.map == None:
+            self.file.truncate(size)
+            self.map_file()
+        else:
+            self.map.resize(size)
+
+    def read_all(self):
+        if self.map == None:
+            return memoryview(b"")
+        return memoryview(self.map)
+
+    def read_at(self, offset, amount_of_bytes):
+        if self.map == None:
+            return b""
+        return self.map[offset:offset + amount_of_bytes]
+
+    def write_at(self, offset, byte_array):
+        end = offset + len(byte_array)
+        if end > self.size():
+            self.truncate(end)
+        self.map[offset:end] = byte_array
+
+    def flush(self):
+        pass
+
+    def sync(self):
+        if self.map != None:
+            self.map.flush()
+        if self.resized:
+            # The new size of the file is only durable with an fsync
+            os.fsync(self.file.fileno())
+            self.resized = False
+
+    def store_all(self, keys, list_of_values):
+        for key, values in zip(keys, list_of_values):
+            self.store(key, values, True)
+        self.sync()
+
+    def close(self):
+        if self.map != None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+STORAGE_BACKENDS = {
+    FILE_STORAGE_BACKEND: KeyValueStorage,
+    MMAP_STORAGE_BACKEND: MmapKeyValueStorage,
+    RECORD_STORAGE_BACKEND: RecordStorage,
+    SNAPSHOT_STORAGE_BACKEND: SnapshotStorage,
+}
+
+def storage_class_from_env():
+    """
+    Returns the storage class set by STORAGE_BACKEND, KeyValueStorage by default
+    """
+    storage_backend = os.getenv("STORAGE_BACKEND")
+    if not storage_backend:
+        return KeyValueStorage
+    storage_class = STORAGE_BACKENDS.get(storage_backend)
+    if storage_class == None:
+        print(f"Invalid STORAGE_BACKEND {storage_backend}, using {FILE_STORAGE_BACKEND}")
+        return KeyValueStorage
+    return storage_class
         
 if __name__ == '__main__':
     import unittest
     from unittest import TestCase
 
     from io import BytesIO
-    import pudb; pu.db
+    import tempfile
 
     MAX_LEN_LIST = 10
     FIXED_FLOAT_BYTES = 4
@@ -664,6 +901,106 @@ if __name__ == '__main__':
             self.assertEqual(storage.key_pos, expected_pos)
             self.assertEqual(storage.next_pos, 2)
         
+        def test_apply_same_as_store_and_remove(self):
+            operations = [("clave1", ["valor1", 1]), ("clave2", ["valor2", 2]), ("clave3", ["valor3", 3]), ("clave4", ["valor4", 4]),
+                          ("clave1", None), ("clave5", ["valor5", 5]), ("clave2", ["valor6", 6]), ("clave5", None), ("clave3", None), ("clave6", None)]
+            file = BytesIO(b"")
+            storage = KeyValueStorage(file, str, FIXED_STR_LEN, [str, int], [FIXED_STR_LEN, U32_BYTES])
+            for key, values in operations:
+                if values == None:
+                    storage.remove(key)
+                else:
+                    storage.store(key, values)
+
+            applied_file = BytesIO(b"")
+            applied_storage = KeyValueStorage(applied_file, str, FIXED_STR_LEN, [str, int], [FIXED_STR_LEN, U32_BYTES])
+            applied_storage.apply(["clave1", "clave2"], [["valor1", 1], ["valor2", 2]])
+            applied_storage.apply([key for key, _ in operations[2:]], [values for _, values in operations[2:]])
+
+            self.assertEqual(applied_file.getvalue(), file.getvalue())
+            self.assertEqual(applied_storage.key_pos, storage.key_pos)
+            self.assertEqual(applied_storage.next_pos, 2)
+            self.assertEqual(applied_storage.get_all_entries(), {"clave2": ["valor6", 6], "clave4": ["valor4", 4]})
+
+        def test_interrupted_apply_keeps_entries_not_applied(self):
+            keys = ["clave1", "clave2", "clave3", "clave4", "clave5"]
+            file = BytesIO(b"")
+            storage = KeyValueStorage(file, str, FIXED_STR_LEN, [str, int], [FIXED_STR_LEN, U32_BYTES])
+            storage.apply(keys, [["valor" + key[-1], int(key[-1])] for key in keys])
+
+            write_at = storage.write_at
+            def write_once(offset, byte_array):
+                storage.write_at = None
+                write_at(offset, byte_array)
+            storage.write_at = write_once
+            with self.assertRaises(TypeError):
+                storage.apply(["clave1", "clave3"], [None, ["valor6", 6]])
+
+            storage = KeyValueStorage(file, str, FIXED_STR_LEN, [str, int], [FIXED_STR_LEN, U32_BYTES])
+            entries = storage.get_all_entries()
+            self.assertEqual(entries, {"clave2": ["valor2", 2], "clave3": ["valor3", 3], "clave4": ["valor4", 4], "clave5": ["valor5", 5]})
+            self.assertEqual(storage.key_pos[FixedStr("clave5", FIXED_STR_LEN)], 0)
+            self.assertEqual(len(file.getvalue()), 4 * storage.entry_byte_size)
+
+        def test_load_rewrites_misplaced_entries(self):
+            initial_bytes = self.str_to_bytes("clave1")
+            initial_bytes.extend(self.str_to_bytes("valor1"))
+            initial_bytes.extend([0,0,0,1])
+            initial_bytes.extend(CROSS_OUT_BYTE * FIXED_STR_LEN)
+            initial_bytes.extend(self.str_to_bytes("valor2"))
+            initial_bytes.extend([0,0,0,2])
+            initial_bytes.extend(self.str_to_bytes("clave3"))
+            initial_bytes.extend(self.str_to_bytes("valor3"))
+            initial_bytes.extend([0,0,0,3])
+            file = BytesIO(initial_bytes)
+            storage = KeyValueStorage(file, str, FIXED_STR_LEN, [str, int], [FIXED_STR_LEN, U32_BYTES])
+            storage.get_all_entries()
+            storage.store("clave3", ["valor4", 4])
+
+            storage = KeyValueStorage(file, str, FIXED_STR_LEN, [str, int], [FIXED_STR_LEN, U32_BYTES])
+            self.assertEqual(storage.get_all_entries(), {"clave1": ["valor1", 1], "clave3": ["valor4", 4]})
+            self.assertEqual(len(file.getvalue()), 2 * storage.entry_byte_size)
+
+        def test_mmap_storage_same_layout_as_file_storage(self):
+            with tempfile.TemporaryDirectory() as directory:
+                storages = []
+                for storage_class in [KeyValueStorage, MmapKeyValueStorage]:
+                    storage = storage_class.new(os.path.join(directory, storage_class.__name__), str, 8, [int, (list, int)], [U32_BYTES, 3])
+                    storage.store("clave1", [1, [1]])
+                    storage.store_all(["clave2", "clave3"], [[2, [2, 2]], [3, [3, 3, 3]]])
+                    storage.remove("clave1")
+                    storage.store("clave2", [4, []])
+                    storage.close()
+                    storages.append(storage)
+                file_bytes = []
+                for storage in storages:
+                    with open(storage.file.name, 'rb') as file:
+                        file_bytes.append(file.read())
+                self.assertEqual(file_bytes[0], file_bytes[1])
+
+                storage = MmapKeyValueStorage.new(storages[0].file.name, str, 8, [int, (list, int)], [U32_BYTES, 3])
+                self.assertEqual(storage.get_all_entries(), {"clave2": [4, []], "clave3": [3, [3, 3, 3]]})
+                self.assertEqual(storage.next_pos, 2)
+                storage.close()
+
+        def test_mmap_storage_removes_partial_entry(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "storage")
+                storage = MmapKeyValueStorage.new(path, str, 8, [int], [U32_BYTES])
+                storage.store("clave1", [1])
+                storage.close()
+                with open(path, 'ab') as file:
+                    file.write(b"clave2")
+                storage = MmapKeyValueStorage.new(path, str, 8, [int], [U32_BYTES])
+                self.assertEqual(storage.get_all_entries(), {"clave1": 1})
+                self.assertEqual(storage.size(), storage.entry_byte_size)
+                storage.remove("clave1")
+                self.assertEqual(storage.size(), 0)
+                storage.store("clave3", [3])
+                self.assertEqual(storage.get_all_entries(), {"clave3": 3})
+                storage.delete()
+                self.assertFalse(os.path.exists(path))
+
         def test(self):
             i = 3
             storage = KeyValueStorage.new("./Persistance/client_context0_S" + str(i) + ".bin", str, 2**i, [(list, int)], [10])
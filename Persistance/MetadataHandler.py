@@ -67,11 +67,11 @@ class MetadataHandler():
         old_values = [None, log_last_client]
 
         self.logger.log(ChangingFile(self.filename, keys, old_values))
-        self.storage.store_all(keys, values)
+        self.storage.apply(keys, values)
 
         self.log_last_client = client_id
 
-    def dump_metadata_to_disk(self, last_received_batch, pending_eof, received_batch=None):
+    def seq_num_entries(self):
         keys = []
         old_entries = []
         new_entries = []
@@ -82,24 +82,69 @@ class MetadataHandler():
             else:
                 old_entries.append([self.log_seq_num])
             new_entries.append([SeqNumGenerator.seq_num])
+        return keys, old_entries, new_entries
+
+    def add_received_batch_entries(self, keys, old_entries, new_entries, last_received_batch, received_batch):
+        keys.append(LAST_RECEIVED_FROM + str(received_batch.sender_id))
+        old_batch_seq_num = last_received_batch.get(received_batch.sender_id, None)
+        if old_batch_seq_num != None:
+            old_batch_seq_num = [old_batch_seq_num]
+        old_entries.append(old_batch_seq_num)
+        new_entries.append([received_batch.seq_num])
+
+    def log_entries(self, keys, old_entries, new_entries):
+        """
+        Logs the change of the entries without commiting it.
+        Returns the writes to apply once the log is commited
+        """
+        if len(keys) == 0:
+            return []
+        self.logger.log(ChangingFile(self.filename, keys, old_entries), commit=False)
+        self.log_seq_num = SeqNumGenerator.seq_num
+        return [(self.storage, keys, new_entries)]
+
+    def delta_entries(self, keys, old_entries, new_entries):
+        """
+        Returns the delta of the change of the entries, logged with their new values instead of the old ones
+        """
+        self.log_seq_num = SeqNumGenerator.seq_num
+        return (self.filename, keys, new_entries)
+
+    def store_entries(self, keys, old_entries, new_entries):
+        if len(keys) == 0:
+            return
+        self.log_entries(keys, old_entries, new_entries)
+        self.logger.commit()
+        self.storage.apply(keys, new_entries)
+
+    def metadata_entries(self, last_received_batch, pending_eof, received_batch=None):
+        keys, old_entries, new_entries = self.seq_num_entries()
 
         if received_batch:
-            keys.append(LAST_RECEIVED_FROM + str(received_batch.sender_id))
-            old_batch_seq_num = last_received_batch.get(received_batch.sender_id, None)
-            if old_batch_seq_num != None:
-                old_batch_seq_num = [old_batch_seq_num]
-            old_entries.append(old_batch_seq_num)
-            new_entries.append([received_batch.seq_num])
+            self.add_received_batch_entries(keys, old_entries, new_entries, last_received_batch, received_batch)
 
             if received_batch.is_empty():
                 keys.append(CLIENT_PENDING_EOF + str(received_batch.client_id))
                 old_entries.append([pending_eof[received_batch.client_id] + 1])
                 new_entries.append([pending_eof[received_batch.client_id]])
-        
-        if len(keys) > 0:
-            self.logger.log(ChangingFile(self.filename, keys, old_entries))
-            self.log_seq_num = SeqNumGenerator.seq_num
-            self.storage.store_all(keys, new_entries)
+        return keys, old_entries, new_entries
+
+    def dump_metadata_to_disk(self, last_received_batch, pending_eof, received_batch=None):
+        self.store_entries(*self.metadata_entries(last_received_batch, pending_eof, received_batch))
+
+    def group_metadata_entries(self, last_received_batch, pending_eof, received_batches, previous_pending_eof):
+        """
+        Entries of the metadata of a group of batchs, that must come from different senders.
+        previous_pending_eof has the pending eof before the group of each client that received an eof in it
+        """
+        keys, old_entries, new_entries = self.seq_num_entries()
+        for received_batch in received_batches:
+            self.add_received_batch_entries(keys, old_entries, new_entries, last_received_batch, received_batch)
+        for client_id, previous_client_pending_eof in previous_pending_eof.items():
+            keys.append(CLIENT_PENDING_EOF + str(client_id))
+            old_entries.append([previous_client_pending_eof])
+            new_entries.append([pending_eof[client_id]])
+        return keys, old_entries, new_entries
 
     def close(self):
         self.storage.close()
@@ -0,0 +1,463 @@
+import os
+import struct
+from threading import Thread
+from Persistance.storage_errors import *
+from Persistance.log import sync_file
+import io
+
+STARTING_FILE_POS = io.SEEK_SET
+LAST_FILE_POS = io.SEEK_END
+
+# Every record is its header, its key and its values
+# header: state, length of the key, capacity for the values and length of the values
+RECORD_HEADER = struct.Struct('>BHII')
+# A dead record removes its key. Records that were updated in place before the storage 
+# was append only have unused capacity after their values
+DEAD_RECORD = 0
+LIVE_RECORD = 1
+RECORD_STATES = [DEAD_RECORD, LIVE_RECORD]
+
+# Compaction rewrites the live records once this ratio of the file is garbage
+GARBAGE_RATIO = 0.5
+MIN_COMPACTION_BYTES = 2**20
+COMPACTION_SUFFIX = '.compacting'
+
+STR_LENGTH = struct.Struct('>H')
+LIST_LENGTH = struct.Struct('>B')
+LIST_NUMBER = struct.Struct('>I')
+INT_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+FLOAT_FORMATS = {4: 'f', 8: 'd'}
+
+class ValueCodec():
+    """
+    Encodes and decodes the values of a record. Strings and lists only take the bytes they use,
+    lists are truncated to their size as in KeyValueStorage
+    """
+    def __init__(self, value_types, values_sizes):
+        self.value_types = value_types
+        self.value_sizes = values_sizes
+        self.structs = []
+        for value_type, value_size in zip(value_types, values_sizes):
+            if value_type == int:
+                self.structs.append(struct.Struct('>' + INT_FORMATS[value_size]))
+            elif value_type == float:
+                self.structs.append(struct.Struct('>' + FLOAT_FORMATS[value_size]))
+            elif value_type == str or value_type == (list, int):
+                self.structs.append(None)
+            else:
+                raise UnsupportedType(f"{value_type} not supported")
+
+    def encode(self, values):
+        if len(values) != len(self.value_types):
+            raise KeysMustBeEqualToValuesOr0
+        byte_array = bytearray()
+        for value, value_type, value_size, value_struct in zip(values, self.value_types, self.value_sizes, self.structs):
+            if type(value) != value_type and not (value_type == (list, int) and type(value) == list):
+                raise TypeDoesNotMatchSetType
+            if value_type == str:
+                value_bytes = value.encode()
+                byte_array.extend(STR_LENGTH.pack(len(value_bytes)))
+                byte_array.extend(value_bytes)
+            elif value_type == (list, int):
+                numbers = value[:value_size]
+                byte_array.extend(LIST_LENGTH.pack(len(numbers)))
+                byte_array.extend(struct.pack(f'>{len(numbers)}I', *numbers))
+            else:
+                byte_array.extend(value_struct.pack(value))
+        return byte_array
+
+    def decode(self, buffer, offset):
+        values = []
+        for value_type, value_struct in zip(self.value_types, self.structs):
+            if value_type == str:
+                length = STR_LENGTH.unpack_from(buffer, offset)[0]
+                offset += STR_LENGTH.size
+                values.append(str(buffer[offset:offset + length], 'utf-8'))
+                offset += length
+            elif value_type == (list, int):
+                length = LIST_LENGTH.unpack_from(buffer, offset)[0]
+                offset += LIST_LENGTH.size
+                values.append(list(struct.unpack_from(f'>{length}I', buffer, offset)))
+                offset += length * LIST_NUMBER.size
+            else:
+                values.append(value_struct.unpack_from(buffer, offset)[0])
+                offset += value_struct.size
+        return values
+
+def scan_records(buffer):
+    """
+    Yields the offset, end, state, key and values offset of every complete record in buffer.
+    Stops at the first incomplete or invalid one
+    """
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(buffer):
+        state, key_len, capacity, values_len = RECORD_HEADER.unpack_from(buffer, offset)
+        key_start = offset + RECORD_HEADER.size
+        end = key_start + key_len + capacity
+        if state not in RECORD_STATES or values_len > capacity or end > len(buffer):
+            return
+        yield offset, end, state, str(buffer[key_start:key_start + key_len], 'utf-8'), key_start + key_len
+        offset = end
+
+def sync_directory(path):
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+class Compaction(Thread):
+    """
+    Writes the live records of the first end bytes of a storage file to a new file,
+    in the background. Appended records are immutable, so it does not block new appends
+    """
+    def __init__(self, path, index, end):
+        super().__init__(daemon=True)
+        self.path = path
+        self.compacted_path = path + COMPACTION_SUFFIX
+        self.index = index
+        self.end = end
+        self.new_offsets = {}
+        self.compacted_size = 0
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.path, 'rb') as file:
+                buffer = file.read(self.end)
+            with open(self.compacted_path, 'wb') as compacted_file:
+                for key, (offset, size) in sorted(self.index.items(), key=lambda item: item[1][0]):
+                    self.new_offsets[key] = compacted_file.tell()
+                    compacted_file.write(buffer[offset:offset + size])
+                self.compacted_size = compacted_file.tell()
+                sync_file(compacted_file)
+        except OSError as e:
+            self.error = e
+
+    def discard(self):
+        if self.ident != None:
+            self.join()
+        try:
+            os.remove(self.compacted_path)
+        except FileNotFoundError:
+            pass
+
+class RecordStorage():
+    """
+    Append only storage of string keys with values of any length, in a single file with an
+    in memory index of the offset of each live record. Every store appends the record and every
+    removal appends a dead record. Once the garbage exceeds GARBAGE_RATIO of the file, a compaction 
+    thread writes the live records to a new file, which replaces the old one with the records 
+    appended meanwhile copied after them
+    """
+    def __init__(self, file, value_types, values_fixed_size):
+        self.file = file
+        self.codec = ValueCodec(value_types, values_fixed_size)
+        self.index = {} # {key: (offset, size of the record)}
+        self.end = 0
+        self.dead_bytes = 0
+        self.compaction = None
+        self.compact_in_background = True
+        self.min_compaction_bytes = MIN_COMPACTION_BYTES
+
+    @classmethod
+    def new(cls, path, key_type, fixed_key_size, value_types, values_fixed_size):
+        """
+        Takes the same arguments as KeyValueStorage.new, keys must be strings and
+        their size is not used
+        """
+        if key_type != str or type(value_types) != list or type(values_fixed_size) != list:
+            return None
+        try:
+            # A compaction that did not finish is discarded, the storage file is still complete
+            os.remove(path + COMPACTION_SUFFIX)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error Removing Compaction: {e}")
+        try:
+            file = open(path, 'rb+')
+        except FileNotFoundError:
+            file = open(path, 'wb+')
+        except OSError as e:
+            print(f"Error Opening Storage: {e}")
+            return None
+        try:
+            return cls(file, value_types, values_fixed_size)
+        except UnsupportedType as e:
+            print(f"Error Opening Storage: {e}")
+            file.close()
+            return None
+
+    def record_bytes(self, key_bytes, values_bytes, state=LIVE_RECORD):
+        byte_array = bytearray(RECORD_HEADER.pack(state, len(key_bytes), len(values_bytes), len(values_bytes)))
+        byte_array.extend(key_bytes)
+        byte_array.extend(values_bytes)
+        return byte_array
+
+    def get_all_entries(self):
+        """
+        Replays all the records. Removes a record that was being appended when the process stopped
+        """
+        self.file.seek(0, STARTING_FILE_POS)
+        buffer = memoryview(self.file.read())
+        all_entries = {}
+        self.index = {}
+        self.dead_bytes = 0
+        self.end = 0
+        for offset, end, state, key, values_offset in scan_records(buffer):
+            if key in self.index:
+                self.dead_bytes += self.index[key][1]
+            if state == DEAD_RECORD:
+                self.index.pop(key, None)
+                all_entries.pop(key, None)
+                self.dead_bytes += end - offset
+            else:
+                values = self.codec.decode(buffer, values_offset)
+                all_entries[key] = values[0] if len(values) == 1 else values
+                self.index[key] = (offset, end - offset)
+            self.end = end
+        size = len(buffer)
+        buffer.release()
+
+        if self.end < size:
+            self.file.truncate(self.end)
+            self.sync()
+        return all_entries
+
+    def apply(self, keys, list_of_values):
+        """
+        Appends a record for each key with its values, or a dead one if its values are None, 
+        with a single write and sync
+        """
+        self.finish_compaction_if_done()
+        byte_array = bytearray()
+        for key, values in zip(keys, list_of_values):
+            if type(key) != str:
+                raise TypeDoesNotMatchSetType
+            previous_record = self.index.pop(key, None)
+            if values == None:
+                if previous_record == None:
+                    continue
+                record = self.record_bytes(key.encode(), b"", DEAD_RECORD)
+                self.dead_bytes += len(record)
+            else:
+                record = self.record_bytes(key.encode(), self.codec.encode(values))
+                self.index[key] = (self.end + len(byte_array), len(record))
+            if previous_record != None:
+                self.dead_bytes += previous_record[1]
+            byte_array.extend(record)
+
+        if len(byte_array) > 0:
+            self.file.seek(self.end, STARTING_FILE_POS)
+            self.file.write(byte_array)
+            self.end += len(byte_array)
+        self.sync()
+        if self.needs_compaction():
+            self.start_compaction()
+
+    def needs_compaction(self):
+        return self.compaction == None and self.end >= self.min_compaction_bytes and self.dead_bytes > self.end * GARBAGE_RATIO
+
+    def start_compaction(self):
+        self.compaction = Compaction(self.file.name, dict(self.index), self.end)
+        self.compaction.dead_bytes = self.dead_bytes
+        if self.compact_in_background:
+            self.compaction.start()
+        else:
+            self.compaction.run()
+            self.finish_compaction()
+
+    def finish_compaction_if_done(self):
+        if self.compaction != None and not self.compaction.is_alive():
+            self.finish_compaction()
+
+    def finish_compaction(self):
+        """
+        Appends the records written since the compaction started to the compacted file and 
+        replaces the storage file with it. Replaying them again is harmless if it was already replaced
+        """
+        compaction = self.compaction
+        self.compaction = None
+        if compaction.error != None:
+            print(f"Error Compacting Storage: {compaction.error}")
+            compaction.discard()
+            return
+        try:
+            self.file.seek(compaction.end, STARTING_FILE_POS)
+            appended_records = self.file.read(self.end - compaction.end)
+            with open(compaction.compacted_path, 'ab') as compacted_file:
+                compacted_file.write(appended_records)
+                sync_file(compacted_file)
+            os.replace(compaction.compacted_path, self.file.name)
+            sync_directory(self.file.name)
+        except OSError as e:
+            print(f"Error Compacting Storage: {e}")
+            compaction.discard()
+            return
+
+        path = self.file.name
+        self.file.close()
+        self.file = open(path, 'rb+')
+        shift = compaction.compacted_size - compaction.end
+        for key, (offset, size) in self.index.items():
+            if offset >= compaction.end:
+                self.index[key] = (offset + shift, size)
+            else:
+                self.index[key] = (compaction.new_offsets[key], size)
+        self.end += shift
+        self.dead_bytes -= compaction.dead_bytes
+
+    def store_all(self, keys, list_of_values):
+        self.apply(keys, list_of_values)
+
+    def store(self, key, values):
+        self.apply([key], [values])
+
+    def remove(self, key):
+        self.apply([key], [None])
+
+    def sync(self):
+        sync_file(self.file)
+
+    def close(self):
+        if self.compaction != None:
+            self.compaction.join()
+            self.finish_compaction()
+        self.file.close()
+
+    def delete(self):
+        if self.compaction != None:
+            self.compaction.discard()
+            self.compaction = None
+        self.close()
+        filename = self.file.name
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        except:
+            print("Could not remove ", filename)
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+    from io import BytesIO
+    import tempfile
+
+    class TestRecordStorage(TestCase):
+        def new_storage(self, file, value_types=[str, int, float], values_sizes=[0, 4, 4]):
+            return RecordStorage(file, value_types, values_sizes)
+
+        def test_store_and_load(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file)
+            storage.apply(["titulo", "título largo"], [["autor", 1, 1.5], ["autores", 2, 2.5]])
+            self.assertEqual(self.new_storage(file).get_all_entries(), {"titulo": ["autor", 1, 1.5], "título largo": ["autores", 2, 2.5]})
+
+        def test_records_only_take_their_length(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file)
+            storage.apply(["titulo"], [["autor", 1, 1.5]])
+            self.assertEqual(len(file.getvalue()), RECORD_HEADER.size + len("titulo") + STR_LENGTH.size + len("autor") + 8)
+
+        def test_updates_are_appended(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file, [int, float], [4, 4])
+            storage.apply(["a", "b"], [[1, 1.5], [2, 2.5]])
+            size = len(file.getvalue())
+            storage.apply(["a"], [[3, 3.5]])
+            self.assertEqual(len(file.getvalue()), size + size // 2)
+            self.assertEqual(storage.dead_bytes, size // 2)
+            loaded = self.new_storage(file, [int, float], [4, 4])
+            self.assertEqual(loaded.get_all_entries(), {"a": [3, 3.5], "b": [2, 2.5]})
+            self.assertEqual(loaded.dead_bytes, storage.dead_bytes)
+            self.assertEqual(loaded.index, storage.index)
+
+        def test_lists_are_truncated_to_their_size(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file, [(list, int)], [3])
+            storage.apply(["autor"], [[[1990, 2000, 2010, 2020]]])
+            self.assertEqual(self.new_storage(file, [(list, int)], [3]).get_all_entries(), {"autor": [1990, 2000, 2010]})
+
+        def test_remove(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file, [], [])
+            storage.apply(["a", "b", "c"], [[], [], []])
+            storage.apply(["b", "d"], [None, None])
+            storage.apply(["b"], [[]])
+            storage.apply(["a"], [None])
+            self.assertEqual(self.new_storage(file, [], []).get_all_entries(), {"b": [], "c": []})
+
+        def test_store_and_remove_in_same_apply(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file, [int, float], [4, 4])
+            storage.apply(["a", "b", "a"], [[1, 1.0], [2, 2.0], None])
+            self.assertEqual(self.new_storage(file, [int, float], [4, 4]).get_all_entries(), {"b": [2, 2.0]})
+
+        def test_partial_record_is_removed(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file)
+            storage.apply(["titulo"], [["autor", 1, 1.5]])
+            size = len(file.getvalue())
+            file.seek(0, LAST_FILE_POS)
+            file.write(storage.record_bytes("otro".encode(), bytes(10))[:12])
+            loaded = self.new_storage(file)
+            self.assertEqual(loaded.get_all_entries(), {"titulo": ["autor", 1, 1.5]})
+            self.assertEqual(len(file.getvalue()), size)
+
+        def test_records_updated_in_place_are_loaded(self):
+            file = BytesIO(b"")
+            storage = self.new_storage(file, [(list, int)], [3])
+            record = bytearray(RECORD_HEADER.pack(LIVE_RECORD, len("autor"), 13, 5))
+            record.extend("autor".encode() + storage.codec.encode([[1990]]) + bytes(8))
+            file.write(bytes(record) + storage.record_bytes("autor".encode(), b"", DEAD_RECORD) + record)
+            self.assertEqual(storage.get_all_entries(), {"autor": [1990]})
+
+        def test_compaction(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "storage")
+                storage = RecordStorage.new(path, str, 0, [int, float], [4, 4])
+                storage.compact_in_background = False
+                storage.min_compaction_bytes = 0
+                storage.apply(["a", "b", "c"], [[1, 1.0], [2, 2.0], [3, 3.0]])
+                storage.apply(["a", "b"], [[4, 4.0], None])
+                self.assertEqual(storage.dead_bytes, 0)
+                storage.apply(["d"], [[5, 5.0]])
+                storage.close()
+                storage = RecordStorage.new(path, str, 0, [int, float], [4, 4])
+                self.assertEqual(storage.get_all_entries(), {"a": [4, 4.0], "c": [3, 3.0], "d": [5, 5.0]})
+                self.assertEqual(os.path.getsize(path), storage.end)
+                self.assertEqual(storage.end, 3 * (RECORD_HEADER.size + 1 + 8))
+                storage.delete()
+                self.assertEqual(os.listdir(directory), [])
+
+        def test_records_appended_during_compaction_are_kept(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "storage")
+                storage = RecordStorage.new(path, str, 0, [int, float], [4, 4])
+                storage.apply(["a", "b", "c"], [[1, 1.0], [2, 2.0], [3, 3.0]])
+                storage.apply(["a", "b"], [[4, 4.0], None])
+                storage.compaction = Compaction(path, dict(storage.index), storage.end)
+                storage.compaction.dead_bytes = storage.dead_bytes
+                storage.compaction.run()
+                storage.apply(["c", "e"], [[6, 6.0], [7, 7.0]])
+                self.assertEqual(storage.compaction, None)
+                storage.apply(["a"], [None])
+                self.assertEqual(storage.get_all_entries(), {"c": [6, 6.0], "e": [7, 7.0]})
+                storage.close()
+
+        def test_unfinished_compaction_is_discarded(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "storage")
+                storage = RecordStorage.new(path, str, 0, [int, float], [4, 4])
+                storage.apply(["a"], [[1, 1.0]])
+                storage.close()
+                with open(path + COMPACTION_SUFFIX, 'wb') as file:
+                    file.write(b"partial")
+                storage = RecordStorage.new(path, str, 0, [int, float], [4, 4])
+                self.assertEqual(storage.get_all_entries(), {"a": [1, 1.0]})
+                self.assertFalse(os.path.exists(path + COMPACTION_SUFFIX))
+                storage.close()
+
+    unittest.main()
@@ -0,0 +1,335 @@
+import os
+import sys
+import struct
+from array import array
+from itertools import accumulate, chain
+from Persistance.storage_errors import *
+from Persistance.log import sync_file
+from Persistance.RecordStorage import sync_directory
+
+# header: magic, amount of entries and amount of values of each entry
+SNAPSHOT_HEADER = struct.Struct('>4sII')
+SNAPSHOT_MAGIC = b'CTXS'
+SNAPSHOT_EXTENSION = '.snapshot'
+SNAPSHOT_TEMP_SUFFIX = '.writing'
+COLUMN_LENGTH = struct.Struct('>I')
+STR_LENGTHS_TYPECODE = 'I'
+LIST_LENGTHS_TYPECODE = 'B'
+LIST_NUMBERS_TYPECODE = 'I'
+FLOAT_TYPECODES = {4: 'f', 8: 'd'}
+# Arrays are written big endian, as the rest of the storages
+SWAP_BYTES = sys.byteorder == 'little'
+
+def int_typecode(size):
+    for typecode in 'BHILQ':
+        if array(typecode).itemsize == size:
+            return typecode
+    raise UnsupportedType(f"int of {size} bytes not supported")
+
+class ColumnReader():
+    """
+    Reads the columns of a snapshot from a buffer, raising InvalidFile if it is truncated
+    """
+    def __init__(self, buffer, offset):
+        self.buffer = buffer
+        self.offset = offset
+
+    def take(self, amount_of_bytes):
+        end = self.offset + amount_of_bytes
+        if end > len(self.buffer):
+            raise InvalidFile
+        taken = self.buffer[self.offset:end]
+        self.offset = end
+        return taken
+
+    def numbers(self, typecode, amount):
+        numbers = array(typecode)
+        numbers.frombytes(self.take(amount * numbers.itemsize))
+        if SWAP_BYTES:
+            numbers.byteswap()
+        return numbers
+
+    def strings(self, amount):
+        lengths = self.numbers(STR_LENGTHS_TYPECODE, amount)
+        text_len = COLUMN_LENGTH.unpack(self.take(COLUMN_LENGTH.size))[0]
+        text = str(self.take(text_len), 'utf-8')
+        ends = list(accumulate(lengths))
+        return [text[end - length:end] for end, length in zip(ends, lengths)]
+
+    def lists(self, amount):
+        lengths = self.numbers(LIST_LENGTHS_TYPECODE, amount)
+        numbers = self.numbers(LIST_NUMBERS_TYPECODE, sum(lengths)).tolist()
+        ends = list(accumulate(lengths))
+        return [tuple(numbers[end - length:end]) for end, length in zip(ends, lengths)]
+
+def numbers_bytes(typecode, numbers):
+    numbers = array(typecode, numbers)
+    if SWAP_BYTES:
+        numbers.byteswap()
+    return numbers.tobytes()
+
+def strings_bytes(strings):
+    text_bytes = ''.join(strings).encode()
+    byte_array = bytearray(numbers_bytes(STR_LENGTHS_TYPECODE, map(len, strings)))
+    byte_array.extend(COLUMN_LENGTH.pack(len(text_bytes)))
+    byte_array.extend(text_bytes)
+    return byte_array
+
+def lists_bytes(lists):
+    byte_array = bytearray(numbers_bytes(LIST_LENGTHS_TYPECODE, map(len, lists)))
+    byte_array.extend(numbers_bytes(LIST_NUMBERS_TYPECODE, chain.from_iterable(lists)))
+    return byte_array
+
+class SnapshotStorage():
+    """
+    Storage of string keys that keeps all its entries in memory and writes them as a whole
+    to a columnar snapshot: the keys as a string table, and the values of each type as an array.
+    It loads in bulk without decoding entry by entry, but every change rewrites the snapshot,
+    so it is meant to be written on checkpoints. A snapshot is written to a temporary file that
+    replaces the previous one, so a snapshot is never partially written
+    """
+    def __init__(self, path, value_types, values_fixed_size):
+        self.path = path
+        self.value_types = value_types
+        self.value_sizes = values_fixed_size
+        self.typecodes = []
+        for value_type, value_size in zip(value_types, values_fixed_size):
+            if value_type == int:
+                self.typecodes.append(int_typecode(value_size))
+            elif value_type == float:
+                if value_size not in FLOAT_TYPECODES:
+                    raise UnsupportedType(f"float of {value_size} bytes not supported")
+                self.typecodes.append(FLOAT_TYPECODES[value_size])
+            elif value_type == str or value_type == (list, int):
+                self.typecodes.append(None)
+            else:
+                raise UnsupportedType(f"{value_type} not supported")
+        self.entries = {} # {key: tuple of values}
+        # The loaded keys and columns, that become the entries on the first change
+        self.loaded_columns = None
+
+    @classmethod
+    def new(cls, path, key_type, fixed_key_size, value_types, values_fixed_size):
+        """
+        Takes the same arguments as KeyValueStorage.new, keys must be strings and
+        their size is not used
+        """
+        if key_type != str or type(value_types) != list or type(values_fixed_size) != list:
+            return None
+        try:
+            # A snapshot that was not finished is discarded, the previous one is still complete
+            os.remove(path + SNAPSHOT_TEMP_SUFFIX)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error Removing Snapshot: {e}")
+        try:
+            return cls(path, value_types, values_fixed_size)
+        except UnsupportedType as e:
+            print(f"Error Opening Storage: {e}")
+            return None
+
+    def read_columns(self, buffer):
+        magic, amount_of_entries, amount_of_values = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC or amount_of_values != len(self.value_types):
+            raise InvalidFile
+        reader = ColumnReader(buffer, SNAPSHOT_HEADER.size)
+        keys = reader.strings(amount_of_entries)
+        columns = []
+        for value_type, typecode in zip(self.value_types, self.typecodes):
+            if value_type == str:
+                columns.append(reader.strings(amount_of_entries))
+            elif value_type == (list, int):
+                columns.append(reader.lists(amount_of_entries))
+            else:
+                columns.append(reader.numbers(typecode, amount_of_entries).tolist())
+        return keys, columns
+
+    def get_all_entries(self):
+        """
+        Loads the snapshot. Returns None if it is not a valid one
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                buffer = file.read()
+        except FileNotFoundError:
+            buffer = b""
+        except OSError as e:
+            print(f"Error Reading Snapshot: {e}")
+            return None
+        self.entries = {}
+        self.loaded_columns = None
+        if len(buffer) == 0:
+            return {}
+        try:
+            keys, columns = self.read_columns(memoryview(buffer))
+        except (InvalidFile, struct.error, UnicodeDecodeError):
+            print(f"Invalid Snapshot: {self.path}")
+            return None
+
+        self.loaded_columns = (keys, columns)
+        columns = list(columns)
+        for i, value_type in enumerate(self.value_types):
+            if value_type == (list, int):
+                columns[i] = [list(numbers) for numbers in columns[i]]
+        if len(columns) == 0:
+            return {key: [] for key in keys}
+        if len(columns) == 1:
+            return dict(zip(keys, columns[0]))
+        return dict(zip(keys, map(list, zip(*columns))))
+
+    def _convert_values(self, values):
+        if len(values) != len(self.value_types):
+            raise KeysMustBeEqualToValuesOr0
+        converted_values = []
+        for value, value_type, value_size in zip(values, self.value_types, self.value_sizes):
+            if value_type == (list, int):
+                if type(value) not in (list, tuple):
+                    raise TypeDoesNotMatchSetType
+                value = tuple(value[:value_size])
+            elif type(value) != value_type:
+                raise TypeDoesNotMatchSetType
+            converted_values.append(value)
+        return tuple(converted_values)
+
+    def load_entries(self):
+        if self.loaded_columns == None:
+            return
+        keys, columns = self.loaded_columns
+        self.loaded_columns = None
+        if len(columns) == 0:
+            self.entries = dict.fromkeys(keys, ())
+        else:
+            self.entries = dict(zip(keys, zip(*columns)))
+
+    def snapshot_bytes(self):
+        byte_array = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(self.entries), len(self.value_types)))
+        byte_array.extend(strings_bytes(list(self.entries.keys())))
+        columns = list(zip(*self.entries.values())) if len(self.entries) > 0 else [()] * len(self.value_types)
+        for column, value_type, typecode in zip(columns, self.value_types, self.typecodes):
+            if value_type == str:
+                byte_array.extend(strings_bytes(column))
+            elif value_type == (list, int):
+                byte_array.extend(lists_bytes(column))
+            else:
+                byte_array.extend(numbers_bytes(typecode, column))
+        return byte_array
+
+    def write_snapshot(self):
+        temp_path = self.path + SNAPSHOT_TEMP_SUFFIX
+        with open(temp_path, 'wb') as file:
+            file.write(self.snapshot_bytes())
+            sync_file(file)
+        os.replace(temp_path, self.path)
+        sync_directory(self.path)
+
+    def apply(self, keys, list_of_values):
+        """
+        Stores each key with its values, or removes it if its values are None, and writes the snapshot
+        """
+        self.load_entries()
+        for key, values in zip(keys, list_of_values):
+            if type(key) != str:
+                raise TypeDoesNotMatchSetType
+            if values == None:
+                self.entries.pop(key, None)
+            else:
+                self.entries[key] = self._convert_values(values)
+        self.write_snapshot()
+
+    def store_all(self, keys, list_of_values):
+        self.apply(keys, list_of_values)
+
+    def store(self, key, values):
+        self.apply([key], [values])
+
+    def remove(self, key):
+        self.apply([key], [None])
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+    def delete(self):
+        self.entries = {}
+        self.loaded_columns = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except:
+            print("Could not remove ", self.path)
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+    import tempfile
+
+    class TestSnapshotStorage(TestCase):
+        def setUp(self):
+            self.directory = tempfile.TemporaryDirectory()
+            self.path = os.path.join(self.directory.name, 'context' + SNAPSHOT_EXTENSION)
+
+        def tearDown(self):
+            self.directory.cleanup()
+
+        def new_storage(self, value_types=[int, float, str], values_sizes=[4, 4, 0]):
+            return SnapshotStorage.new(self.path, str, 0, value_types, values_sizes)
+
+        def test_store_and_load(self):
+            storage = self.new_storage()
+            storage.apply(["a", "ñandú"], [[1, 1.5, "autor;otro"], [2, 2.5, ""]])
+            self.assertEqual(self.new_storage().get_all_entries(), {"a": [1, 1.5, "autor;otro"], "ñandú": [2, 2.5, ""]})
+
+        def test_single_value_entries_are_not_lists(self):
+            storage = self.new_storage([float], [4])
+            storage.apply(["a", "b"], [[1.5], [0.25]])
+            self.assertEqual(self.new_storage([float], [4]).get_all_entries(), {"a": 1.5, "b": 0.25})
+
+        def test_keys_without_values(self):
+            storage = self.new_storage([], [])
+            storage.apply(["a", "b"], [[], []])
+            self.assertEqual(self.new_storage([], []).get_all_entries(), {"a": [], "b": []})
+
+        def test_lists_are_truncated_to_their_size(self):
+            storage = self.new_storage([(list, int)], [3])
+            storage.apply(["a", "b"], [[[1970, 1980, 1990, 2000]], [[]]])
+            self.assertEqual(self.new_storage([(list, int)], [3]).get_all_entries(), {"a": [1970, 1980, 1990], "b": []})
+
+        def test_remove(self):
+            storage = self.new_storage()
+            storage.apply(["a", "b"], [[1, 1.5, "x"], [2, 2.5, "y"]])
+            storage.apply(["a", "c"], [None, [3, 3.5, "z"]])
+            storage.remove("b")
+            self.assertEqual(self.new_storage().get_all_entries(), {"c": [3, 3.5, "z"]})
+
+        def test_loaded_entries_are_kept_on_apply(self):
+            self.new_storage().apply(["a"], [[1, 1.5, "x"]])
+            storage = self.new_storage()
+            storage.get_all_entries()
+            storage.apply(["b"], [[2, 2.5, "y"]])
+            self.assertEqual(self.new_storage().get_all_entries(), {"a": [1, 1.5, "x"], "b": [2, 2.5, "y"]})
+
+        def test_unfinished_snapshot_is_discarded(self):
+            self.new_storage().apply(["a"], [[1, 1.5, "x"]])
+            with open(self.path + SNAPSHOT_TEMP_SUFFIX, 'wb') as file:
+                file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 5, 3))
+            self.assertEqual(self.new_storage().get_all_entries(), {"a": [1, 1.5, "x"]})
+            self.assertFalse(os.path.exists(self.path + SNAPSHOT_TEMP_SUFFIX))
+
+        def test_truncated_snapshot_is_invalid(self):
+            self.new_storage().apply(["a", "b"], [[1, 1.5, "x"], [2, 2.5, "y"]])
+            with open(self.path, 'rb+') as file:
+                file.truncate(os.path.getsize(self.path) - 1)
+            self.assertEqual(self.new_storage().get_all_entries(), None)
+
+        def test_delete(self):
+            storage = self.new_storage()
+            storage.apply(["a"], [[1, 1.5, "x"]])
+            storage.delete()
+            self.assertFalse(os.path.exists(self.path))
+            self.assertEqual(self.new_storage().get_all_entries(), {})
+
+    unittest.main()
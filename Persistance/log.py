@@ -2,8 +2,9 @@ from abc import ABC, abstractmethod
 from enum import IntEnum
 import os
 import struct
+import zlib
 from Persistance.storage_errors import KeysMustBeEqualToValuesOr0, TooManyValues, UnsupportedType
-from utils.auxiliar_functions import integer_to_big_endian_byte_array, byte_array_to_big_endian_integer, remove_bytes
+from utils.auxiliar_functions import integer_to_big_endian_byte_array
 import io
 
 VALUES_TYPES_LEN = 1
@@ -25,10 +26,58 @@ NEW_ENTRY = 1
 
 END_OF_FILE_POS = io.SEEK_END
 CURRENT_FILE_POS = io.SEEK_CUR
+STARTING_FILE_POS = io.SEEK_SET
+
+# Every log is written as a record: header, log args and trailer
+# header: log type, length of the args and crc32 of the log type, length and args
+RECORD_HEADER = struct.Struct('>BII')
+# trailer: length of the args, to read the log backwards
+RECORD_TRAILER = struct.Struct('>I')
+RECORD_FRAMING_BYTES = RECORD_HEADER.size + RECORD_TRAILER.size
+CRC_PREFIX = struct.Struct('>BI')
+# Bytes the previous log format wrote after every log while writing it, to detect torn writes
+LEGACY_PREPARE_BYTE = 254
+LEGACY_COUNT_PREPARE_BYTE = 255
+NUMBER_FORMATS = {1: 'B', 2: 'H', 4: 'I'}
+
+def record_crc(log_type, args):
+    return zlib.crc32(args, zlib.crc32(CRC_PREFIX.pack(log_type, len(args))))
+
+def record_end(buffer, offset):
+    """
+    Returns the end of the record that starts at offset in buffer, or None 
+    if there is no complete and valid record there
+    """
+    if offset + RECORD_FRAMING_BYTES > len(buffer):
+        return None
+    log_type, args_len, crc = RECORD_HEADER.unpack_from(buffer, offset)
+    end = offset + RECORD_FRAMING_BYTES + args_len
+    if end > len(buffer):
+        return None
+    if RECORD_TRAILER.unpack_from(buffer, end - RECORD_TRAILER.size)[0] != args_len:
+        return None
+    args_start = offset + RECORD_HEADER.size
+    if record_crc(log_type, buffer[args_start:args_start + args_len]) != crc:
+        return None
+    return end
+
+def sync_file(file):
+    file.flush()
+    try:
+        fileno = file.fileno()
+    except io.UnsupportedOperation:
+        # In memory files have nothing to sync
+        return
+    os.fsync(fileno)
 
 class LogReadWriter():
+    """
+    Append only log. Logs are only durable after a commit, so several logs can share a single fsync
+    """
     def __init__(self, file):
         self.file = file
+        self.log_bytes = b""
+        self.position = 0
 
     @classmethod
     def new(cls, path):
@@ -39,60 +88,90 @@ class LogReadWriter():
         except OSError as e:
             print(f"Error Opening Log: {e}")
             return None
-        return LogReadWriter(file)
+        logger = LogReadWriter(file)
+        logger.convert_legacy_log()
+        return logger
+
+    def convert_legacy_log(self):
+        """
+        Rewrites a log written in the previous format, without records, in the current one.
+        Returns True if the log was converted
+        """
+        self.file.seek(0, STARTING_FILE_POS)
+        log_bytes = self.file.read()
+        if len(log_bytes) == 0 or record_end(log_bytes, 0) != None:
+            return False
+        logs = legacy_logs_from_bytes(log_bytes)
+        if logs == None:
+            return False
+        self.file.seek(0, STARTING_FILE_POS)
+        self.file.truncate(0)
+        for log in logs:
+            self.log(log, commit=False)
+        self.commit()
+        print(f"Converted {len(logs)} logs from the previous log format")
+        return True
 
-    def prepare_file_for_log(self, log_len):
+    def log(self, log, commit=True):
         self.file.seek(0, END_OF_FILE_POS)
-        self.file.write(LogType.Prepare.to_bytes() * log_len + LogType.CountPrepare.to_bytes() * log_len)
-        self.file.flush()
-
-    def remove_count_prepare(self, log_len):
-        size = self.file.seek(0, END_OF_FILE_POS)
-        self.file.truncate(max(0,size - log_len))
-        self.file.flush()
-
-    def log(self, log):
-        byte_array = log.get_log_bytes()
-
-        self.prepare_file_for_log(len(byte_array))
-
-        self.file.seek(-2*len(byte_array), END_OF_FILE_POS)
-        self.file.write(byte_array)
-        self.file.flush()
-        self.remove_count_prepare(len(byte_array))
-        os.fsync(self.file.fileno())
-
-    def handle_partial_logs(self, log):
-        i = 0
-        while log != None and log.log_type == LogType.CountPrepare:
-            log = Log.from_file_pos(self.file, CURRENT_FILE_POS)
-            i+=1
-        
-        i *= 2
-        self.file.seek(-i, END_OF_FILE_POS)
-        log = Log.from_file_pos(self.file, CURRENT_FILE_POS)
-        while log != None and log.log_type == LogType.Prepare:
-            log = Log.from_file_pos(self.file, CURRENT_FILE_POS)
-            i+=1
-
-        if i > 0:
-            size = self.file.seek(0, END_OF_FILE_POS)
-            self.file.truncate(max(0,size - i))
-            self.file.flush()
-            os.fsync(self.file.fileno())
-        
-        return log
+        self.file.write(log.get_record_bytes())
+        if commit:
+            self.commit()
+
+    def commit(self):
+        sync_file(self.file)
+
+    def truncate_torn_tail(self):
+        """
+        Scans the log forward and removes everything after the last complete record, 
+        left by a log that was being written when the process stopped
+        """
+        self.file.seek(0, STARTING_FILE_POS)
+        log_bytes = self.file.read()
+        valid_end = 0
+        while True:
+            end = record_end(log_bytes, valid_end)
+            if end == None:
+                break
+            valid_end = end
+        if valid_end < len(log_bytes):
+            self.file.truncate(valid_end)
+            self.commit()
+            log_bytes = log_bytes[:valid_end]
+        self.log_bytes = log_bytes
+        return valid_end
 
     def read_last_log(self):
-        log = Log.from_file_pos(self.file, END_OF_FILE_POS)
-        if not log:
-            return None
-        if log.log_type == LogType.CountPrepare or log.log_type == LogType.Prepare:
-            return self.handle_partial_logs(log)
-        return log
+        """
+        Reads the whole log and returns its last log. The previous ones are returned by read_curr_log
+        """
+        self.position = self.truncate_torn_tail()
+        return self.read_curr_log()
     
     def read_curr_log(self):
-        return Log.from_file_pos(self.file, CURRENT_FILE_POS)
+        """
+        Returns the log before the last one read, or None if it was the first one
+        """
+        if self.position < RECORD_FRAMING_BYTES:
+            return None
+        args_len = RECORD_TRAILER.unpack_from(self.log_bytes, self.position - RECORD_TRAILER.size)[0]
+        start = self.position - RECORD_FRAMING_BYTES - args_len
+        log = Log.from_record(self.log_bytes, start)
+        self.position = start
+        return log
+
+    def read_all_logs(self):
+        """
+        Reads the whole log and returns all its logs, from the first to the last one
+        """
+        end = self.truncate_torn_tail()
+        logs = []
+        offset = 0
+        while offset < end:
+            logs.append(Log.from_record(self.log_bytes, offset))
+            offset = record_end(self.log_bytes, offset)
+        self.position = 0
+        return logs
     
     def read_while_log_type(self, log_type):
         logs = [self.read_last_log()]
@@ -113,9 +192,13 @@ class LogReadWriter():
         self.log_type == log_type
 
     def clean(self):
+        """
+        Empties the log. It becomes durable with the next commit
+        """
         self.file.truncate(0)
         self.file.flush()
-        os.fsync(self.file.fileno())
+        self.log_bytes = b""
+        self.position = 0
 
     def close(self):
         self.file.close()
@@ -128,21 +211,6 @@ class LogType(IntEnum):
     SentFinalResult = 4
     FinishedSendingResults = 5
     FinishedClient = 6
-    Prepare = 254
-    CountPrepare = 255
-
-    @classmethod
-    def from_file_pos(cls, file, pos):
-        file.seek(0, pos)
-        if file.tell() == 0:
-            return None
-        file.seek(-LOG_TYPE_BYTES, CURRENT_FILE_POS)
-        log_type_bytes = file.read(LOG_TYPE_BYTES)
-        if len(log_type_bytes) == 0:
-            return None
-        log_type = LogType(byte_array_to_big_endian_integer(log_type_bytes))
-        file.seek(-LOG_TYPE_BYTES, CURRENT_FILE_POS)
-        return log_type
     
     def to_bytes(self):
         return integer_to_big_endian_byte_array(self.value, LOG_TYPE_BYTES)
@@ -153,6 +221,20 @@ class Log(ABC):
         byte_array.extend(self.log_type.to_bytes())
         return byte_array
 
+    def get_record_bytes(self):
+        args = self.get_log_arg_bytes()
+        byte_array = bytearray(RECORD_HEADER.pack(self.log_type, len(args), record_crc(self.log_type, args)))
+        byte_array.extend(args)
+        byte_array.extend(RECORD_TRAILER.pack(len(args)))
+        return byte_array
+
+    @classmethod
+    def from_record(cls, buffer, offset):
+        log_type, args_len, _crc = RECORD_HEADER.unpack_from(buffer, offset)
+        args_start = offset + RECORD_HEADER.size
+        reader = ArgsReader(buffer, args_start, args_start + args_len)
+        return cls.get_log_subclass(LogType(log_type)).from_args(reader)
+
     @abstractmethod
     def get_log_arg_bytes(self):
         pass
@@ -167,18 +249,13 @@ class Log(ABC):
             LogType.SentFinalResult: SentFirstFinalResults,
             LogType.FinishedSendingResults: FinishedSendingResults,
             LogType.FinishedClient: FinishedClient,
-            LogType.Prepare: PrepareLog,
-            LogType.CountPrepare: CountPrepareLog,
         }
         return switch[log_type]
 
     @classmethod
     @abstractmethod
-    def from_file_pos(cls, file, pos):
-        log_type = LogType.from_file_pos(file, pos)
-        if log_type == None:
-            return None
-        return cls.get_log_subclass(log_type).from_file_pos(file, CURRENT_FILE_POS)
+    def from_args(cls, reader):
+        pass
     
     def __eq__(self, other):
         if not isinstance(other, Log):
@@ -200,19 +277,11 @@ class NoArgsLog(Log, ABC):
         return bytearray([])
     
     @classmethod
-    def from_file_pos(cls, file, pos):
+    def from_args(cls, reader):
         return cls()
     
     def params_eq(self, other):
         return True
-    
-class PrepareLog(NoArgsLog):
-    def __init__(self):
-        self.log_type = LogType.Prepare
-
-class CountPrepareLog(NoArgsLog):
-    def __init__(self):
-        self.log_type = LogType.CountPrepare
 
 #keys = ['key1', 'key2']
 #values = [[1,1.1,'hola', 'chau'], [2,2.2,'como', 'estas']]
@@ -295,26 +364,27 @@ class ChangingFile(Log):
         return byte_array
 
     @classmethod
-    def from_file_pos(cls, file, pos):
-        filename = string_from_file_pos(file, pos)
-        new_keys = keys_from_file_pos(file, CURRENT_FILE_POS)
-        update_keys = keys_from_file_pos(file, CURRENT_FILE_POS)
-        amount_of_value_types = numbers_from_file_pos(file, CURRENT_FILE_POS, 1, VALUES_TYPES_LEN)[0]
+    def from_args(cls, reader):
+        filename = reader.string()
+        new_keys = reader.keys()
+        update_keys = reader.keys()
+        amount_of_value_types = reader.number(VALUES_TYPES_LEN)
         if amount_of_value_types == 0:
-            return cls(filename, new_keys)
-        value_types = numbers_from_file_pos(file, CURRENT_FILE_POS, amount_of_value_types, VALUES_TYPES_LEN)
+            keys = update_keys + new_keys
+            return cls(filename, keys, [()] * len(update_keys) + [None] * len(new_keys))
+        value_types = reader.numbers(amount_of_value_types, VALUES_TYPES_LEN)
         values = []
         for value_type in reversed(value_types):
             if value_type == STR_TYPE_BYTE:
-                values.insert(0,strings_from_file_pos(file, CURRENT_FILE_POS, len(update_keys)))
+                values.insert(0, reader.strings(len(update_keys)))
             elif value_type == INT_TYPE_BYTE:
-                values.insert(0,numbers_from_file_pos(file, CURRENT_FILE_POS, len(update_keys), U32_BYTES))
+                values.insert(0, reader.numbers(len(update_keys), U32_BYTES))
             elif value_type == FLOAT_TYPE_BYTE:
-                values.insert(0,floats_from_file_pos(file, CURRENT_FILE_POS, len(update_keys)))
+                values.insert(0, reader.floats(len(update_keys)))
             elif value_type == INT_LIST_TYPE_BYTE:
                 lists = []
                 for i in range(len(update_keys)):
-                    lists.insert(0, u32_list_from_file_pos(file, CURRENT_FILE_POS))
+                    lists.insert(0, reader.u32_list())
                 values.insert(0, lists)
             else:
                 raise UnsupportedType
@@ -372,9 +442,9 @@ class SentFirstFinalResults(Log):
         return byte_array
     
     @classmethod
-    def from_file_pos(cls, file, pos):
-        client_id = numbers_from_file_pos(file, pos, 1, CLIENT_ID_BYTES)[0]
-        batch_seq_num, n = numbers_from_file_pos(file, pos, 2, U32_BYTES)
+    def from_args(cls, reader):
+        client_id = reader.number(CLIENT_ID_BYTES)
+        batch_seq_num, n = reader.numbers(2, U32_BYTES)
         return cls(client_id, n, batch_seq_num)
     
     def params_eq(self, other):
@@ -392,9 +462,9 @@ class FinishedSendingResults(Log):
         return byte_array
     
     @classmethod
-    def from_file_pos(cls, file, pos):
-        client_id = numbers_from_file_pos(file, pos, 1, CLIENT_ID_BYTES)[0]
-        batch_seq_num = numbers_from_file_pos(file, pos, 1, U32_BYTES)[0]
+    def from_args(cls, reader):
+        client_id = reader.number(CLIENT_ID_BYTES)
+        batch_seq_num = reader.number(U32_BYTES)
         return cls(client_id, batch_seq_num)
     
     def params_eq(self, other):
@@ -404,54 +474,71 @@ class FinishedClient(NoArgsLog):
     def __init__(self):
         self.log_type = LogType.FinishedClient
 
-def string_from_file_pos(file, pos):
-    file.seek(-STRING_LENGTH_BYTES, pos)
-    len_str = byte_array_to_big_endian_integer(file.read(STRING_LENGTH_BYTES))
-    file.seek(-STRING_LENGTH_BYTES-len_str, CURRENT_FILE_POS)
-    string = file.read(len_str).decode()
-    file.seek(-len_str, CURRENT_FILE_POS)
-    return string
-
-def numbers_from_file_pos(file, pos, amount, bytes_per_number):
-    file.seek(-bytes_per_number*amount, pos)
-    byte_array = bytearray(file.read(bytes_per_number*amount))
-    numbers = []
-    for _i in range(amount):
-        numbers.append(byte_array_to_big_endian_integer(remove_bytes(byte_array, bytes_per_number)))
-    file.seek(-bytes_per_number*amount, pos)
-    return numbers
-
-def floats_from_file_pos(file, pos, amount):
-    file.seek(-FLOAT_BYTES*amount, pos)
-    byte_array = bytearray(file.read(FLOAT_BYTES*amount))
-    numbers = []
-    for _i in range(amount):
-        numbers.append(struct.unpack('f', remove_bytes(byte_array,FLOAT_BYTES))[0])
-    file.seek(-FLOAT_BYTES*amount, pos)
-    return numbers
-
-def amount_of_entries_from_file_pos(file, pos):
-    file.seek(-AMOUNT_OF_ENTRY_BYTES, pos)
-    amount_of_entries = byte_array_to_big_endian_integer(bytearray(file.read(AMOUNT_OF_ENTRY_BYTES)))
-    file.seek(-AMOUNT_OF_ENTRY_BYTES, pos)
-    return amount_of_entries
-
-def strings_from_file_pos(file, pos, amount):
-    strings = []
-    for i in range(amount):
-        strings.insert(0, string_from_file_pos(file, pos))
-    return strings
-
-def keys_from_file_pos(file, pos):
-    amount_of_keys = amount_of_entries_from_file_pos(file, pos)
-    return strings_from_file_pos(file, CURRENT_FILE_POS, amount_of_keys)
-
-def u32_list_from_file_pos(file, pos):
-    file.seek(-LEN_LIST_BYTES, pos)
-    list_len = byte_array_to_big_endian_integer(bytearray(file.read(LEN_LIST_BYTES)))
-    file.seek(-LEN_LIST_BYTES, pos)
-    return numbers_from_file_pos(file, CURRENT_FILE_POS, list_len, U32_BYTES)
-
+class ArgsReader():
+    """
+    Reads the args of a log in buffer[start:end] from their end, as every value 
+    is written before its length. Raises ValueError if they are truncated
+    """
+    def __init__(self, buffer, start, end):
+        self.buffer = buffer
+        self.start = start
+        self.pos = end
+
+    def take(self, amount_of_bytes):
+        if self.pos - amount_of_bytes < self.start:
+            raise ValueError("Truncated log args")
+        self.pos -= amount_of_bytes
+        return self.buffer[self.pos:self.pos + amount_of_bytes]
+
+    def number(self, bytes_per_number):
+        return int.from_bytes(self.take(bytes_per_number), 'big')
+
+    def numbers(self, amount, bytes_per_number):
+        return list(struct.unpack(f'>{amount}{NUMBER_FORMATS[bytes_per_number]}', self.take(amount * bytes_per_number)))
+
+    def floats(self, amount):
+        return list(struct.unpack(f'{amount}f', self.take(amount * FLOAT_BYTES)))
+
+    def string(self):
+        return str(self.take(self.number(STRING_LENGTH_BYTES)), 'utf-8')
+
+    def strings(self, amount):
+        strings = [self.string() for _ in range(amount)]
+        strings.reverse()
+        return strings
+
+    def keys(self):
+        return self.strings(self.number(AMOUNT_OF_ENTRY_BYTES))
+
+    def u32_list(self):
+        return self.numbers(self.number(LEN_LIST_BYTES), U32_BYTES)
+
+def legacy_logs_from_bytes(log_bytes):
+    """
+    Parses the logs of the previous format, where each log was its args followed by its type
+    and the one being written when the process stopped is followed by prepare bytes. 
+    Returns them from the first to the last one, or None if log_bytes are not in that format
+    """
+    end = len(log_bytes)
+    count_prepares = 0
+    while end > 0 and log_bytes[end - 1] == LEGACY_COUNT_PREPARE_BYTE:
+        end -= 1
+        count_prepares += 1
+    end = max(0, end - count_prepares)
+    while end > 0 and log_bytes[end - 1] == LEGACY_PREPARE_BYTE:
+        end -= 1
+
+    logs = []
+    try:
+        while end > 0:
+            log_class = Log.get_log_subclass(LogType(log_bytes[end - 1]))
+            reader = ArgsReader(log_bytes, 0, end - LOG_TYPE_BYTES)
+            logs.append(log_class.from_args(reader))
+            end = reader.pos
+    except (ValueError, KeyError, struct.error, UnsupportedType):
+        return None
+    logs.reverse()
+    return logs
 
 def get_number_byte_array(num, bytes_per_number):
     return integer_to_big_endian_byte_array(num, bytes_per_number)
@@ -485,21 +572,20 @@ if __name__ == '__main__':
     import unittest
     from unittest import TestCase
     from io import BytesIO
-    import pudb; pu.db
     
     class TestLog(TestCase):
         def get_mock_file(self):
-            logs_bytes = ChangingFile("file1", ["a", "b"], [["a", 1 , 1, 1.1], ["b", 2, 2, 2.2]]).get_log_bytes()
-            logs_bytes.extend(ChangingFile("file1", ["a"], [[1]]).get_log_bytes())
-            logs_bytes.extend(ChangingFile("file1", ["a"], [[[1,2,3]]]).get_log_bytes())
-            logs_bytes.extend(ChangingFile("file1", ["a", "b"], [[1], None]).get_log_bytes())
-            logs_bytes.extend(ChangingFile("file1", ["a", "b"], [None, None]).get_log_bytes())
-            logs_bytes.extend(FinishedWriting().get_log_bytes())
-            logs_bytes.extend(SentBatch().get_log_bytes())
-            logs_bytes.extend(AckedBatch().get_log_bytes())
-            logs_bytes.extend(SentFirstFinalResults(1, 2, 4).get_log_bytes())
-            logs_bytes.extend(FinishedSendingResults(65536, 4).get_log_bytes())
-            logs_bytes.extend(FinishedClient().get_log_bytes())
+            logs_bytes = ChangingFile("file1", ["a", "b"], [["a", 1 , 1, 1.1], ["b", 2, 2, 2.2]]).get_record_bytes()
+            logs_bytes.extend(ChangingFile("file1", ["a"], [[1]]).get_record_bytes())
+            logs_bytes.extend(ChangingFile("file1", ["a"], [[[1,2,3]]]).get_record_bytes())
+            logs_bytes.extend(ChangingFile("file1", ["a", "b"], [[1], None]).get_record_bytes())
+            logs_bytes.extend(ChangingFile("file1", ["a", "b"], [None, None]).get_record_bytes())
+            logs_bytes.extend(FinishedWriting().get_record_bytes())
+            logs_bytes.extend(SentBatch().get_record_bytes())
+            logs_bytes.extend(AckedBatch().get_record_bytes())
+            logs_bytes.extend(SentFirstFinalResults(1, 2, 4).get_record_bytes())
+            logs_bytes.extend(FinishedSendingResults(65536, 4).get_record_bytes())
+            logs_bytes.extend(FinishedClient().get_record_bytes())
             return BytesIO(logs_bytes)
 
         def test_log_to_bytes(self):
@@ -575,53 +661,100 @@ if __name__ == '__main__':
             logs = logger.read_until_log_type(LogType.AckedBatch)
             self.assertEqual(logs, [SentBatch(), FinishedClient()])
         
-        def test_read_patial_log_didnt_finish_writing_Prepare(self):
+        def test_record_bytes(self):
+            args = SentFirstFinalResults(1, 2, 4).get_log_arg_bytes()
+            record = SentFirstFinalResults(1, 2, 4).get_record_bytes()
+            self.assertEqual(record[:RECORD_HEADER.size], RECORD_HEADER.pack(LogType.SentFinalResult, len(args), record_crc(LogType.SentFinalResult, args)))
+            self.assertEqual(record[RECORD_HEADER.size:-RECORD_TRAILER.size], args)
+            self.assertEqual(record[-RECORD_TRAILER.size:], RECORD_TRAILER.pack(len(args)))
+
+        def test_log_without_commit(self):
             file = BytesIO(b"")
             logger = LogReadWriter(file)
-            logger.log(AckedBatch())
-            file.seek(0, END_OF_FILE_POS)
-            file.write(LogType.Prepare.to_bytes() * 2)
-            self.assertEqual(logger.read_last_log(), AckedBatch())
+            logger.log(ChangingFile("file1", ["a"], [[1]]), commit=False)
+            logger.log(ChangingFile("file2", ["b"], [[2]]), commit=False)
+            logger.commit()
+            self.assertEqual(logger.read_while_log_type(LogType.ChangingFile), [ChangingFile("file2", ["b"], [[2]]), ChangingFile("file1", ["a"], [[1]])])
 
-        def test_read_patial_log_didnt_finish_writing_CountPrepare(self):
+        def test_read_partial_log_didnt_finish_writing_header(self):
             file = BytesIO(b"")
             logger = LogReadWriter(file)
             logger.log(AckedBatch())
             file.seek(0, END_OF_FILE_POS)
-            log_bytes = len(FinishedSendingResults(15, 4).get_log_bytes())
-            file.write(log_bytes * LogType.Prepare.to_bytes() + 2 * LogType.CountPrepare.to_bytes())
+            file.write(FinishedSendingResults(15, 4).get_record_bytes()[:3])
             self.assertEqual(logger.read_last_log(), AckedBatch())
+            self.assertEqual(file.getvalue(), AckedBatch().get_record_bytes())
 
-        def test_read_patial_log_finished_preparing(self):
+        def test_read_partial_log_didnt_finish_writing_args(self):
             file = BytesIO(b"")
             logger = LogReadWriter(file)
             logger.log(AckedBatch())
             file.seek(0, END_OF_FILE_POS)
-            log_bytes = len(FinishedSendingResults(15, 4).get_log_bytes())
-            file.write(log_bytes * LogType.Prepare.to_bytes() + log_bytes * LogType.CountPrepare.to_bytes())
+            file.write(FinishedSendingResults(15, 4).get_record_bytes()[:-RECORD_TRAILER.size - 2])
             self.assertEqual(logger.read_last_log(), AckedBatch())
 
-        def test_read_patial_log_started_writing(self):
+        def test_read_partial_log_corrupted_args(self):
             file = BytesIO(b"")
             logger = LogReadWriter(file)
             logger.log(AckedBatch())
+            record = FinishedSendingResults(15, 4).get_record_bytes()
+            record[RECORD_HEADER.size] ^= 0xff
             file.seek(0, END_OF_FILE_POS)
-            log_bytes = len(FinishedSendingResults(15, 4).get_log_bytes())
-            file.write(log_bytes * LogType.Prepare.to_bytes() + log_bytes * LogType.CountPrepare.to_bytes())
-            file.seek(-2*log_bytes, END_OF_FILE_POS)
-            file.write(FinishedSendingResults(15, 4).get_log_bytes()[:2])
+            file.write(record)
             self.assertEqual(logger.read_last_log(), AckedBatch())
 
-        def test_read_patial_log_finished_writing_didnt_remove_count_prepare(self):
+        def test_read_log_after_clean(self):
             file = BytesIO(b"")
             logger = LogReadWriter(file)
             logger.log(AckedBatch())
-            file.seek(0, END_OF_FILE_POS)
-            log_bytes = len(FinishedSendingResults(15, 4).get_log_bytes())
-            file.write(log_bytes * LogType.Prepare.to_bytes() + log_bytes * LogType.CountPrepare.to_bytes())
-            file.seek(-2*log_bytes, END_OF_FILE_POS)
-            file.write(FinishedSendingResults(15, 4).get_log_bytes())
-            self.assertEqual(logger.read_last_log(), AckedBatch())
+            logger.clean()
+            self.assertEqual(logger.read_last_log(), None)
+            logger.log(FinishedWriting())
+            self.assertEqual(logger.read_last_log(), FinishedWriting())
+
+        def test_read_all_logs(self):
+            logger = LogReadWriter(self.get_mock_file())
+            logs = logger.read_all_logs()
+            self.assertEqual(logs[0], ChangingFile("file1", ["a", "b"], [["a", 1 , 1, 1.1], ["b", 2, 2, 2.2]]))
+            self.assertEqual(logs[-2:], [FinishedSendingResults(65536, 4), FinishedClient()])
+            self.assertEqual(len(logs), 11)
+
+        def test_truncated_args(self):
+            args = SentFirstFinalResults(1, 2, 4).get_log_arg_bytes()
+            with self.assertRaises(ValueError):
+                SentFirstFinalResults.from_args(ArgsReader(args, 2, len(args)))
+
+        def test_keys_without_values(self):
+            log = ChangingFile("file1", ["a", "b"], [[], None])
+            read_log = Log.from_record(log.get_record_bytes(), 0)
+            self.assertEqual(read_log.keys, ["a", "b"])
+            self.assertEqual(read_log.entries, [(), None])
+
+        def get_legacy_log_bytes(self, logs):
+            log_bytes = bytearray()
+            for log in logs:
+                log_bytes.extend(log.get_log_bytes())
+            return log_bytes
+
+        def test_convert_legacy_log(self):
+            logs = [ChangingFile("file1", ["a", "b"], [["a", 1], ["b", 2]]), FinishedWriting(), SentFirstFinalResults(1, 2, 4)]
+            file = BytesIO(self.get_legacy_log_bytes(logs))
+            logger = LogReadWriter(file)
+            self.assertTrue(logger.convert_legacy_log())
+            self.assertEqual(logger.read_all_logs(), logs)
+            self.assertFalse(logger.convert_legacy_log())
+
+        def test_convert_legacy_log_with_torn_tail(self):
+            logs = [FinishedWriting(), AckedBatch()]
+            torn_log = SentFirstFinalResults(1, 2, 4).get_log_bytes()
+            prepares = bytes([LEGACY_PREPARE_BYTE] * len(torn_log))
+            count_prepares = bytes([LEGACY_COUNT_PREPARE_BYTE] * len(torn_log))
+            # The previous format wrote prepare and count prepare bytes, overwrote the prepare ones with the log and removed the rest
+            torn_tails = [prepares[:3], prepares + count_prepares[:3], torn_log[:5] + prepares[5:] + count_prepares]
+            for torn_tail in torn_tails:
+                logger = LogReadWriter(BytesIO(bytes(self.get_legacy_log_bytes(logs) + torn_tail)))
+                self.assertTrue(logger.convert_legacy_log())
+                self.assertEqual(logger.read_all_logs(), logs)
 
         def test(self):
             logger = LogReadWriter.new("./Persistance/log.bin")
@@ -5,27 +5,21 @@ from Persistance.KeyValueStorage import KeyValueStorage
 from Persistance.log import ChangingFile
 from utils.auxiliar_functions import next_power_of_2_exponent, smalles_scale_for_str
 from .Worker import Worker
-from utils.QueryMessage import QueryMessage, YEAR_FIELD, TITLE_FIELD, AUTHOR_FIELD, BOOK_MSG_TYPE, REVIEW_MSG_TYPE, RATING_FIELD, MSP_FIELD, REVIEW_TEXT_FIELD
+from utils.QueryMessage import QueryMessage, YEAR_FIELD, TITLE_FIELD, AUTHOR_FIELD, BOOK_MSG_TYPE, REVIEW_MSG_TYPE, REVIEW_COUNT_MSG_TYPE, RATING_FIELD, MSP_FIELD, REVIEW_TEXT_FIELD
 import unittest
 from unittest import TestCase
-import heapq
-import bisect
-try:
-    from textblob import TextBlob
-except:
-    pass
+from .Sentiment import SentimentEngine, sentiment_analyser_from_env, sentiment_processes_from_env, polarity_cache_size_from_env, polarity_cache_persisted_from_env, POLARITY_CACHE_FILENAME, POLARITY_CACHE_TEMP_SUFFIX
+from .Percentile import PercentileEngine, percentile_sketch_from_env
+from .TopK import TopK
+from .StringTable import StringTable, ColumnarContext
+from utils.NextPools import GATEWAY_QUEUE_NAME
 
 REVIEW_COUNT = "review_count"
 CONTEXT_FLOAT_BYTES = 4
 CONTEXT_INT_BYTES = 4
-
-def sentiment_analysis(texto):
-    if isinstance(texto, str):
-        blob = TextBlob(texto)
-        sentimiento = blob.sentiment.polarity
-        return sentimiento
-    else:
-        return None
+# Amount of reviews, sum of their ratings, id of the authors in the string table of the worker and scale
+REVIEW_COUNT_TYPECODES = ['L', 'd', 'L', 'B']
+AUTHORS_COLUMN = 2
 
 class Accumulator(Worker, ABC):
     def __init__(self,  id, next_pools, eof_to_receive, field, values, accumulate_by):
@@ -78,7 +72,8 @@ class Accumulator(Worker, ABC):
         pass
 
     def process_message(self, client_id, msg: QueryMessage):
-        self.client_contexts[client_id] = self.client_contexts.get(client_id, self.get_new_context())
+        if client_id not in self.client_contexts:
+            self.client_contexts[client_id] = self.get_new_context()
         results = self.accumulate(client_id, msg)
         if not results:
             return None
@@ -131,15 +126,22 @@ class DecadeByAuthorAccumulator(Accumulator):
         return [(list, int)], [self.values]
     
     def add_previous_context(self, previous_context, client_id):
-        self.client_contexts[client_id] = self.client_contexts.get(client_id,{})
-        self.client_contexts[client_id].update(previous_context)
+        if client_id in self.client_contexts:
+            self.client_contexts[client_id].update(previous_context)
+        else:
+            self.client_contexts[client_id] = previous_context
 
     def sorted_final_results(self, client_id):
         return []
     
 class AmountOfReviewByTitleAccumulator(Accumulator):
+    """
+    Keeps the amount of reviews, the sum of their ratings and the authors of each title in a
+    ColumnarContext, with the titles and the authors interned in the string table of the worker,
+    and the scale of the context file of each title so it is not computed again on every review
+    """
     def get_new_context(cls):
-        return {}
+        return ColumnarContext(REVIEW_COUNT_TYPECODES)
     
     def accumulate(self, client_id, msg):
         if msg.msg_type == BOOK_MSG_TYPE:
@@ -147,108 +149,211 @@ class AmountOfReviewByTitleAccumulator(Accumulator):
             self.add_to_context(client_id, msg.msg_type, msg.title, msg.rating, authors)
             if "Best Gay Erotica 2000".lower() in msg.title.lower():
                 print(f"\n\n {list(authors.encode())} \n\n")
-        elif msg.msg_type == REVIEW_MSG_TYPE:
-            if msg.title not in self.client_contexts[client_id]:
+        elif msg.msg_type in (REVIEW_MSG_TYPE, REVIEW_COUNT_MSG_TYPE):
+            if msg.title not in self.client_contexts[client_id].rows:
                 return None
-            self.add_to_context(client_id, msg.msg_type, msg.title, msg.rating)
-            if self.client_contexts[client_id][msg.title][0] == int(self.values):
+            amount_of_reviews = msg.year if msg.msg_type == REVIEW_COUNT_MSG_TYPE else 1
+            amount = self.add_to_context(client_id, msg.msg_type, msg.title, msg.rating, amount_of_reviews=amount_of_reviews)
+            if 0 <= amount - int(self.values) < amount_of_reviews:
                 print(f"[Worker {self.id}] Accumulated {self.values} of {msg.title} for client {client_id}")
         return None
     
-    def add_to_context(self, client_id, msg_type, title, rating, authors=None):
-        old_value = self.client_contexts[client_id].get(title, None)
-        if old_value != None:
-            old_value = old_value.copy()
-        if authors == None:
-            authors = old_value[2]
+    def stored_value(self, context, row):
+        amounts, rating_sums, authors_ids, _ = context.columns
+        return [amounts[row], rating_sums[row], self.string_table.strings[authors_ids[row]]]
+
+    def add_to_context(self, client_id, msg_type, title, rating, authors=None, amount_of_reviews=1):
+        """
+        Returns the amount of reviews of title
+        """
+        context = self.client_contexts[client_id]
+        amounts, rating_sums, authors_ids, scales = context.columns
+        row = context.rows.get(title, None)
+        is_new_title = row == None
+        if is_new_title:
+            title = self.string_table.intern(title)
+            scale = max(smalles_scale_for_str(title),smalles_scale_for_str(authors))
+            row = context.set(title, [0, 0.0, self.string_table.id(authors), scale])
+        elif authors == None:
+            scale = scales[row]
+        else:
+            scale = max(smalles_scale_for_str(title),smalles_scale_for_str(authors))
 
-        scale = max(smalles_scale_for_str(title),smalles_scale_for_str(authors))
         if scale not in self.client_context_storage_updates:
             self.client_context_storage_updates[scale] = {}
         if title in self.client_context_storage_updates[scale]:
             old_value = self.client_context_storage_updates[scale][title][0]
-            
-        new_value = self.client_contexts[client_id].get(title, [0, 0.0, authors])
-        if msg_type == REVIEW_MSG_TYPE:
-            new_value[0] +=1
-            new_value[1] += rating
-        self.client_context_storage_updates[scale][title] = (old_value, new_value)
-        self.client_contexts[client_id][title] = new_value
+        elif is_new_title:
+            old_value = None
+        else:
+            old_value = self.stored_value(context, row)
+
+        if msg_type != BOOK_MSG_TYPE:
+            amounts[row] += amount_of_reviews
+            rating_sums[row] += rating
+        self.client_context_storage_updates[scale][title] = (old_value, [amounts[row], rating_sums[row], self.string_table.strings[authors_ids[row]]])
+        return amounts[row]
 
     def sorted_final_results(self, client_id):
         sorted_results = []
-        for title, accum in sorted(self.client_contexts[client_id].items()):
-            if accum[0] >= int(self.values):
-                authors = accum[2].split(';')
-                result = QueryMessage(msg_type=BOOK_MSG_TYPE, title=title, authors=authors, rating=accum[1] / accum[0])
+        context = self.client_contexts[client_id]
+        amounts, rating_sums, authors_ids, _ = context.columns
+        for title, row in sorted(context.rows.items()):
+            if amounts[row] >= int(self.values):
+                authors = self.string_table.string(authors_ids[row]).split(';')
+                result = QueryMessage(msg_type=BOOK_MSG_TYPE, title=title, authors=authors, rating=rating_sums[row] / amounts[row])
                 sorted_results.append(result)
         #print("\n\n resultadpos finales  ", sorted_results)
         return sorted_results
     
     def get_context_storage_types(self, scale_of_update_file):
         return [int, float, str], [CONTEXT_INT_BYTES, CONTEXT_FLOAT_BYTES, 2**scale_of_update_file]
+
+    def rebuild_string_table(self):
+        """
+        Interns the titles and authors of the clients left in a new string table, 
+        updating the authors ids of their contexts
+        """
+        previous_string_table = self.string_table
+        self.string_table = StringTable()
+        for context in self.client_contexts.values():
+            authors_ids = context.columns[AUTHORS_COLUMN]
+            for title, row in context.rows.items():
+                self.string_table.intern(title)
+                authors_ids[row] = self.string_table.id(previous_string_table.string(authors_ids[row]))
     
     def add_previous_context(self, previous_context, client_id):
-        self.client_contexts[client_id] = self.client_contexts.get(client_id,{})
-        self.client_contexts[client_id].update(previous_context)
+        if client_id not in self.client_contexts:
+            self.client_contexts[client_id] = self.get_new_context()
+        context = self.client_contexts[client_id]
+        for title, (amount, rating_sum, authors) in previous_context.items():
+            title = self.string_table.intern(title)
+            scale = max(smalles_scale_for_str(title),smalles_scale_for_str(authors))
+            context.set(title, [amount, rating_sum, self.string_table.id(authors), scale])
     
-class RatingByTitleAccumulator(Accumulator):
+class TopKAccumulator(Accumulator):
+    """
+    Keeps the WORKER_VALUE keys with the largest value of each client in a TopK. Only the 
+    keys added and evicted by each batch are written to the context storages.
+    The stages that do not send to the Gateway are partial: they send their top-K as a run by
+    value, that the next stage merges
+    """
     def get_new_context(cls):
-        return []
-    
+        return TopK(int(cls.values))
+
+    @abstractmethod
+    def top_k_entry(self, msg):
+        """
+        Returns the (key, value) of msg, or None if it has none
+        """
+        pass
+
+    @abstractmethod
+    def top_k_result(self, key, value):
+        pass
+
     def accumulate(self, client_id, msg):
-        if msg.rating == None or msg.title == None:
-            return
-        if len(self.client_contexts[client_id]) < int(self.values):
-            self.add_to_context(client_id, msg.title, msg.rating)
-        elif self.client_contexts[client_id][0].attribute < msg.rating:
-            self.remove_smallest_from_context(client_id)
-            self.add_to_context(client_id, msg.title, msg.rating)
-
-    def add_to_context(self, client_id, title, rating):
-        old_value = None
-        new_value = rating
-        scale = smalles_scale_for_str(title)
-        if scale not in self.client_context_storage_updates:
-            self.client_context_storage_updates[scale] = {}
-        self.client_context_storage_updates[scale][title] = (old_value, [new_value])
-        heapq.heappush(self.client_contexts[client_id], BookAtribute(title, rating))
-    
-    def remove_smallest_from_context(self, client_id):
-        old_book_attribute = heapq.heappop(self.client_contexts[client_id])
-        new_value = None
-        scale = smalles_scale_for_str(old_book_attribute.title)
-        if scale not in self.client_context_storage_updates:
-            self.client_context_storage_updates[scale] = {}
-        self.client_context_storage_updates[scale][old_book_attribute.title] = ([old_book_attribute.attribute], new_value)
+        entry = self.top_k_entry(msg)
+        if entry != None:
+            self.client_contexts[client_id].offer(*entry)
+
+    def process_batch_messages(self, batch, results):
+        """
+        Offers the entries of all the messages of the batch to the TopK of the client, and then 
+        adds its delta to the context storage updates
+        """
+        if batch.is_empty():
+            return super().process_batch_messages(batch, results)
+        client_id = batch.client_id
+        self.client_contexts[client_id] = self.client_contexts.get(client_id, self.get_new_context())
+        entries = [self.top_k_entry(msg) for msg in batch]
+        self.client_contexts[client_id].merge([entry for entry in entries if entry != None])
+        self.add_top_k_delta(client_id)
+
+    def add_top_k_delta(self, client_id):
+        for key, old_value, new_value in self.client_contexts[client_id].delta():
+            scale = smalles_scale_for_str(key)
+            if scale not in self.client_context_storage_updates:
+                self.client_context_storage_updates[scale] = {}
+            old_value = None if old_value == None else [old_value]
+            new_value = None if new_value == None else [new_value]
+            self.client_context_storage_updates[scale][key] = (old_value, new_value)
+
+    def is_partial(self):
+        return self.next_pools != None and not self.next_pools.contains_pool(GATEWAY_QUEUE_NAME)
 
     def sorted_final_results(self, client_id):
-        results = []
-        while len(self.client_contexts[client_id]) > 0:
-            result = heapq.heappop(self.client_contexts[client_id])
-            results.append(QueryMessage(BOOK_MSG_TYPE, title=result.title, rating= result.attribute))
-        return sorted(results, key=lambda q: q.title)
+        if self.is_partial():
+            entries = self.client_contexts[client_id].sorted_by_value()
+        else:
+            entries = self.client_contexts[client_id].sorted_by_key()
+        return [self.top_k_result(key, value) for key, value in entries]
     
     def get_context_storage_types(self, scale_of_update_file):
         return [float], [CONTEXT_FLOAT_BYTES]
     
     def add_previous_context(self, previous_context, client_id):
-        self.client_contexts[client_id] =  self.client_contexts.get(client_id, [])
-        for title, rating in previous_context.items():
-            heapq.heappush(self.client_contexts[client_id], BookAtribute(title, rating))
+        self.client_contexts[client_id] = self.client_contexts.get(client_id, self.get_new_context())
+        self.client_contexts[client_id].extend(previous_context.items())
+
+class RatingByTitleAccumulator(TopKAccumulator):
+    def top_k_entry(self, msg):
+        if msg.rating == None or msg.title == None:
+            return None
+        return msg.title, msg.rating
+
+    def top_k_result(self, title, rating):
+        return QueryMessage(BOOK_MSG_TYPE, title=title, rating=rating)
     
 class ReviewTextByTitleAccumulator(Accumulator):
+    def __init__(self,  id, next_pools, eof_to_receive, field, values, accumulate_by):
+        super().__init__(id, next_pools, eof_to_receive, field, values, accumulate_by)
+        self.sentiment_engine = SentimentEngine.new(sentiment_processes_from_env(), polarity_cache_size_from_env(), sentiment_analyser_from_env())
+        self.persist_polarity_cache = polarity_cache_persisted_from_env()
+
+    def load_from_disk(self):
+        if not super().load_from_disk():
+            return False
+        if self.persist_polarity_cache:
+            self.sentiment_engine.load_cache(self.worker_dir() + POLARITY_CACHE_FILENAME)
+        return True
+
+    def is_context_file(self, filename):
+        if filename == POLARITY_CACHE_FILENAME or filename == POLARITY_CACHE_FILENAME + POLARITY_CACHE_TEMP_SUFFIX:
+            return False
+        return super().is_context_file(filename)
+
     def get_new_context(cls):
         return {}
     
     def accumulate(self, client_id, msg):
         if msg.msg_type == REVIEW_MSG_TYPE:
-            if not msg.title in self.client_contexts[client_id].keys():
-                self.client_contexts[client_id][msg.title] = [0, 0.0]
-            sent_analysis = sentiment_analysis(msg.review_text)
-            if sent_analysis != None:
-                self.add_to_context(client_id, msg.title, sent_analysis)
+            self.add_review(client_id, msg.title, self.sentiment_engine.polarities([msg.review_text])[0])
         return None
+
+    def add_review(self, client_id, title, sent_analysis):
+        if not title in self.client_contexts[client_id].keys():
+            self.client_contexts[client_id][title] = [0, 0.0]
+        if sent_analysis != None:
+            self.add_to_context(client_id, title, sent_analysis)
+
+    def process_batch_messages(self, batch, results):
+        """
+        Computes the polarity of all the reviews of the batch with the sentiment engine, 
+        and then adds them to the context of their titles in the order of the batch
+        """
+        if batch.is_empty():
+            return super().process_batch_messages(batch, results)
+        client_id = batch.client_id
+        self.client_contexts[client_id] = self.client_contexts.get(client_id, self.get_new_context())
+        reviews = [msg for msg in batch if msg.msg_type == REVIEW_MSG_TYPE]
+        polarities = self.sentiment_engine.polarities([msg.review_text for msg in reviews])
+        for msg, sent_analysis in zip(reviews, polarities):
+            self.add_review(client_id, msg.title, sent_analysis)
+
+    def close(self):
+        super().close()
+        self.sentiment_engine.close()
     
     def add_to_context(self, client_id, title, sentiment_analisys):
         old_value = self.client_contexts[client_id].get(title, None)
@@ -277,12 +382,18 @@ class ReviewTextByTitleAccumulator(Accumulator):
         return [int, float], [CONTEXT_INT_BYTES, CONTEXT_FLOAT_BYTES]
     
     def add_previous_context(self, previous_context, client_id):
-        self.client_contexts[client_id] = self.client_contexts.get(client_id,{})
-        self.client_contexts[client_id].update(previous_context)
+        if client_id in self.client_contexts:
+            self.client_contexts[client_id].update(previous_context)
+        else:
+            self.client_contexts[client_id] = previous_context
     
 class MeanSentimentPolarityByTitleAccumulator(Accumulator):
+    def __init__(self,  id, next_pools, eof_to_receive, field, values, accumulate_by):
+        super().__init__(id, next_pools, eof_to_receive, field, values, accumulate_by)
+        self.percentile_sketch = percentile_sketch_from_env()
+
     def get_new_context(cls):
-        return []
+        return PercentileEngine.new(int(cls.values), cls.percentile_sketch)
     
     def accumulate(self, client_id, msg):
         if msg.title and msg.mean_sentiment_polarity != None:
@@ -295,24 +406,20 @@ class MeanSentimentPolarityByTitleAccumulator(Accumulator):
         if scale not in self.client_context_storage_updates:
             self.client_context_storage_updates[scale] = {}
         self.client_context_storage_updates[scale][title] = (old_value, [new_value])
-        bisect.insort(self.client_contexts[client_id], BookAtribute(title, msp))
+        self.client_contexts[client_id].add(title, msp)
 
     def sorted_final_results(self, client_id):
-        percentil_90_index = int(len(self.client_contexts[client_id]) * (int(self.values) / 100))
-        sorted_results = []
-        for book_attr in self.client_contexts[client_id]:
-            if book_attr >= self.client_contexts[client_id][percentil_90_index]:
-                bisect.insort(sorted_results, book_attr)
-
-        return [QueryMessage(BOOK_MSG_TYPE, title=result.title) for result in sorted_results]
+        percentile_engine = self.client_contexts[client_id]
+        if percentile_engine.sketch != None and len(percentile_engine) > 0:
+            print(f"[Worker {self.id}] Percentile {percentile_engine.percentile} of client {client_id}: {percentile_engine.cutoff()}, estimated {percentile_engine.estimated_cutoff()}")
+        return [QueryMessage(BOOK_MSG_TYPE, title=title) for title, _ in percentile_engine.top()]
     
     def get_context_storage_types(self, scale_of_update_file):
         return [float], [CONTEXT_FLOAT_BYTES]
     
     def add_previous_context(self, previous_context, client_id):
-        self.client_contexts[client_id] =  self.client_contexts.get(client_id, [])
-        for title, msp in previous_context.items():
-            bisect.insort(self.client_contexts[client_id], BookAtribute(title, msp))
+        self.client_contexts[client_id] = self.client_contexts.get(client_id, self.get_new_context())
+        self.client_contexts[client_id].extend(previous_context.items())
 
 class BookAtribute():
     def __init__(self, title, attribute):
@@ -323,4 +430,54 @@ class BookAtribute():
         return self.attribute < other.attribute
     
     def __le__(self, other):
-        return self.attribute <= other.attribute
\ No newline at end of file
+        return self.attribute <= other.attribute
+
+if __name__ == '__main__':
+    from utils.SenderID import SenderID
+    from utils.Batch import Batch
+    from benchmarks.contexts import DictAmountOfReviewByTitleAccumulator
+
+    class TestAmountOfReviewByTitleAccumulator(TestCase):
+        def get_test_batchs(self, client_id):
+            books = [QueryMessage(BOOK_MSG_TYPE, title=f"Titulo {i}", authors=[f"Autor {i % 3}", "Otro autor"]) for i in range(6)]
+            reviews = [QueryMessage(REVIEW_MSG_TYPE, title=f"Titulo {i % 8}", rating=float(i % 5)) for i in range(40)]
+            review_counts = [QueryMessage(REVIEW_COUNT_MSG_TYPE, title=f"Titulo {i}", year=3, rating=12.0) for i in range(2, 9)]
+            resent_books = [QueryMessage(BOOK_MSG_TYPE, title="Titulo 1", authors=["Un autor con un nombre mucho mas largo que el resto"])]
+            return [Batch(client_id, SenderID(2,0,0), i, messages) for i, messages in enumerate([books, reviews, review_counts, resent_books, reviews])]
+
+        def get_test_accumulator(self, accumulator_class):
+            return accumulator_class(SenderID(3,0,0), None, 1, REVIEW_COUNT, '5', TITLE_FIELD)
+
+        def final_results(self, accumulator, client_id):
+            return [(msg.title, msg.authors, msg.rating) for msg in accumulator.sorted_final_results(client_id)]
+
+        def test_matches_dict_accumulator(self):
+            accumulators = [self.get_test_accumulator(DictAmountOfReviewByTitleAccumulator), self.get_test_accumulator(AmountOfReviewByTitleAccumulator)]
+            for client_id in [1, 2]:
+                for batch in self.get_test_batchs(client_id):
+                    updates = []
+                    for accumulator in accumulators:
+                        accumulator.process_batch_messages(batch, [])
+                        updates.append(accumulator.client_context_storage_updates)
+                        accumulator.client_context_storage_updates = {}
+                    self.assertEqual(updates[0], updates[1])
+            for client_id in [1, 2]:
+                self.assertEqual(self.final_results(accumulators[0], client_id), self.final_results(accumulators[1], client_id))
+
+        def test_string_table_keeps_strings_of_clients_left(self):
+            accumulator = self.get_test_accumulator(AmountOfReviewByTitleAccumulator)
+            for client_id in [1, 2]:
+                for batch in self.get_test_batchs(client_id):
+                    accumulator.process_batch_messages(batch, [])
+            expected_results = self.final_results(accumulator, 2)
+            accumulator.client_context_storage_updates = {}
+            accumulator.client_contexts[3] = accumulator.get_new_context()
+            accumulator.add_to_context(3, BOOK_MSG_TYPE, "Titulo de otro cliente", 0.0, "Autor de otro cliente")
+            accumulator.remove_client_context(3)
+            accumulator.remove_client_context(1)
+            accumulator.rebuild_string_table()
+            self.assertNotIn("Titulo de otro cliente", accumulator.string_table.ids)
+            self.assertEqual(len(accumulator.string_table), 6 + 3)
+            self.assertEqual(self.final_results(accumulator, 2), expected_results)
+
+    unittest.main()
@@ -0,0 +1,99 @@
+import math
+import os
+import zlib
+
+BLOOM_HASHES = 3
+NO_BLOOM_FILTER = 0
+
+class BloomFilter():
+    """
+    Bit array where each key sets BLOOM_HASHES bits, so a key whose bits are not all set was
+    never added, and one whose bits are set may have been. The positions come from the crc32
+    and adler32 of the bytes of the key, so strings can be checked without decoding them.
+    Counts the keys checked, the ones rejected and the false positives reported by the caller
+    """
+    def __init__(self, size):
+        self.size = size
+        self.bits = bytearray((size + 7) // 8)
+        self.keys = 0
+        self.checked = 0
+        self.rejected = 0
+        self.false_positives = 0
+
+    def positions(self, key_bytes):
+        first = zlib.crc32(key_bytes)
+        step = zlib.adler32(key_bytes) | 1
+        return [(first + i * step) % self.size for i in range(BLOOM_HASHES)]
+
+    def add(self, key_bytes):
+        for position in self.positions(key_bytes):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.keys += 1
+
+    def might_contain(self, key_bytes):
+        self.checked += 1
+        bits = self.bits
+        size = self.size
+        position = zlib.crc32(key_bytes) % size
+        step = zlib.adler32(key_bytes) | 1
+        for _ in range(BLOOM_HASHES):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                self.rejected += 1
+                return False
+            position = (position + step) % size
+        return True
+
+    def add_false_positive(self):
+        self.false_positives += 1
+
+    def observed_false_positive_rate(self):
+        """
+        False positives over the keys checked that were not added, None if there were none
+        """
+        absent = self.rejected + self.false_positives
+        if absent == 0:
+            return None
+        return self.false_positives / absent
+
+    def expected_false_positive_rate(self):
+        return (1 - math.exp(-BLOOM_HASHES * self.keys / self.size)) ** BLOOM_HASHES
+
+def title_bloom_filter_bits_from_env():
+    bits = os.getenv("TITLE_BLOOM_FILTER_BITS")
+    if not bits:
+        return NO_BLOOM_FILTER
+    try:
+        return max(int(bits), NO_BLOOM_FILTER)
+    except ValueError as e:
+        print(f"Invalid TITLE_BLOOM_FILTER_BITS, not using a bloom filter: {e}")
+        return NO_BLOOM_FILTER
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+
+    class TestBloomFilter(TestCase):
+        def test_added_keys_are_never_rejected(self):
+            bloom = BloomFilter(2**12)
+            keys = [f"titulo {i}".encode() for i in range(200)]
+            for key in keys:
+                bloom.add(key)
+            self.assertTrue(all(bloom.might_contain(key) for key in keys))
+            self.assertEqual(bloom.rejected, 0)
+
+        def test_false_positive_rate(self):
+            bloom = BloomFilter(2**14)
+            for i in range(1000):
+                bloom.add(f"titulo {i}".encode())
+            for i in range(1000, 11000):
+                if bloom.might_contain(f"titulo {i}".encode()):
+                    bloom.add_false_positive()
+            self.assertEqual(bloom.checked, 10000)
+            self.assertAlmostEqual(bloom.observed_false_positive_rate(), bloom.expected_false_positive_rate(), delta=0.01)
+
+        def test_checks_memoryviews(self):
+            bloom = BloomFilter(64)
+            bloom.add(b"titulo")
+            self.assertTrue(bloom.might_contain(memoryview(bytearray(b"un titulo"))[3:]))
+
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+from utils.QueryMessage import QueryMessage, REVIEW_MSG_TYPE, REVIEW_COUNT_MSG_TYPE, YEAR_STRUCT
+
+# The amount of reviews of a partial is sent in the year field
+MAX_REVIEWS_PER_PARTIAL = 2**(8 * YEAR_STRUCT.size) - 1
+
+def combine_reviews(messages):
+    """
+    Folds the reviews of each title into REVIEW_COUNT_MSG_TYPE partials with the amount of
+    reviews and the sum of their ratings, in the position of the first review of the title,
+    so the books keep arriving before the reviews of their titles. The rest of the messages,
+    and the reviews without a rating, are kept as they are
+    """
+    combined = []
+    partials = {} # {title: partial}
+    for msg in messages:
+        if msg.msg_type != REVIEW_MSG_TYPE or msg.rating == None:
+            combined.append(msg)
+            continue
+        if msg.title not in partials or partials[msg.title].year == MAX_REVIEWS_PER_PARTIAL:
+            partials[msg.title] = QueryMessage(REVIEW_COUNT_MSG_TYPE, year=0, rating=0.0, title=msg.title)
+            combined.append(partials[msg.title])
+        partial = partials[msg.title]
+        partial.year += 1
+        partial.rating += msg.rating
+    return combined
+
+def combine_reviews_from_env():
+    return bool(os.getenv("COMBINE_REVIEWS"))
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+    from utils.QueryMessage import BOOK_MSG_TYPE
+
+    class TestCombineReviews(TestCase):
+        def test_folds_reviews_by_title(self):
+            messages = [
+                QueryMessage(BOOK_MSG_TYPE, title="a", authors=["x"]),
+                QueryMessage(REVIEW_MSG_TYPE, title="a", rating=4.0),
+                QueryMessage(REVIEW_MSG_TYPE, title="b", rating=1.0),
+                QueryMessage(REVIEW_MSG_TYPE, title="a", rating=5.0),
+                QueryMessage(REVIEW_MSG_TYPE, title="b"),
+            ]
+            self.assertEqual(combine_reviews(messages), [
+                QueryMessage(BOOK_MSG_TYPE, title="a", authors=["x"]),
+                QueryMessage(REVIEW_COUNT_MSG_TYPE, year=2, rating=9.0, title="a"),
+                QueryMessage(REVIEW_COUNT_MSG_TYPE, year=1, rating=1.0, title="b"),
+                QueryMessage(REVIEW_MSG_TYPE, title="b"),
+            ])
+
+        def test_partials_fit_in_the_year(self):
+            messages = [QueryMessage(REVIEW_MSG_TYPE, title="a", rating=1.0)] * (MAX_REVIEWS_PER_PARTIAL + 1)
+            combined = combine_reviews(messages)
+            self.assertEqual([msg.year for msg in combined], [MAX_REVIEWS_PER_PARTIAL, 1])
+            self.assertEqual([QueryMessage.from_bytes(msg.to_bytes()).year for msg in combined], [MAX_REVIEWS_PER_PARTIAL, 1])
+
+    unittest.main()
@@ -1,6 +1,8 @@
 from utils.Batch import SeqNumGenerator
 from utils.auxiliar_functions import smalles_scale_for_str
 from .Worker import Worker
+from .Combiner import combine_reviews, combine_reviews_from_env
+from .BloomFilter import BloomFilter, title_bloom_filter_bits_from_env, NO_BLOOM_FILTER
 from utils.QueryMessage import QueryMessage, CATEGORIES_FIELD, YEAR_FIELD, TITLE_FIELD, REVIEW_MSG_TYPE, AUTHOR_FIELD
 
 class Filter(Worker):
@@ -9,6 +11,11 @@ class Filter(Worker):
         self.field = field
         self.valid_values = valid_values
         self.droping_fields = droping_fields
+        # Filters only read the fields they filter by, the rest is forwarded as received
+        self.lazy_decoding = True
+        self.combining_reviews = combine_reviews_from_env()
+        self.title_bloom_filter_bits = title_bloom_filter_bits_from_env()
+        self.title_bloom_filters = {} # {client_id: BloomFilter}
 
     @classmethod
     def new(cls, field, valid_values, droping_fields=[]):
@@ -24,6 +31,9 @@ class Filter(Worker):
         return [], []
     
     def add_to_context(self, client_id, title):
+        title = self.string_table.intern(title)
+        if title not in self.client_contexts[client_id]:
+            self.add_to_title_bloom_filter(client_id, title)
         self.client_contexts[client_id].add(title)
         scale = smalles_scale_for_str(title)
         if scale not in self.client_context_storage_updates:
@@ -34,7 +44,7 @@ class Filter(Worker):
         if self.field == AUTHOR_FIELD:
             return self.split_message_by_author(msg)
         self.client_contexts[client_id] = self.client_contexts.get(client_id, set())
-        if msg.msg_type == REVIEW_MSG_TYPE and msg.title in self.client_contexts[client_id]:
+        if msg.msg_type == REVIEW_MSG_TYPE and self.title_in_context(client_id, msg):
             return self.transform_to_result(msg)
         if self.filter_book(msg):
             self.add_to_context(client_id, msg.title)
@@ -42,9 +52,48 @@ class Filter(Worker):
             return self.transform_to_result(msg)
         return None
     
+    def combine_results(self, results):
+        if self.combining_reviews:
+            return combine_reviews(results)
+        return results
+
+    def add_to_title_bloom_filter(self, client_id, title):
+        if self.title_bloom_filter_bits == NO_BLOOM_FILTER:
+            return
+        if client_id not in self.title_bloom_filters:
+            self.title_bloom_filters[client_id] = BloomFilter(self.title_bloom_filter_bits)
+        self.title_bloom_filters[client_id].add(title.encode())
+
+    def title_in_context(self, client_id, msg):
+        """
+        With a bloom filter, most titles that are not in the context are rejected without 
+        decoding them or looking them up in the context
+        """
+        bloom_filter = self.title_bloom_filters.get(client_id, None)
+        if bloom_filter == None:
+            return msg.title in self.client_contexts[client_id]
+        title_bytes = msg.title_bytes()
+        if title_bytes == None or not bloom_filter.might_contain(title_bytes):
+            return False
+        if msg.title in self.client_contexts[client_id]:
+            return True
+        bloom_filter.add_false_positive()
+        return False
+
     def remove_client_context(self, client_id):
         if client_id in self.client_contexts:
             self.client_contexts.pop(client_id)
+        bloom_filter = self.title_bloom_filters.pop(client_id, None)
+        if bloom_filter != None:
+            observed = bloom_filter.observed_false_positive_rate()
+            observed = f"{observed:.4f}" if observed != None else "-"
+            print(f"[Worker {self.id}] Title bloom filter of client {client_id}: {bloom_filter.keys} titles, {bloom_filter.checked} reviews checked, {bloom_filter.rejected} rejected, {bloom_filter.false_positives} false positives, false positive rate {observed} (expected {bloom_filter.expected_false_positive_rate():.4f})")
+
+    def rebuild_string_table(self):
+        self.string_table.clear()
+        for titles in self.client_contexts.values():
+            for title in titles:
+                self.string_table.intern(title)
 
     def filter_book(self, msg:QueryMessage):
         switch = {
@@ -59,7 +108,9 @@ class Filter(Worker):
 
     def add_previous_context(self, previous_context, client_id):
         self.client_contexts[client_id] = self.client_contexts.get(client_id,set())
-        self.client_contexts[client_id].update(previous_context.keys())
+        self.client_contexts[client_id].update(map(self.string_table.intern, previous_context.keys()))
+        for title in previous_context.keys():
+            self.add_to_title_bloom_filter(client_id, title)
 
     def get_final_results(self, _client_id):
         return []
@@ -0,0 +1,246 @@
+try:
+    import numpy as np
+    from textblob.en import sentiment as pattern_sentiment
+    from textblob._text import PUNCTUATION, ABBREVIATIONS, EMOTICONS, EOS, RE_ABBR1, RE_ABBR2, RE_ABBR3, RE_SARCASM, RE_EMOTICONS, replacements
+except:
+    pass
+import re
+
+NEGATIONS = ("no", "not", "n't", "never")
+MODIFIER_POS = "RB"
+MODIFIER_SUFFIX = "ly"
+EXCLAMATION = "!"
+EXCLAMATION_BOOST = 1.25
+IRONY = "(!)"
+NEGATED_POLARITY_FACTOR = -0.5
+MAX_EMOTICON_LENGTH = 5
+# Largest difference with the polarity of TextBlob over the golden reviews
+POLARITY_TOLERANCE = 1e-9
+# Every assessment of a review is its polarity, the intensity of its last word and if it is negated
+POLARITY, INTENSITY, NEGATED = 0, 1, 2
+
+_lexicon = None
+
+class PolarityLexicon():
+    """
+    Polarity of review texts with the lexicon and rules of the pattern analyzer of TextBlob,
+    without building a TextBlob for every text. The words of the lexicon are looked up in a
+    single dict of (polarity, intensity, is modifier), the assessments of all the texts of a
+    batch are flattened in arrays and the negations and averages by text are computed with NumPy
+    """
+    def __init__(self, words, emoticons):
+        self.words = words # {word: (polarity, intensity, is modifier)}
+        self.emoticons = emoticons # {emoticon: polarity}
+        self.replacements = re.compile("|".join(re.escape(contraction) for contraction in replacements))
+        self.punctuation = set(PUNCTUATION.replace(".", ""))
+        self.punctuation_and_period = set(PUNCTUATION)
+        # Pattern ends a sentence on these tokens and the trailers after them, except for
+        # quotes, that it never considers closing ones
+        self.sentence_ends = set(("...", ".", "!", "?", EOS))
+        self.sentence_trailers = set(("”", "’", "...", ".", "!", "?", ")", EOS))
+
+    @classmethod
+    def new(cls):
+        try:
+            np, pattern_sentiment
+        except NameError as e:
+            print(f"Could not load the sentiment lexicon, textblob and numpy are needed: {e}")
+            return None
+        words = {}
+        # The lexicon is loaded on its first use
+        len(pattern_sentiment)
+        for word, senses in dict.items(pattern_sentiment):
+            polarity, _subjectivity, intensity = senses[None]
+            words[word] = (polarity, intensity, MODIFIER_POS in senses)
+        emoticons = {}
+        for (_expression, polarity), faces in EMOTICONS.items():
+            for face in faces:
+                face = face.lower()
+                # Pattern only looks up the tokens that are not alphabetic
+                if not face.isalpha() and len(face) <= MAX_EMOTICON_LENGTH:
+                    emoticons.setdefault(face, polarity)
+        return PolarityLexicon(words, emoticons)
+
+    def tokens(self, texto):
+        """
+        Returns the lowercase words of texto as pattern tokenizes them: contractions, quotes
+        and punctuation are split from the words, except for abbreviations, emoticons and (!)
+        """
+        texto = self.replacements.sub(lambda match: replacements[match.group()], texto)
+        texto = texto.replace("“", " “ ").replace("”", " ” ").replace("‘", " ‘ ").replace("’", " ’ ").replace("'", " ' ").replace('"', ' " ')
+        texto = texto.replace("\r\n", "\n")
+        texto = re.sub(r"\n{2,}", " %s " % EOS, texto)
+        tokens = []
+        for token in texto.split():
+            if token[0] in self.punctuation_and_period or token[-1] in self.punctuation_and_period:
+                self.split_punctuation(token, tokens)
+            else:
+                tokens.append(token)
+        texto = RE_SARCASM.sub(IRONY, self.sentences(tokens, EOS in texto))
+        texto = RE_EMOTICONS.sub(lambda match: match.group(1).replace(" ", "") + match.group(2), texto)
+        return texto.lower().split()
+
+    def split_punctuation(self, token, tokens):
+        tail = []
+        while token and token[0] in self.punctuation and token not in replacements:
+            tokens.append(token[0])
+            token = token[1:]
+        while token and token[-1] in self.punctuation_and_period and token not in replacements:
+            if token[-1] in self.punctuation:
+                tail.append(token[-1])
+                token = token[:-1]
+            if token.endswith("..."):
+                tail.append("...")
+                token = token[:-3].rstrip(".")
+            if token.endswith("."):
+                if token in ABBREVIATIONS or RE_ABBR1.match(token) or RE_ABBR2.match(token) or RE_ABBR3.match(token):
+                    break
+                tail.append(token[-1])
+                token = token[:-1]
+        if token != "":
+            tokens.append(token)
+        tokens.extend(reversed(tail))
+
+    def sentences(self, tokens, with_line_breaks):
+        """
+        Joins the tokens of each sentence with a space and the sentences with two, so the
+        emoticons and (!), that pattern matches in each sentence, are not matched across them.
+        The line breaks that end sentences are dropped
+        """
+        sentences = []
+        i = j = 0
+        for end in [j for j, token in enumerate(tokens) if token in self.sentence_ends]:
+            if end < j:
+                continue
+            j = end
+            while j < len(tokens) and tokens[j] in self.sentence_trailers:
+                j += 1
+            if with_line_breaks:
+                sentences.append(" ".join(token for token in tokens[i:j] if token != EOS))
+            else:
+                sentences.append(" ".join(tokens[i:j]))
+            i = j
+        sentences.append(" ".join(tokens[i:]))
+        return "  ".join(sentences)
+
+    def assessments(self, tokens):
+        """
+        Returns the [polarity, intensity, negated] of the lexicon words and emoticons of tokens.
+        A word preceded by a modifier ("very good") is one assessment scaled by the intensity
+        of the modifier, a negation ("not good") inverts it, and "!" boosts the last one
+        """
+        assessments = []
+        modifier = None
+        negation = None
+        for word in tokens:
+            known = self.words.get(word)
+            if known != None:
+                polarity, intensity, is_modifier = known
+                if modifier == None:
+                    assessments.append([polarity, intensity, False])
+                else:
+                    last = assessments[-1]
+                    last[POLARITY] = max(-1.0, min(polarity * last[INTENSITY], +1.0))
+                    last[INTENSITY] = intensity
+                if negation != None:
+                    assessments[-1][INTENSITY] = 1.0 / assessments[-1][INTENSITY]
+                    assessments[-1][NEGATED] = True
+                modifier = word if is_modifier else None
+                negation = word if word in NEGATIONS else None
+                continue
+            if word in NEGATIONS:
+                negation = word
+            elif negation and len(word.strip("'")) > 1:
+                negation = None
+            if negation != None and modifier != None and modifier.endswith(MODIFIER_SUFFIX):
+                assessments[-1][NEGATED] = True
+                negation = None
+            elif modifier and len(word) > 2:
+                modifier = None
+            if word == EXCLAMATION and len(assessments) > 0:
+                assessments[-1][POLARITY] = max(-1.0, min(assessments[-1][POLARITY] * EXCLAMATION_BOOST, +1.0))
+            if word == IRONY:
+                assessments.append([0.0, 1.0, False])
+            emoticon = self.emoticons.get(word)
+            if emoticon != None:
+                assessments.append([emoticon, 1.0, False])
+        return assessments
+
+    def polarities(self, textos):
+        """
+        Returns the mean polarity of the assessments of each text, 0 if it has none and None
+        if it is not a text
+        """
+        texts = []
+        polarities = []
+        negated = []
+        for i, texto in enumerate(textos):
+            if not isinstance(texto, str):
+                continue
+            for assessment in self.assessments(self.tokens(texto)):
+                texts.append(i)
+                polarities.append(assessment[POLARITY])
+                negated.append(assessment[NEGATED])
+        polarities = np.array(polarities, dtype=np.float64)
+        polarities = np.where(np.array(negated, dtype=bool), polarities * NEGATED_POLARITY_FACTOR, polarities)
+        texts = np.array(texts, dtype=np.int64)
+        sums = np.bincount(texts, weights=polarities, minlength=len(textos))
+        counts = np.bincount(texts, minlength=len(textos))
+        means = (sums / np.maximum(counts, 1)).tolist()
+        return [mean if isinstance(texto, str) else None for texto, mean in zip(textos, means)]
+
+def default_lexicon():
+    global _lexicon
+    if _lexicon == None:
+        _lexicon = PolarityLexicon.new()
+    return _lexicon
+
+def batch_lexicon_analysis(textos):
+    return default_lexicon().polarities(textos)
+
+# Reviews and the polarity TextBlob 0.20 computes for them
+GOLDEN_REVIEWS = [
+    ('This book was great, I loved it!', 0.8375),
+    ('Not good. The plot is boring and the characters are flat.', -0.4583333333333333),
+    ('A very good read, really enjoyable.', 0.705),
+    ("I didn't like it at all, it's a terrible and badly written book.", -0.8499999999999999),
+    ('Never thought a history book could be this interesting!!', 0.78125),
+    ('Absolutely wonderful :) highly recommended', 0.5533333333333333),
+    ("The ending made me cry :'( but it was beautiful", -0.07500000000000001),
+    ('Meh. Not bad, not great either.', -0.02500000000000005),
+    ('Amazing story (!) if you like reading the same page twice', 0.20000000000000004),
+    ('It was extremely slow, unfortunately not very well edited.', -0.2),
+    ('The author, e.g. in chapter 3, is just brilliant... Mr. Smith is the best', 0.95),
+    ('"Best book ever" said nobody. Boring.', 0.0),
+    ('Good\n\nBad\n\nUgly', -0.23333333333333328),
+    ('I love this book <3 <3', 0.8333333333333334),
+    ('Horrible translation. Would not recommend :(', -0.875),
+    ('', 0.0),
+    ('12345', 0.0),
+    ('The recipes are easy to follow and the photos are gorgeous; a must have for any kitchen.', 0.5666666666666667),
+    ('Not very interesting, but the illustrations are nice ;)', 0.21923076923076923),
+    ('The second half is surprisingly funny and the first half is painfully dull.', -0.02083333333333333),
+]
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+
+    class TestPolarityLexicon(TestCase):
+        def setUp(self):
+            self.lexicon = default_lexicon()
+            if self.lexicon == None:
+                self.skipTest("textblob and numpy are not installed")
+
+        def test_golden_reviews_polarities(self):
+            polarities = self.lexicon.polarities([texto for texto, _ in GOLDEN_REVIEWS])
+            for (texto, expected), polarity in zip(GOLDEN_REVIEWS, polarities):
+                self.assertAlmostEqual(polarity, expected, delta=POLARITY_TOLERANCE, msg=texto)
+
+        def test_tokens(self):
+            self.assertEqual(self.lexicon.tokens("I didn't like it, e.g. the end... :) (!)"), ["i", "did", "n", "'", "t", "like", "it", ",", "e.g.", "the", "end", "...", ":)", "(!)"])
+
+        def test_not_texts_have_no_polarity(self):
+            self.assertEqual(self.lexicon.polarities([None, "", "great"]), [None, 0.0, 0.8])
+
+    unittest.main()
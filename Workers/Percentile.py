@@ -0,0 +1,177 @@
+import os
+import random
+from array import array
+
+# The P² sketch keeps the minimum, the maximum, the quantile and the middle points between them
+SKETCH_MARKERS = 5
+
+class QuantileSketch():
+    """
+    Streaming estimate of a quantile with the P² algorithm (Jain and Chlamtac): five markers
+    whose heights are adjusted with a parabolic interpolation as values are added, without
+    keeping the values
+    """
+    def __init__(self, quantile):
+        self.quantile = quantile
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired_positions = [1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5]
+        self.increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def add(self, value):
+        heights = self.heights
+        if len(heights) < SKETCH_MARKERS:
+            heights.append(value)
+            heights.sort()
+            return
+        if value < heights[0]:
+            heights[0] = value
+            marker = 0
+        elif value >= heights[-1]:
+            heights[-1] = value
+            marker = SKETCH_MARKERS - 2
+        else:
+            marker = 0
+            while value >= heights[marker + 1]:
+                marker += 1
+        for i in range(marker + 1, SKETCH_MARKERS):
+            self.positions[i] += 1
+        for i in range(SKETCH_MARKERS):
+            self.desired_positions[i] += self.increments[i]
+        for i in range(1, SKETCH_MARKERS - 1):
+            self.adjust(i)
+
+    def adjust(self, i):
+        heights = self.heights
+        positions = self.positions
+        distance = self.desired_positions[i] - positions[i]
+        if (distance >= 1 and positions[i + 1] - positions[i] > 1) or (distance <= -1 and positions[i - 1] - positions[i] < -1):
+            step = 1 if distance > 0 else -1
+            height = heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+                (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+                + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1]))
+            if not heights[i - 1] < height < heights[i + 1]:
+                height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+            heights[i] = height
+            positions[i] += step
+
+    def estimate(self):
+        if len(self.heights) == 0:
+            return None
+        if len(self.heights) < SKETCH_MARKERS:
+            return self.heights[int(len(self.heights) * self.quantile)]
+        return self.heights[2]
+
+def select(values, k):
+    """
+    Returns the k-th smallest of values in O(n) average time, with quickselect
+    """
+    values = list(values)
+    while True:
+        if len(values) == 1:
+            return values[0]
+        pivot = values[random.randrange(len(values))]
+        smaller = [value for value in values if value < pivot]
+        if k < len(smaller):
+            values = smaller
+            continue
+        larger = [value for value in values if value > pivot]
+        if k < len(values) - len(larger):
+            return pivot
+        k -= len(values) - len(larger)
+        values = larger
+
+class PercentileEngine():
+    """
+    Titles and their values in arrival order, the values in a compact array of doubles.
+    The percentile cutoff is computed once, at the end, selecting it in O(n), and only the
+    titles over the cutoff are sorted. With a sketch, an estimate of the cutoff is available
+    as the values are added
+    """
+    def __init__(self, percentile, sketch):
+        self.percentile = percentile
+        self.titles = []
+        self.values = array('d')
+        self.sketch = sketch
+
+    @classmethod
+    def new(cls, percentile, with_sketch=False):
+        sketch = None
+        if with_sketch:
+            sketch = QuantileSketch(percentile / 100)
+        return PercentileEngine(percentile, sketch)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, title, value):
+        self.titles.append(title)
+        self.values.append(value)
+        if self.sketch != None:
+            self.sketch.add(value)
+
+    def extend(self, entries):
+        for title, value in entries:
+            self.add(title, value)
+
+    def cutoff_index(self):
+        return int(len(self.values) * (self.percentile / 100))
+
+    def cutoff(self):
+        if len(self.values) == 0:
+            return None
+        return select(self.values, self.cutoff_index())
+
+    def estimated_cutoff(self):
+        if self.sketch == None:
+            return None
+        return self.sketch.estimate()
+
+    def top(self):
+        """
+        Returns the (title, value) of the values greater or equal than the cutoff, by value and
+        in arrival order if equal
+        """
+        cutoff = self.cutoff()
+        if cutoff == None:
+            return []
+        top = [i for i, value in enumerate(self.values) if value >= cutoff]
+        top.sort(key=self.values.__getitem__)
+        return [(self.titles[i], self.values[i]) for i in top]
+
+def percentile_sketch_from_env():
+    return bool(os.getenv("PERCENTILE_SKETCH"))
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+
+    class TestPercentileEngine(TestCase):
+        def test_select(self):
+            values = [random.random() for _ in range(1000)] + [0.5] * 100
+            for k in [0, 1, 500, 550, 1099]:
+                self.assertEqual(select(values, k), sorted(values)[k])
+
+        def test_top_is_sorted_with_ties_in_arrival_order(self):
+            engine = PercentileEngine.new(50)
+            engine.extend([("a", 0.3), ("b", 0.9), ("c", 0.1), ("d", 0.3), ("e", 0.5), ("f", 0.3)])
+            self.assertEqual(engine.cutoff(), 0.3)
+            self.assertEqual(engine.top(), [("a", 0.3), ("d", 0.3), ("f", 0.3), ("e", 0.5), ("b", 0.9)])
+
+        def test_empty_engine_has_no_top(self):
+            self.assertEqual(PercentileEngine.new(90).top(), [])
+
+        def test_sketch_estimates_the_cutoff(self):
+            engine = PercentileEngine.new(90, with_sketch=True)
+            for i in range(10000):
+                engine.add(str(i), random.uniform(-1, 1))
+            self.assertAlmostEqual(engine.estimated_cutoff(), engine.cutoff(), delta=0.05)
+
+        def test_sketch_of_a_few_values(self):
+            sketch = QuantileSketch(0.9)
+            self.assertEqual(sketch.estimate(), None)
+            for value in [3.0, 1.0, 2.0]:
+                sketch.add(value)
+            self.assertEqual(sketch.estimate(), 3.0)
+
+    unittest.main()
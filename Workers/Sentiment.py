@@ -0,0 +1,334 @@
+import os
+import hashlib
+import struct
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+from .LexiconSentiment import batch_lexicon_analysis, default_lexicon
+try:
+    from textblob import TextBlob
+except:
+    pass
+
+INLINE_SENTIMENT_ANALYSIS = 1
+TEXTBLOB_SENTIMENT_ENGINE = 'textblob'
+LEXICON_SENTIMENT_ENGINE = 'lexicon'
+NO_POLARITY_CACHE = 0
+POLARITY_CACHE_FILENAME = 'polarity_cache.bin'
+POLARITY_CACHE_TEMP_SUFFIX = '.writing'
+POLARITY_CACHE_REPORT_INTERVAL = 2**16
+# Every persisted polarity is the digest of its text and the polarity
+TEXT_DIGEST_SIZE = 16
+POLARITY_RECORD = struct.Struct(f'>{TEXT_DIGEST_SIZE}sd')
+# The persisted file is rewritten with only the cached polarities once it has this many times more records
+POLARITY_CACHE_REWRITE_RATIO = 2
+
+def sentiment_analysis(texto):
+    if isinstance(texto, str):
+        blob = TextBlob(texto)
+        sentimiento = blob.sentiment.polarity
+        return sentimiento
+    else:
+        return None
+
+def batch_sentiment_analysis(textos):
+    return [sentiment_analysis(texto) for texto in textos]
+
+SENTIMENT_ANALYSERS = {
+    TEXTBLOB_SENTIMENT_ENGINE: batch_sentiment_analysis,
+    LEXICON_SENTIMENT_ENGINE: batch_lexicon_analysis,
+}
+
+def text_digest(texto):
+    return hashlib.blake2b(texto.encode(), digest_size=TEXT_DIGEST_SIZE).digest()
+
+class PolarityCache():
+    """
+    LRU cache of the polarity of the last size review texts, by the digest of the text.
+    If it has a path, the polarities added are appended to it after each batch and loaded on 
+    restart. Losing the last ones only costs computing them again, so the file is not synced
+    """
+    def __init__(self, size):
+        self.size = size
+        self.polarities = OrderedDict() # {digest: polarity}
+        self.hits = 0
+        self.misses = 0
+        self.path = None
+        self.persisted_records = 0
+        self.pending_records = bytearray()
+
+    def get(self, digest):
+        polarity = self.polarities.get(digest)
+        if polarity == None:
+            self.misses += 1
+            return None
+        self.polarities.move_to_end(digest)
+        self.hits += 1
+        return polarity
+
+    def put(self, digest, polarity):
+        self.polarities[digest] = polarity
+        self.polarities.move_to_end(digest)
+        if len(self.polarities) > self.size:
+            self.polarities.popitem(last=False)
+        if self.path != None:
+            self.pending_records.extend(POLARITY_RECORD.pack(digest, polarity))
+
+    def load(self, path):
+        """
+        Loads the persisted polarities and appends the new ones to path from now on
+        """
+        self.path = path
+        try:
+            with open(path, 'rb') as file:
+                records = file.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Could not load the polarity cache: {e}")
+            return
+        complete_size = len(records) - len(records) % POLARITY_RECORD.size
+        for digest, polarity in POLARITY_RECORD.iter_unpack(memoryview(records)[:complete_size]):
+            self.polarities[digest] = polarity
+            self.polarities.move_to_end(digest)
+            if len(self.polarities) > self.size:
+                self.polarities.popitem(last=False)
+        self.persisted_records = complete_size // POLARITY_RECORD.size
+        if complete_size < len(records) or self.persisted_records > self.size * POLARITY_CACHE_REWRITE_RATIO:
+            self.rewrite()
+
+    def rewrite(self):
+        temp_path = self.path + POLARITY_CACHE_TEMP_SUFFIX
+        with open(temp_path, 'wb') as file:
+            for digest, polarity in self.polarities.items():
+                file.write(POLARITY_RECORD.pack(digest, polarity))
+        os.replace(temp_path, self.path)
+        self.persisted_records = len(self.polarities)
+        self.pending_records = bytearray()
+
+    def persist(self):
+        if self.path == None or len(self.pending_records) == 0:
+            return
+        try:
+            if self.persisted_records + len(self.pending_records) // POLARITY_RECORD.size > self.size * POLARITY_CACHE_REWRITE_RATIO:
+                self.rewrite()
+                return
+            with open(self.path, 'ab') as file:
+                file.write(self.pending_records)
+            self.persisted_records += len(self.pending_records) // POLARITY_RECORD.size
+        except OSError as e:
+            print(f"Could not persist the polarity cache: {e}")
+        self.pending_records = bytearray()
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        print(f"[Sentiment] polarity cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), {len(self.polarities)}/{self.size} entries")
+
+    def report_periodically(self, lookups):
+        total_lookups = self.hits + self.misses
+        if total_lookups // POLARITY_CACHE_REPORT_INTERVAL != (total_lookups - lookups) // POLARITY_CACHE_REPORT_INTERVAL:
+            self.report()
+
+class SentimentEngine():
+    """
+    Computes the polarity of the review texts of a batch. With more than one process the texts
+    are split in one chunk per process of a ProcessPoolExecutor, and the polarities are
+    returned in the order of the texts. With a polarity cache only the texts that are not 
+    cached are analysed, once each. The analyser computes the polarities of a list of texts
+    """
+    def __init__(self, processes, executor, cache_size=NO_POLARITY_CACHE, analyser=batch_sentiment_analysis):
+        self.processes = processes
+        self.executor = executor
+        self.analyser = analyser
+        self.cache = None
+        if cache_size != NO_POLARITY_CACHE:
+            self.cache = PolarityCache(cache_size)
+
+    @classmethod
+    def new(cls, processes, cache_size=NO_POLARITY_CACHE, analyser=batch_sentiment_analysis):
+        # Whatever the analyser loads on its first call is loaded before forking
+        analyser([])
+        if processes <= INLINE_SENTIMENT_ANALYSIS:
+            return SentimentEngine(INLINE_SENTIMENT_ANALYSIS, None, cache_size, analyser)
+        # The main module of the workers is not importable, so the processes are forked.
+        # They are all forked on the first submit, before the worker connects to the MOM
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'))
+        executor.submit(analyser, []).result()
+        return SentimentEngine(processes, executor, cache_size, analyser)
+
+    def load_cache(self, path):
+        if self.cache != None:
+            self.cache.load(path)
+
+    def polarities(self, textos):
+        if self.cache == None:
+            return self.analyse(textos)
+        lookups = self.cache.hits + self.cache.misses
+        polarities = [None] * len(textos)
+        missing = {} # {digest: positions of its text}
+        missing_textos = []
+        for i, texto in enumerate(textos):
+            if not isinstance(texto, str):
+                continue
+            digest = text_digest(texto)
+            if digest in missing:
+                missing[digest].append(i)
+                self.cache.hits += 1
+                continue
+            polarity = self.cache.get(digest)
+            if polarity != None:
+                polarities[i] = polarity
+                continue
+            missing[digest] = [i]
+            missing_textos.append(texto)
+        for (digest, positions), polarity in zip(missing.items(), self.analyse(missing_textos)):
+            self.cache.put(digest, polarity)
+            for i in positions:
+                polarities[i] = polarity
+        self.cache.persist()
+        self.cache.report_periodically(self.cache.hits + self.cache.misses - lookups)
+        return polarities
+
+    def analyse(self, textos):
+        if self.executor == None or len(textos) <= 1:
+            return self.analyser(textos)
+        chunk_size = -(-len(textos) // self.processes)
+        chunks = [textos[i:i + chunk_size] for i in range(0, len(textos), chunk_size)]
+        try:
+            return list(chain.from_iterable(self.executor.map(self.analyser, chunks)))
+        except BrokenProcessPool as e:
+            print(f"Sentiment analysis processes stopped, analysing in the worker process: {e}")
+            self.executor = None
+            return self.analyser(textos)
+
+    def close(self):
+        if self.cache != None:
+            self.cache.report()
+        if self.executor != None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+def sentiment_processes_from_env():
+    sentiment_processes = os.getenv("SENTIMENT_PROCESSES")
+    if not sentiment_processes:
+        return INLINE_SENTIMENT_ANALYSIS
+    try:
+        return max(int(sentiment_processes), INLINE_SENTIMENT_ANALYSIS)
+    except ValueError as e:
+        print(f"Invalid SENTIMENT_PROCESSES, analysing in the worker process: {e}")
+        return INLINE_SENTIMENT_ANALYSIS
+
+def sentiment_analyser_from_env():
+    sentiment_engine = os.getenv("SENTIMENT_ENGINE") or TEXTBLOB_SENTIMENT_ENGINE
+    if sentiment_engine not in SENTIMENT_ANALYSERS:
+        print(f"Invalid SENTIMENT_ENGINE {sentiment_engine}, using {TEXTBLOB_SENTIMENT_ENGINE}")
+        return batch_sentiment_analysis
+    if sentiment_engine == LEXICON_SENTIMENT_ENGINE and default_lexicon() == None:
+        print(f"Could not use the {LEXICON_SENTIMENT_ENGINE} sentiment engine, using {TEXTBLOB_SENTIMENT_ENGINE}")
+        return batch_sentiment_analysis
+    return SENTIMENT_ANALYSERS[sentiment_engine]
+
+def polarity_cache_size_from_env():
+    polarity_cache_size = os.getenv("POLARITY_CACHE_SIZE")
+    if not polarity_cache_size:
+        return NO_POLARITY_CACHE
+    try:
+        return max(int(polarity_cache_size), NO_POLARITY_CACHE)
+    except ValueError as e:
+        print(f"Invalid POLARITY_CACHE_SIZE, not caching polarities: {e}")
+        return NO_POLARITY_CACHE
+
+def polarity_cache_persisted_from_env():
+    return bool(os.getenv("PERSIST_POLARITY_CACHE"))
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+    import tempfile
+
+    class TestPolarityCache(TestCase):
+        def test_least_recently_used_is_evicted(self):
+            cache = PolarityCache(2)
+            cache.put(text_digest("a"), 0.5)
+            cache.put(text_digest("b"), -0.5)
+            self.assertEqual(cache.get(text_digest("a")), 0.5)
+            cache.put(text_digest("c"), 0.0)
+            self.assertEqual(cache.get(text_digest("b")), None)
+            self.assertEqual(cache.get(text_digest("c")), 0.0)
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        def test_persisted_polarities_are_loaded(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, POLARITY_CACHE_FILENAME)
+                cache = PolarityCache(2)
+                cache.load(path)
+                cache.put(text_digest("a"), 0.5)
+                cache.persist()
+                cache.put(text_digest("b"), -0.5)
+                cache.put(text_digest("c"), 0.25)
+                cache.persist()
+                loaded_cache = PolarityCache(2)
+                loaded_cache.load(path)
+                self.assertEqual(list(loaded_cache.polarities.items()), [(text_digest("b"), -0.5), (text_digest("c"), 0.25)])
+
+        def test_persisted_file_is_rewritten(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, POLARITY_CACHE_FILENAME)
+                cache = PolarityCache(2)
+                cache.load(path)
+                for i in range(10):
+                    cache.put(text_digest(str(i)), float(i))
+                    cache.persist()
+                self.assertLessEqual(os.path.getsize(path), 2 * POLARITY_CACHE_REWRITE_RATIO * POLARITY_RECORD.size)
+                loaded_cache = PolarityCache(2)
+                loaded_cache.load(path)
+                self.assertEqual(list(loaded_cache.polarities.values()), [8.0, 9.0])
+
+        def test_partial_record_is_discarded(self):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, POLARITY_CACHE_FILENAME)
+                with open(path, 'wb') as file:
+                    file.write(POLARITY_RECORD.pack(text_digest("a"), 0.5))
+                    file.write(b"partial")
+                cache = PolarityCache(2)
+                cache.load(path)
+                self.assertEqual(cache.get(text_digest("a")), 0.5)
+                self.assertEqual(os.path.getsize(path), POLARITY_RECORD.size)
+
+    def checksum_analysis(textos):
+        return [sum(map(ord, texto)) % 200 / 100 - 1 if isinstance(texto, str) else None for texto in textos]
+
+    class TestSentimentEngine(TestCase):
+        TEXTOS = ["Great book", "", "Boring and way too long", None, "Not bad", "", "I loved it", "Great book", "Meh"]
+
+        def assert_same_polarities(self, analyser, processes=4, cache_size=NO_POLARITY_CACHE):
+            inline = SentimentEngine.new(INLINE_SENTIMENT_ANALYSIS, cache_size, analyser)
+            pool = SentimentEngine.new(processes, cache_size, analyser)
+            try:
+                self.assertNotEqual(pool.executor, None)
+                for amount in [len(self.TEXTOS), processes - 1, 2, 1, 0]:
+                    textos = self.TEXTOS[:amount]
+                    polarities = pool.polarities(textos)
+                    self.assertEqual(polarities, inline.polarities(textos))
+                    self.assertEqual(polarities, analyser(textos))
+            finally:
+                inline.close()
+                pool.close()
+
+        def test_processes_keep_the_order_of_the_batch(self):
+            self.assert_same_polarities(checksum_analysis)
+
+        def test_processes_with_cache_keep_the_order_of_the_batch(self):
+            self.assert_same_polarities(checksum_analysis, cache_size=4)
+
+        def test_textblob_processes_keep_the_order_of_the_batch(self):
+            try:
+                TextBlob("")
+            except NameError:
+                self.skipTest("textblob is not installed")
+            self.assert_same_polarities(batch_sentiment_analysis, processes=3)
+
+    unittest.main()
@@ -0,0 +1,94 @@
+from array import array
+
+class StringTable():
+    """
+    The strings of the contexts of a worker, each one kept once with an integer id, so the
+    contexts of every client share the same string objects and can keep ids in arrays
+    instead of strings
+    """
+    def __init__(self):
+        self.ids = {} # {string: id}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def id(self, string):
+        id = self.ids.get(string, None)
+        if id == None:
+            id = len(self.strings)
+            self.ids[string] = id
+            self.strings.append(string)
+        return id
+
+    def intern(self, string):
+        return self.strings[self.id(string)]
+
+    def string(self, id):
+        return self.strings[id]
+
+    def clear(self):
+        self.ids = {}
+        self.strings = []
+
+class ColumnarContext():
+    """
+    Values of the keys of a client context by column, each column an array of one type,
+    and the row of each key in a dict, instead of a list of values by key
+    """
+    def __init__(self, typecodes):
+        self.rows = {} # {key: row}
+        self.columns = [array(typecode) for typecode in typecodes]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def row(self, key):
+        return self.rows.get(key, None)
+
+    def values(self, row):
+        return [column[row] for column in self.columns]
+
+    def set(self, key, values):
+        """
+        Sets the values of key, adding a row if it is new. Returns its row
+        """
+        row = self.rows.get(key, None)
+        if row == None:
+            row = len(self.rows)
+            self.rows[key] = row
+            for column, value in zip(self.columns, values):
+                column.append(value)
+            return row
+        for column, value in zip(self.columns, values):
+            column[row] = value
+        return row
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+
+    class TestStringTable(TestCase):
+        def test_interned_strings_are_shared(self):
+            table = StringTable()
+            first = table.intern(''.join(["Dr. ", "Seuss"]))
+            second = table.intern(''.join(["Dr. Se", "uss"]))
+            self.assertIs(first, second)
+            self.assertEqual(table.id("otro"), 1)
+            self.assertEqual(table.string(1), "otro")
+            self.assertEqual(len(table), 2)
+
+        def test_columnar_context(self):
+            context = ColumnarContext(['L', 'd'])
+            self.assertEqual(context.set("a", [1, 2.5]), 0)
+            self.assertEqual(context.set("b", [2, 0.5]), 1)
+            context.set("a", [3, 4.0])
+            self.assertIn("b", context)
+            self.assertEqual(context.row("c"), None)
+            self.assertEqual(context.values(context.row("a")), [3, 4.0])
+            self.assertEqual(len(context), 2)
+
+    unittest.main()
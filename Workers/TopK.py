@@ -0,0 +1,133 @@
+import heapq
+import operator
+from itertools import islice
+
+class TopK():
+    """
+    The k keys with the largest values, in a heap of (value, key) tuples so heapq compares
+    them without calling Python code, and the key only breaks ties between equal values.
+    A key only replaces the smallest one if its value is strictly larger.
+    The keys added and evicted are tracked until the next delta, so a key added and evicted
+    between two deltas is never written
+    """
+    def __init__(self, k):
+        self.k = k
+        self.heap = [] # [(value, key)]
+        self.added = {} # {key: value}
+        self.evicted = {} # {key: value}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def offer(self, key, value):
+        """
+        Adds key if it is among the k largest values so far. Returns if it was added
+        """
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (value, key))
+        elif self.heap[0][0] < value:
+            evicted_value, evicted_key = heapq.heapreplace(self.heap, (value, key))
+            if evicted_key in self.added:
+                self.added.pop(evicted_key)
+            else:
+                self.evicted[evicted_key] = evicted_value
+        else:
+            return False
+        self.added[key] = value
+        return True
+
+    def offer_all(self, entries):
+        """
+        Offers all the (key, value) entries, skipping the ones that are not larger than the 
+        smallest one without a call
+        """
+        heap = self.heap
+        for key, value in entries:
+            if len(heap) < self.k or heap[0][0] < value:
+                self.offer(key, value)
+
+    def merge(self, entries):
+        """
+        Merges a run of (key, value) entries sorted by value in descending order, as the top-K
+        that the partial stages send, stopping at the first one that does not enter, as the 
+        next ones can not enter either. If entries are not sorted they are all offered
+        """
+        values = [value for _, value in entries]
+        if not all(map(operator.ge, values, islice(values, 1, None))):
+            return self.offer_all(entries)
+        heap = self.heap
+        for key, value in entries:
+            if len(heap) == self.k and heap[0][0] >= value:
+                break
+            self.offer(key, value)
+
+    def extend(self, entries):
+        """
+        Adds the entries of a loaded context, that are already persisted
+        """
+        self.heap.extend((value, key) for key, value in entries)
+        heapq.heapify(self.heap)
+
+    def delta(self):
+        """
+        Returns the (key, old value, new value) of the keys added and evicted since the last
+        delta, with None as the old value of new keys and the new value of evicted ones
+        """
+        delta = []
+        for key, value in self.added.items():
+            delta.append((key, self.evicted.pop(key, None), value))
+        for key, value in self.evicted.items():
+            delta.append((key, value, None))
+        self.added = {}
+        self.evicted = {}
+        return delta
+
+    def sorted_by_key(self):
+        return sorted((key, value) for value, key in self.heap)
+
+    def sorted_by_value(self):
+        """
+        Returns the (key, value) entries as a run, by value in descending order
+        """
+        return [(key, value) for value, key in sorted(self.heap, reverse=True)]
+
+if __name__ == '__main__':
+    import unittest
+    from unittest import TestCase
+
+    class TestTopK(TestCase):
+        def test_keeps_the_largest_values(self):
+            top_k = TopK(2)
+            for key, value in [("a", 1.0), ("b", 3.0), ("c", 2.0), ("d", 2.0), ("e", 0.5)]:
+                top_k.offer(key, value)
+            self.assertEqual(top_k.sorted_by_key(), [("b", 3.0), ("c", 2.0)])
+
+        def test_delta_skips_keys_added_and_evicted(self):
+            top_k = TopK(2)
+            top_k.extend([("a", 1.0), ("b", 2.0)])
+            top_k.offer("c", 3.0)
+            top_k.offer("d", 4.0)
+            top_k.offer("e", 5.0)
+            self.assertEqual(sorted(top_k.delta(), key=lambda entry: entry[0]), [("a", 1.0, None), ("b", 2.0, None), ("d", None, 4.0), ("e", None, 5.0)])
+            self.assertEqual(top_k.delta(), [])
+
+        def test_evicted_key_added_again_is_updated(self):
+            top_k = TopK(1)
+            top_k.extend([("a", 1.0)])
+            top_k.offer("b", 2.0)
+            top_k.offer("a", 3.0)
+            self.assertEqual(top_k.delta(), [("a", 1.0, 3.0)])
+
+        def test_merge_runs(self):
+            top_k = TopK(3)
+            runs = [[("a", 5.0), ("b", 3.0), ("c", 1.0)], [("d", 4.0), ("e", 2.0), ("f", 0.5)], [("g", 6.0), ("h", 0.1)]]
+            for run in runs:
+                top_k.merge(run)
+            self.assertEqual(top_k.sorted_by_value(), [("g", 6.0), ("a", 5.0), ("d", 4.0)])
+
+        def test_merge_offers_all_if_not_sorted(self):
+            top_k = TopK(2)
+            top_k.merge([("a", 1.0), ("b", 2.0), ("c", 3.0)])
+            self.assertEqual(top_k.sorted_by_key(), [("b", 2.0), ("c", 3.0)])
+
+    unittest.main()
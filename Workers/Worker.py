@@ -4,24 +4,40 @@ import os
 from abc import ABC, abstractmethod
 import signal
 import socket
+import time
 
 from CommunicationMiddleware.middleware import Communicator
 from Persistance.log import *
-from Persistance.KeyValueStorage import KeyValueStorage
+from Persistance.KeyValueStorage import KeyValueStorage, storage_class_from_env, FILE_STORAGE_BACKEND, SNAPSHOT_STORAGE_BACKEND
+from Persistance.RecordStorage import RecordStorage, COMPACTION_SUFFIX
+from Persistance.SnapshotStorage import SnapshotStorage, SNAPSHOT_EXTENSION, SNAPSHOT_TEMP_SUFFIX
 from utils.SenderID import SenderID
-from utils.Batch import Batch, SeqNumGenerator
+from utils.Batch import Batch, SeqNumGenerator, AMOUNT_OF_MESSAGES_MASK
 from utils.auxiliar_functions import append_extend
 from utils.QueryMessage import query_to_query_result
 from utils.NextPools import NextPools, GATEWAY_QUEUE_NAME 
+from .StringTable import StringTable
 from Persistance.MetadataHandler import MetadataHandler, METADATA_FILENAME
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 
 PERSISTANCE_PATH = '/persistance_files/'
 LOG_FILENAME = 'log.bin'
+DELTA_LOG_FILENAME = 'deltas.bin'
 CLIENT_CONTEXT_FILENAME = 'client_context'
 SCALE_SEPARATOR = '_S'
+# Record storages keep the whole context of a client in a single file without a scale,
+# and the sizes of strings that depend on the scale are not used
+VARIABLE_LENGTH_SCALE = 0
 
 BATCH_SIZE = 512
+NO_CONSUME_GROUPS = 1
+# A group holds at most as many messages as a batch can have
+MAX_CONSUME_GROUP_SIZE = AMOUNT_OF_MESSAGES_MASK // BATCH_SIZE
+GROUP_CONSUME_WAIT = 0.05
+# Without an interval the context is written to its storages on every batch
+NO_CHECKPOINTS = 0
+SEQUENTIAL_CONTEXT_LOADING = 1
 
 class Worker(ABC):
     def __init__(self, id, next_pools, eof_to_receive):
@@ -36,9 +52,24 @@ class Worker(ABC):
         self.client_context_storage_updates = {} # {client{key: (old_value, new value)}}
         self.client_contexts = {} # {client {depende del accum}}
         self.client_contexts_storage = {}
+        self.string_table = StringTable()
 
         self.metadata_handler = None
         self.logger = None
+        self.lazy_decoding = False
+        self.consume_group_size = consume_group_size_from_env()
+        self.deferred_batch = None
+        self.checkpoint_batches, self.checkpoint_seconds = checkpoint_interval_from_env()
+        self.storage_class = storage_class_from_env()
+        if self.storage_class == SnapshotStorage and not self.checkpointing():
+            # Every apply rewrites the whole snapshot, so it is only written on checkpoints
+            print(f"[Worker {self.id}] STORAGE_BACKEND={SNAPSHOT_STORAGE_BACKEND} needs CHECKPOINT_BATCHES or CHECKPOINT_SECONDS, using {FILE_STORAGE_BACKEND}")
+            self.storage_class = KeyValueStorage
+        self.context_loaders = context_loaders_from_env()
+        self.delta_logger = None
+        self.pending_checkpoint = {} # {filename: {key: new_value}}
+        self.batches_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
         signal.signal(signal.SIGTERM, self.handle_SIGTERM)
         
     @classmethod
@@ -59,33 +90,86 @@ class Worker(ABC):
     def add_previous_context(self, previous_context, client_id):
         pass
 
-    def load_context(self, path, filename,  client_id, scale_of_update_file):
-        storage_types, storage_types_size = self.get_context_storage_types(scale_of_update_file)
-        self.client_contexts_storage[client_id][filename] = KeyValueStorage.new(
-            path, str, 2**scale_of_update_file, storage_types, storage_types_size)
-        previous_context = self.client_contexts_storage[client_id][filename].get_all_entries()
-        if not self.client_contexts_storage[client_id][filename] or previous_context == None:
+    def context_filename(self, client_id, scale_of_update_file):
+        if self.storage_class == RecordStorage:
+            return CLIENT_CONTEXT_FILENAME + str(client_id) + '.bin'
+        if self.storage_class == SnapshotStorage:
+            return CLIENT_CONTEXT_FILENAME + str(client_id) + SNAPSHOT_EXTENSION
+        return CLIENT_CONTEXT_FILENAME + str(client_id) + SCALE_SEPARATOR + str(scale_of_update_file) + '.bin'
+
+    def open_context_storage(self, path, scale_of_file):
+        """
+        Opens a context file with the storage that wrote it: a snapshot storage if it is a snapshot,
+        a record storage if its name has no scale
+        """
+        if path.endswith(SNAPSHOT_EXTENSION):
+            storage_class = SnapshotStorage
+            scale_of_file = VARIABLE_LENGTH_SCALE
+        elif scale_of_file == None:
+            storage_class = RecordStorage
+            scale_of_file = VARIABLE_LENGTH_SCALE
+        elif self.storage_class in (RecordStorage, SnapshotStorage):
+            storage_class = KeyValueStorage
+        else:
+            storage_class = self.storage_class
+        value_types, value_types_size = self.get_context_storage_types(scale_of_file)
+        if value_types == None or value_types_size == None:
+            return None
+        return storage_class.new(path, str, 2**scale_of_file, value_types, value_types_size)
+
+    def read_context(self, path, scale_of_update_file):
+        """
+        Opens a context file and reads all its entries. Returns the storage, the entries 
+        and the seconds it took, with None entries if it could not be read
+        """
+        start = time.perf_counter()
+        storage = self.open_context_storage(path, scale_of_update_file)
+        previous_context = None
+        if storage:
+            previous_context = storage.get_all_entries()
+        return storage, previous_context, time.perf_counter() - start
+
+    def is_context_file(self, filename):
+        if filename == METADATA_FILENAME + '.bin' or filename in (LOG_FILENAME, DELTA_LOG_FILENAME):
             return False
-        self.add_previous_context(previous_context, client_id)
-        return True
-    
+        return not filename.endswith((COMPACTION_SUFFIX, SNAPSHOT_TEMP_SUFFIX))
+
+    def context_files(self):
+        filenames = []
+        for filename in sorted(os.listdir(self.worker_dir())):
+            if self.is_context_file(filename) and os.path.isfile(os.path.join(self.worker_dir(), filename)):
+                filenames.append(filename)
+        return filenames
+
     def load_all_context(self):
+        """
+        Reads the context files with context_loaders threads, then adds their entries to 
+        the context of each client in order of filename
+        """
         self.client_context_storage_updates = {}
         self.client_contexts = {} 
         self.client_contexts_storage = {}
+        start = time.perf_counter()
         try:
-            for filename in os.listdir(self.worker_dir()):
-                if filename == METADATA_FILENAME + '.bin' or filename == LOG_FILENAME:
-                    continue
-                path = os.path.join(self.worker_dir(), filename)
-                if os.path.isfile(path):
-                    client_id, scale_of_file = info_from_filename(filename)
-                    self.client_contexts_storage[client_id] = self.client_contexts_storage.get(client_id, {})
-                    if not self.load_context(path, filename, client_id, scale_of_file):
-                        print(f"[Worker [{self.id}]]: Could not load context: {path}")
-                        return False
+            filenames = self.context_files()
+            paths = [os.path.join(self.worker_dir(), filename) for filename in filenames]
+            scales = [info_from_filename(filename)[1] for filename in filenames]
+            with ThreadPoolExecutor(self.context_loaders) as executor:
+                loaded_contexts = list(executor.map(self.read_context, paths, scales))
         except OSError as e:
             print(f"[Worker [{self.id}]]: Could not load context: {e}")
+            return True
+
+        for filename, path, (storage, previous_context, seconds) in zip(filenames, paths, loaded_contexts):
+            if previous_context == None:
+                print(f"[Worker [{self.id}]]: Could not load context: {path}")
+                return False
+            client_id, _scale_of_file = info_from_filename(filename)
+            self.client_contexts_storage.setdefault(client_id, {})[filename] = storage
+            self.add_previous_context(previous_context, client_id)
+            print(f"[Worker [{self.id}]]: Loaded {len(previous_context)} entries of {filename} in {seconds*1000:.1f} ms")
+        if len(filenames) > 0:
+            print(f"[Worker [{self.id}]]: Loaded {len(filenames)} context files with {self.context_loaders} threads in {(time.perf_counter() - start)*1000:.1f} ms")
         return True
 
     def worker_dir(self):
@@ -104,7 +188,7 @@ class Worker(ABC):
         return True
 
     def load_from_disk(self):
-        path = PERSISTANCE_PATH + self.id.__repr__() + '/'
+        path = self.worker_dir()
         try:
             if not os.path.exists(path):
                 os.makedirs(path)
@@ -120,10 +204,45 @@ class Worker(ABC):
         
         if not self.load_metadata():
             return False
-        return True
+        return self.load_deltas()
+
+    def checkpointing(self):
+        return self.checkpoint_batches != NO_CHECKPOINTS or self.checkpoint_seconds != NO_CHECKPOINTS
+
+    def load_deltas(self):
+        """
+        Opens the delta log and writes the deltas that the last execution did not checkpoint 
+        to their storages, reloading the context and metadata from them. The deltas of a batch
+        after its last FinishedWriting were not fully committed, so they are discarded
+        """
+        self.delta_logger = LogReadWriter.new(self.worker_dir() + DELTA_LOG_FILENAME)
+        if not self.delta_logger:
+            print(f"[Worker [{self.id}]] Failed to open delta log")
+            return False
+        batch_deltas = []
+        for log in self.delta_logger.read_all_logs():
+            if log.log_type != LogType.FinishedWriting:
+                batch_deltas.append(log)
+                continue
+            for delta in batch_deltas:
+                self.add_delta(delta.filename, delta.keys, delta.entries)
+            batch_deltas = []
+        if len(batch_deltas) > 0:
+            print(f"[Worker [{self.id}]] Discarding {len(batch_deltas)} deltas of a batch that was not committed")
+        if len(self.pending_checkpoint) == 0:
+            return True
+        print(f"[Worker [{self.id}]] Replaying the deltas of {len(self.pending_checkpoint)} files")
+        if not self.checkpoint():
+            return False
+        self.close_files()
+        return self.load_metadata() and self.load_all_context()
 
     def connect(self):
-        communicator = Communicator.new(self.signal_queue, self.next_pools.worker_ids(), False)
+        if self.consume_group_size == NO_CONSUME_GROUPS:
+            communicator = Communicator.new(self.signal_queue, self.next_pools.worker_ids(), False)
+        else:
+            communicator = Communicator.new(self.signal_queue, self.next_pools.worker_ids(), False, 
+                                            self.consume_group_size, inactivity_timeout=GROUP_CONSUME_WAIT)
         if not communicator:
             return False
         self.communicator = communicator
@@ -171,8 +290,7 @@ class Worker(ABC):
             message.msg_type = query_to_query_result(self.id.query)
         return message
 
-    def process_batch(self, batch):
-        results = []
+    def process_batch_messages(self, batch, results):
         if batch.is_empty():
             self.handle_eof(batch.client_id)
         else:
@@ -180,9 +298,26 @@ class Worker(ABC):
                 result = self.process_message(batch.client_id, message)
                 if result:
                     append_extend(results, result)
-        if len(results) > 0:
-            result_batch = Batch.new(batch.client_id, self.id, results)
-            return self.send_partial_results(result_batch)
+
+    def combine_results(self, results):
+        """
+        Returns the results to send of a batch or a group, by default as they are
+        """
+        return results
+
+    def process_batch(self, batch):
+        results = []
+        self.process_batch_messages(batch, results)
+        results = self.combine_results(results)
+        return self.send_results(batch.client_id, results)
+
+    def send_results(self, client_id, results):
+        """
+        Sends the results of a batch or a group in batchs of up to BATCH_SIZE messages
+        """
+        for i in range(0, len(results), BATCH_SIZE):
+            if not self.send_partial_results(Batch.new(client_id, self.id, results[i:i+BATCH_SIZE])):
+                return False
         return True
     
     def send_partial_results(self, batch):
@@ -195,6 +330,9 @@ class Worker(ABC):
     def receive_batch(self):
         worker_name = self.id.__repr__()
         return self.communicator.consume_message(worker_name)
+
+    def decode_batch(self, batch_bytes):
+        return Batch.from_bytes(batch_bytes, self.lazy_decoding)
         
     def start(self):
         if not self.load_from_disk(): 
@@ -214,6 +352,7 @@ class Worker(ABC):
     def remove_client(self, client_id):
         self.pending_eof.pop(client_id, None)
         self.remove_client_context(client_id)
+        self.rebuild_string_table()
         client_storage = self.client_contexts_storage.get(client_id, {})
         while len(client_storage) > 0:
             filename, storage = client_storage.popitem()
@@ -221,8 +360,17 @@ class Worker(ABC):
         self.metadata_handler.remove_client(client_id)
         print(f"[Worker {self.id}] Client disconnected. Worker reset")
 
+    def rebuild_string_table(self):
+        """
+        Keeps in the string table only the strings of the contexts of the clients left, so the ones 
+        of removed clients are freed. By default contexts keep no strings of the table
+        """
+        self.string_table.clear()
+
     def proccess_final_results(self, client_id, already_sent_results=0):
         print(f"[Worker {self.id}] No more eof to receive")
+        if not self.checkpoint():
+            return False
         if not self.send_final_results(client_id, already_sent_results):
             print(f"[Worker {self.id}] Disconnected from MOM, while sending final results")
             return False
@@ -242,61 +390,164 @@ class Worker(ABC):
     def get_context_storage_types(self, scale_of_update_file):
         pass 
 
-    def dump_client_updates(self, client_id, filename, update_values): #{title: (old_value, new_value)}
+    def log_client_updates(self, client_id, filename, update_values): #{title: (old_value, new_value)}
+        """
+        Logs the updates of the file without commiting them. Returns the writes to apply once the log is commited
+        """
         storage = self.client_contexts_storage[client_id][filename]
         
         old_values = []
+        new_values = []
         keys = []
         for key, values in update_values.items():
             old_values.append(values[0])
+            new_values.append(values[1])
             keys.append(key)
-        self.logger.log(ChangingFile(filename, keys, old_values))
-
-        for key, values in update_values.items():
-            if values[1] == None:
-                storage.remove(key)
-            else:
-                storage.store(key, values[1])
+        self.logger.log(ChangingFile(filename, keys, old_values), commit=False)
+        return (storage, keys, new_values)
 
-    def dump_all_client_updates_to_disk(self, client_id):
+    def log_all_client_updates(self, client_id):
+        pending_writes = []
         if client_id not in self.client_contexts_storage:
             self.client_contexts_storage[client_id] = {}
 
+        updates_by_file = {}
         while len(self.client_context_storage_updates) > 0:
             scale_of_update_file, update_values  = self.client_context_storage_updates.popitem()
-            filename = CLIENT_CONTEXT_FILENAME + str(client_id) + SCALE_SEPARATOR + str(scale_of_update_file) + '.bin'
+            filename = self.context_filename(client_id, scale_of_update_file)
+            if filename in updates_by_file:
+                updates_by_file[filename][1].update(update_values)
+            else:
+                updates_by_file[filename] = (scale_of_update_file, update_values)
 
+        for filename, (scale_of_update_file, update_values) in updates_by_file.items():
             if filename not in self.client_contexts_storage[client_id]:
-                path = self.worker_dir() + filename
-                value_types, value_types_size = self.get_context_storage_types(scale_of_update_file)
-                if value_types == None or value_types_size == None:
+                _client_id, scale_of_file = info_from_filename(filename)
+                storage = self.open_context_storage(self.worker_dir() + filename, scale_of_file)
+                if storage == None:
                     continue
-                self.client_contexts_storage[client_id][filename] = KeyValueStorage.new(
-                    path, str, 2**scale_of_update_file, value_types, value_types_size)
+                self.client_contexts_storage[client_id][filename] = storage
             
-            self.dump_client_updates(client_id, filename, update_values)
-
-    def dump_metadata_to_disk(self, received_batch):
-        self.metadata_handler.dump_metadata_to_disk(self.last_received_batch, self.pending_eof, received_batch)
-        self.last_received_batch[received_batch.sender_id] = received_batch.seq_num
+            pending_writes.append(self.log_client_updates(client_id, filename, update_values))
+        return pending_writes
 
-    def dump_to_disk(self, batch):
+    def dump_changes_to_disk(self, client_id, metadata_entries, received_batches):
+        """
+        Logs the metadata changes and the context updates of the client, commits all 
+        of them at once and only then writes them to their storages
+        """
         try:
-            self.dump_metadata_to_disk(batch)
-            self.dump_all_client_updates_to_disk(batch.client_id)
+            pending_writes = self.metadata_handler.log_entries(*metadata_entries)
+            pending_writes.extend(self.log_all_client_updates(client_id))
+            self.logger.commit()
+            for storage, keys, new_values in pending_writes:
+                storage.apply(keys, new_values)
+            for batch in received_batches:
+                self.last_received_batch[batch.sender_id] = batch.seq_num
             self.logger.log(FinishedWriting())
         except OSError as e:
             print(f"[Worker {self.id}] Error dumping to disk: {e}")
             return False
         return True
 
+    def add_delta(self, filename, keys, new_values):
+        file_delta = self.pending_checkpoint.setdefault(filename, {})
+        for key, new_value in zip(keys, new_values):
+            file_delta[key] = new_value
+
+    def client_deltas(self, client_id):
+        deltas = []
+        while len(self.client_context_storage_updates) > 0:
+            scale_of_update_file, update_values = self.client_context_storage_updates.popitem()
+            new_values = [values[1] for values in update_values.values()]
+            deltas.append((self.context_filename(client_id, scale_of_update_file), list(update_values.keys()), new_values))
+        return deltas
+
+    def dump_deltas_to_disk(self, client_id, metadata_entries, received_batches):
+        """
+        Appends the new values of the metadata and the context updates of the client to 
+        the delta log, followed by a FinishedWriting, committing them at once. They reach 
+        their storages on the next checkpoint
+        """
+        try:
+            deltas = [self.metadata_handler.delta_entries(*metadata_entries)]
+            deltas.extend(self.client_deltas(client_id))
+            for filename, keys, new_values in deltas:
+                if len(keys) == 0:
+                    continue
+                self.delta_logger.log(ChangingFile(filename, keys, new_values), commit=False)
+                self.add_delta(filename, keys, new_values)
+            self.delta_logger.log(FinishedWriting(), commit=False)
+            self.delta_logger.commit()
+            for batch in received_batches:
+                self.last_received_batch[batch.sender_id] = batch.seq_num
+            self.logger.log(FinishedWriting(), commit=False)
+        except OSError as e:
+            print(f"[Worker {self.id}] Error dumping deltas to disk: {e}")
+            return False
+        self.batches_since_checkpoint += 1
+        return self.checkpoint_if_due()
+
+    def checkpoint_if_due(self):
+        due_by_batches = self.checkpoint_batches != NO_CHECKPOINTS and self.batches_since_checkpoint >= self.checkpoint_batches
+        due_by_time = self.checkpoint_seconds != NO_CHECKPOINTS and time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds
+        if due_by_batches or due_by_time:
+            return self.checkpoint()
+        return True
+
+    def delta_storage(self, filename):
+        if filename == self.metadata_handler.filename:
+            return self.metadata_handler.storage
+        client_id, scale_of_file = info_from_filename(filename)
+        client_storages = self.client_contexts_storage.setdefault(client_id, {})
+        if filename not in client_storages:
+            storage = self.open_context_storage(self.worker_dir() + filename, scale_of_file)
+            if storage == None:
+                return None
+            client_storages[filename] = storage
+        return client_storages[filename]
+
+    def checkpoint(self):
+        """
+        Writes the deltas since the last checkpoint to their storages, with one apply for each file, 
+        and empties the delta log. Deltas have the new values, so if it is interrupted 
+        they are written again on restart
+        """
+        if len(self.pending_checkpoint) == 0:
+            return True
+        try:
+            for filename, file_delta in self.pending_checkpoint.items():
+                storage = self.delta_storage(filename)
+                if storage == None:
+                    print(f"[Worker {self.id}] Could not open {filename} to checkpoint")
+                    return False
+                storage.apply(list(file_delta.keys()), list(file_delta.values()))
+            self.delta_logger.clean()
+            self.delta_logger.commit()
+        except OSError as e:
+            print(f"[Worker {self.id}] Error checkpointing: {e}")
+            return False
+        self.pending_checkpoint = {}
+        self.batches_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+        return True
+
+    def dump_to_disk(self, batch):
+        metadata_entries = self.metadata_handler.metadata_entries(self.last_received_batch, self.pending_eof, batch)
+        if self.checkpointing():
+            return self.dump_deltas_to_disk(batch.client_id, metadata_entries, [batch])
+        return self.dump_changes_to_disk(batch.client_id, metadata_entries, [batch])
+
     def send_batch(self, batch: Batch):
         if batch.is_empty():
             return self.communicator.produce_to_all_group_members(batch.to_bytes())
         else:
             for pool, _next_pool_workers, shard_attribute in self.next_pools:
-                if not self.communicator.produce_batch_of_messages(batch, pool, shard_attribute):
+                batch_format = self.next_pools.batch_format_of_pool(pool)
+                shard_hash = self.next_pools.shard_hash_of_pool(pool)
+                if not self.communicator.produce_batch_of_messages(batch, pool, shard_attribute, batch_format, shard_hash, flush=False):
                     return False
+            return self.communicator.flush()
         return True
 
     def is_dup_batch(self, batch):
@@ -310,17 +561,19 @@ class Worker(ABC):
         if not self.communicator.acknowledge_last_message():
             print(f"[Worker {self.id}] Disconnected from MOM, while acking_message")
             return False
-        self.logger.log(AckedBatch())
+        self.logger.log(AckedBatch(), commit=False)
         return True
 
     def loop(self):
+        if self.consume_group_size != NO_CONSUME_GROUPS:
+            return self.loop_in_groups()
         while True:
             ########### receive batch
             batch_bytes = self.receive_batch()
             if not batch_bytes:
                 print(f"[Worker {self.id}] Disconnected from MOM, while receiving_message")
                 break
-            batch = Batch.from_bytes(batch_bytes)
+            batch = self.decode_batch(batch_bytes)
             
             ########### filter dup
             if not batch or self.is_dup_batch(batch):
@@ -352,6 +605,110 @@ class Worker(ABC):
             ############ Clean Log
             self.logger.clean()
 
+    def receive_group(self):
+        """
+        Receives up to consume_group_size batchs of the same client, only waiting for the first one. 
+        A batch from a sender that already has one in the group, or from another client, is deferred 
+        to the next group. This way a duplicated batch is always the last received from its sender.
+        Returns the not duplicated batchs and the delivery tag of the last one received, 
+        or None, None if disconnected
+        """
+        group = []
+        senders = set()
+        client_id = None
+        last_delivery_tag = None
+        deliveries = 0
+        worker_name = self.id.__repr__()
+        while deliveries < self.consume_group_size:
+            if self.deferred_batch:
+                batch, delivery_tag = self.deferred_batch
+                self.deferred_batch = None
+            else:
+                batch_bytes = self.communicator.consume_message(worker_name, wait=deliveries == 0)
+                if batch_bytes == None:
+                    break
+                if not batch_bytes:
+                    return None, None
+                batch = self.decode_batch(batch_bytes)
+                delivery_tag = self.communicator.last_delivery_tag
+                if batch and (batch.sender_id in senders or client_id not in (None, batch.client_id)):
+                    self.deferred_batch = (batch, delivery_tag)
+                    break
+            deliveries += 1
+            last_delivery_tag = delivery_tag
+            if not batch or self.is_dup_batch(batch):
+                continue
+            group.append(batch)
+            senders.add(batch.sender_id)
+            client_id = batch.client_id
+        return group, last_delivery_tag
+
+    def process_group(self, group):
+        """
+        Processes every batch of the group and sends all the results together, in batchs of up to BATCH_SIZE messages.
+        Returns {client_id: pending eof before the group} if the client received an eof in it, or None if disconnected
+        """
+        client_id = group[0].client_id
+        previous_pending_eof = {}
+        results = []
+        for batch in group:
+            if batch.is_empty():
+                previous_pending_eof.setdefault(client_id, self.pending_eof.get(client_id, self.eof_to_receive))
+            self.process_batch_messages(batch, results)
+        results = self.combine_results(results)
+        if not self.send_results(client_id, results):
+            return None
+        return previous_pending_eof
+
+    def dump_group_to_disk(self, group, previous_pending_eof):
+        metadata_entries = self.metadata_handler.group_metadata_entries(self.last_received_batch, self.pending_eof, group, previous_pending_eof)
+        if self.checkpointing():
+            return self.dump_deltas_to_disk(group[0].client_id, metadata_entries, group)
+        return self.dump_changes_to_disk(group[0].client_id, metadata_entries, group)
+
+    def acknowledge_group(self, last_delivery_tag):
+        if not self.communicator.acknowledge_messages_until(last_delivery_tag):
+            print(f"[Worker {self.id}] Disconnected from MOM, while acking_message")
+            return False
+        self.logger.log(AckedBatch(), commit=False)
+        return True
+
+    def loop_in_groups(self):
+        while True:
+            ########### receive group of batchs, without dups
+            group, last_delivery_tag = self.receive_group()
+            if group == None:
+                print(f"[Worker {self.id}] Disconnected from MOM, while receiving_message")
+                break
+            if len(group) == 0:
+                if not self.communicator.acknowledge_messages_until(last_delivery_tag):
+                    print(f"[Worker {self.id}] Disconnected from MOM, while acking_message")
+                    break
+                continue
+
+            ############ proccess batchs
+            previous_pending_eof = self.process_group(group)
+            if previous_pending_eof == None:
+                break
+
+            ############ bajar a disco
+            if not self.dump_group_to_disk(group, previous_pending_eof):
+                break
+
+            ############ ack all batchs
+            if not self.acknowledge_group(last_delivery_tag):
+                break
+
+            ############ Send final results
+            client_id = group[0].client_id
+            if self.pending_eof.get(client_id, None) == 0:
+                if not self.proccess_final_results(client_id):
+                    break
+                self.remove_client(client_id)
+
+            ############ Clean Log
+            self.logger.clean()
+
     def close_files(self):
         while len(self.client_contexts_storage) > 0:
             client_id, storages = self.client_contexts_storage.popitem()
@@ -373,7 +730,9 @@ class Worker(ABC):
 
         if not self.load_metadata():
             return False
-        return self.load_all_context()
+        if not self.load_all_context():
+            return False
+        return self.send_any_ready_final_results()
 
     def send_any_ready_final_results(self):
         finished_clients = []
@@ -406,7 +765,7 @@ class Worker(ABC):
             if not batch_bytes:
                 print(f"[Worker {self.id}] Disconnected from MOM, while receiving_message")
                 return False
-            batch = Batch.from_bytes(batch_bytes)
+            batch = self.decode_batch(batch_bytes)
         
             if not batch or self.is_dup_batch(batch):
                 if not self.communicator.acknowledge_last_message():
@@ -436,8 +795,10 @@ class Worker(ABC):
     def initialize_based_on_last_execution(self):
         last_log = self.logger.read_last_log()
         if not last_log:
+            # With checkpoints the logs after the deltas are not committed, so the deltas 
+            # replayed may have left clients without eofs to receive
             print(f"[Worker {self.id}] Initializing based on empty log file")
-            return True
+            return self.send_any_ready_final_results()
         print(f"[Worker {self.id}] Initializing based on log", last_log.log_type)
         
         switch = {
@@ -457,32 +818,76 @@ class Worker(ABC):
         return False
 
     def rollback(self, storage, client_id, keys, old_entries):
-        for key, old_entry in zip(keys, old_entries):
-            if old_entry == None:
-                storage.remove(key)
-            else:
-                storage.store(key, old_entry)
+        storage.apply(keys, old_entries)
 
         #if client_id == None:
         #    self.set_previouse_metadata()
         #else:
         #    self.add_previous_context(storage.get_all_entries(), client_id)
 
+def consume_group_size_from_env():
+    consume_group_size = os.getenv("CONSUME_GROUP_SIZE")
+    if not consume_group_size:
+        return NO_CONSUME_GROUPS
+    try:
+        return min(max(int(consume_group_size), NO_CONSUME_GROUPS), MAX_CONSUME_GROUP_SIZE)
+    except ValueError as e:
+        print(f"Invalid CONSUME_GROUP_SIZE, consuming one batch at a time: {e}")
+        return NO_CONSUME_GROUPS
+
+def context_loaders_from_env():
+    context_loaders = os.getenv("CONTEXT_LOADERS")
+    if not context_loaders:
+        return SEQUENTIAL_CONTEXT_LOADING
+    try:
+        return max(int(context_loaders), SEQUENTIAL_CONTEXT_LOADING)
+    except ValueError as e:
+        print(f"Invalid CONTEXT_LOADERS, loading the context files one at a time: {e}")
+        return SEQUENTIAL_CONTEXT_LOADING
+
+def checkpoint_interval_from_env():
+    """
+    Returns the batches and seconds between checkpoints set by CHECKPOINT_BATCHES and CHECKPOINT_SECONDS,
+    NO_CHECKPOINTS for the ones not set
+    """
+    interval = []
+    for variable, value_type in (("CHECKPOINT_BATCHES", int), ("CHECKPOINT_SECONDS", float)):
+        value = os.getenv(variable)
+        if not value:
+            interval.append(NO_CHECKPOINTS)
+            continue
+        try:
+            interval.append(max(value_type(value), NO_CHECKPOINTS))
+        except ValueError as e:
+            print(f"Invalid {variable}, not checkpointing by it: {e}")
+            interval.append(NO_CHECKPOINTS)
+    return interval[0], interval[1]
+
 def info_from_filename(filename):
-    client_id, scale = filename.strip('.bin').strip(CLIENT_CONTEXT_FILENAME).split(SCALE_SEPARATOR)
+    """
+    Returns the client and the scale of a context file, None if it is a record storage or snapshot file
+    """
+    name = os.path.splitext(filename)[0][len(CLIENT_CONTEXT_FILENAME):]
+    if SCALE_SEPARATOR not in name:
+        return int(name), None
+    client_id, scale = name.split(SCALE_SEPARATOR)
     return int(client_id), int(scale)
 
 if __name__ == '__main__':
     import unittest
     from unittest import TestCase
-    from Workers.Accumulators import ReviewTextByTitleAccumulator
-    from Persistance.MetadataHandler import METADATA_KEY_BYTES, METADATA_NUM_BYTES, LAST_RECEIVED_FROM_WORKER, LAST_SENT_SEQ_NUM
+    from Workers.Accumulators import ReviewTextByTitleAccumulator, AmountOfReviewByTitleAccumulator
+    from Persistance.MetadataHandler import METADATA_KEY_BYTES, METADATA_NUM_BYTES, LAST_RECEIVED_FROM, LAST_SENT_SEQ_NUM
     from io import BytesIO
-    import pudb; pu.db
+    import tempfile
+    import Workers.Worker as worker_module
+    from Workers.Filters import Filter
+    from utils.QueryMessage import QueryMessage, BOOK_MSG_TYPE, REVIEW_MSG_TYPE, AUTHOR_FIELD, YEAR_FIELD
+    from utils.Batch import ROW_BATCH_FORMAT, COLUMNAR_BATCH_FORMAT
     
-    STR_LEN = 4
+    STR_SCALE = 2
     INT_BYTES = 4
-    TEST_CONTEXT_FILENAME = CLIENT_CONTEXT_FILENAME + str(1) + '_S' + str(STR_LEN)
+    TEST_CONTEXT_FILENAME = CLIENT_CONTEXT_FILENAME + str(1) + SCALE_SEPARATOR + str(STR_SCALE) + '.bin'
 
     class TestMetadata(TestCase):
         def test_metadata(self):
@@ -490,34 +895,52 @@ if __name__ == '__main__':
             storage = KeyValueStorage(file, str, 50, [int], [METADATA_NUM_BYTES])
             
             storage.store(LAST_SENT_SEQ_NUM, [2])
-            storage.store(LAST_RECEIVED_FROM_WORKER + SenderID(1,1,1).__repr__(), [1])
+            storage.store(LAST_RECEIVED_FROM + SenderID(1,1,1).__repr__(), [1])
             entires = storage.get_all_entries()
             self.assertEqual(entires.pop(LAST_SENT_SEQ_NUM), 2)
-            self.assertEqual(entires.pop(LAST_RECEIVED_FROM_WORKER + SenderID(1,1,1).__repr__()), 1)
+            self.assertEqual(entires.pop(LAST_RECEIVED_FROM + SenderID(1,1,1).__repr__()), 1)
     
+    class TestContextAccumulator(ReviewTextByTitleAccumulator):
+        def get_context_storage_types(self, scale_of_update_file):
+            return [int], [INT_BYTES]
+
     class TestInitializeBasedOnLog(TestCase):
+        def setUp(self):
+            # The worker reloads the storages it rolls back from its directory
+            self.directory = tempfile.TemporaryDirectory()
+            self.persistance_path = worker_module.PERSISTANCE_PATH
+            worker_module.PERSISTANCE_PATH = self.directory.name + '/'
+
+        def tearDown(self):
+            worker_module.PERSISTANCE_PATH = self.persistance_path
+            for storages in self.worker.client_contexts_storage.values():
+                for storage in storages.values():
+                    storage.close()
+            self.worker.metadata_handler.close()
+            self.directory.cleanup()
+
         def get_test_worker(self,n):
-            storage_file = BytesIO(b"")
-            metadata_file = BytesIO(b"")
-            
-            storage = KeyValueStorage(storage_file, str, STR_LEN, [int], [INT_BYTES])
+            worker = TestContextAccumulator(SenderID(1,1,1), 5, 5, None, None, None)
+            worker_dir = worker_module.PERSISTANCE_PATH + worker.id.__repr__() + '/'
+            os.makedirs(worker_dir)
+            worker.worker_dir = lambda: worker_dir
+            self.worker = worker
+
+            storage = worker.open_context_storage(worker.worker_dir() + TEST_CONTEXT_FILENAME, STR_SCALE)
             storage.store("1", [1])
             storage.store("2", [2])
             storage.store("3", [3])
             storage.store("4", [4])
             
-            metadata_storage = KeyValueStorage(metadata_file, str, METADATA_KEY_BYTES, [int], [INT_BYTES])
-            metadata_storage.store(LAST_SENT_SEQ_NUM, [1])
-            metadata_storage.store(LAST_RECEIVED_FROM_WORKER + '1.0.1', [2])
-            
-            worker = ReviewTextByTitleAccumulator(SenderID(1,1,1), 5, 5, None, None, None)
             worker.logger = self.get_test_logger(n)
             worker.client_contexts_storage[1] = {TEST_CONTEXT_FILENAME: storage}
-            worker.metadata_handler = MetadataHandler(metadata_storage, worker.logger)
+            worker.metadata_handler = MetadataHandler.new(worker.worker_dir(), worker.logger)
+            worker.metadata_handler.storage.store(LAST_SENT_SEQ_NUM, [1])
+            worker.metadata_handler.storage.store(LAST_RECEIVED_FROM + '1.0.1', [2])
             return worker
 
         def get_test_logger(self, n):
-            logs = [ChangingFile(METADATA_FILENAME + '.bin', [LAST_SENT_SEQ_NUM, LAST_RECEIVED_FROM_WORKER + '1.0.1'], [[0], [2]]),
+            logs = [ChangingFile(METADATA_FILENAME + '.bin', [LAST_SENT_SEQ_NUM, LAST_RECEIVED_FROM + '1.0.1'], [[0], [2]]),
                     ChangingFile(TEST_CONTEXT_FILENAME, ["2", "4"], [[1], None]),
                     FinishedWriting()]
             log_file = BytesIO(b"")
@@ -529,7 +952,7 @@ if __name__ == '__main__':
         def test_last_log_changing_file_only_metadata(self):
             w: Worker = self.get_test_worker(1)
             w.initialize_based_on_last_execution()
-            expected_metadata_entries = {LAST_SENT_SEQ_NUM: 0, LAST_RECEIVED_FROM_WORKER + '1.0.1': 2}
+            expected_metadata_entries = {LAST_SENT_SEQ_NUM: 0, LAST_RECEIVED_FROM + '1.0.1': 2}
             self.assertEqual(w.metadata_handler.storage.get_all_entries(), expected_metadata_entries)
             self.assertEqual(SeqNumGenerator.seq_num, 0)
             self.assertEqual(w.pending_eof, {})
@@ -539,7 +962,7 @@ if __name__ == '__main__':
             w: Worker = self.get_test_worker(2)
             w.initialize_based_on_last_execution()
 
-            expected_metadata_entries = {LAST_SENT_SEQ_NUM: 0, LAST_RECEIVED_FROM_WORKER + '1.0.1': 2}
+            expected_metadata_entries = {LAST_SENT_SEQ_NUM: 0, LAST_RECEIVED_FROM + '1.0.1': 2}
             expected_context = {
                 "1": 1,
                 "2": 1,
@@ -553,4 +976,237 @@ if __name__ == '__main__':
             self.assertEqual(w.client_contexts_storage[1][TEST_CONTEXT_FILENAME].get_all_entries(), expected_context)
             self.assertEqual(w.client_contexts[1], expected_context)
 
+    class TestCommunicator():
+        """
+        Delivers the given batchs in order, keeping the acks, and decodes the batchs produced 
+        as the next pools would receive them
+        """
+        def __init__(self, batchs=[]):
+            self.to_deliver = [batch.to_bytes() for batch in batchs]
+            self.last_delivery_tag = 0
+            self.acked_until = 0
+            self.sent = []
+
+        def consume_message(self, _queue_name, wait=True):
+            """
+            Once there is nothing left to deliver it times out, or disconnects if asked to wait
+            """
+            if len(self.to_deliver) == 0:
+                return bytearray([]) if wait else None
+            self.last_delivery_tag += 1
+            return self.to_deliver.pop(0)
+
+        def acknowledge_messages_until(self, delivery_tag):
+            self.acked_until = delivery_tag
+            return True
+
+        def acknowledge_last_message(self):
+            return self.acknowledge_messages_until(self.last_delivery_tag)
+
+        def produce_batch_of_messages(self, batch, group, shard_by=None, batch_format=ROW_BATCH_FORMAT, shard_hash=None, flush=True):
+            self.sent.append(Batch.from_bytes(batch.to_bytes(batch_format)))
+            return True
+
+        def produce_to_all_group_members(self, message):
+            self.sent.append(Batch.from_bytes(message))
+            return True
+
+        def flush(self):
+            return True
+
+        def contains_producer_group(self, group):
+            return False
+
+    class TestGroups(TestCase):
+        def get_test_filter(self, field, batchs=[]):
+            next_pools = NextPools(['2.1'], ['1'], [None], [COLUMNAR_BATCH_FORMAT])
+            filter = Filter(SenderID(2,0,0), next_pools, 1, field, (1990, 1999), [])
+            filter.communicator = TestCommunicator(batchs)
+            filter.consume_group_size = 4
+            return filter
+
+        def get_books_batch(self, client_id, sender_num, seq_num, years=[1995, 2005]):
+            books = [QueryMessage(BOOK_MSG_TYPE, year=year, title=f"Titulo {sender_num} {seq_num} {year}") for year in years]
+            return Batch(client_id, SenderID(1,0,sender_num), seq_num, books)
+
+        def test_group_defers_repeated_sender(self):
+            batchs = [self.get_books_batch(1, 0, 0), self.get_books_batch(1, 1, 0), self.get_books_batch(1, 0, 1)]
+            filter = self.get_test_filter(YEAR_FIELD, batchs)
+            group, last_delivery_tag = filter.receive_group()
+            self.assertEqual([(batch.sender_id, batch.seq_num) for batch in group], [(SenderID(1,0,0), 0), (SenderID(1,0,1), 0)])
+            self.assertEqual(last_delivery_tag, 2)
+            group, last_delivery_tag = filter.receive_group()
+            self.assertEqual([(batch.sender_id, batch.seq_num) for batch in group], [(SenderID(1,0,0), 1)])
+            self.assertEqual(last_delivery_tag, 3)
+
+        def test_group_defers_other_client(self):
+            batchs = [self.get_books_batch(1, 0, 0), self.get_books_batch(2, 1, 0), self.get_books_batch(2, 2, 0)]
+            filter = self.get_test_filter(YEAR_FIELD, batchs)
+            group, last_delivery_tag = filter.receive_group()
+            self.assertEqual([batch.client_id for batch in group], [1])
+            self.assertEqual(last_delivery_tag, 1)
+            group, last_delivery_tag = filter.receive_group()
+            self.assertEqual([batch.client_id for batch in group], [2, 2])
+            self.assertEqual(last_delivery_tag, 3)
+
+        def test_group_skips_duplicated_batch(self):
+            batchs = [self.get_books_batch(1, 0, 7), self.get_books_batch(1, 1, 0)]
+            filter = self.get_test_filter(YEAR_FIELD, batchs)
+            filter.last_received_batch[SenderID(1,0,0)] = 7
+            group, last_delivery_tag = filter.receive_group()
+            self.assertEqual([batch.sender_id for batch in group], [SenderID(1,0,1)])
+            self.assertEqual(last_delivery_tag, 2)
+
+        def run_loop_in_groups(self, batchs, eof_to_receive=1):
+            """
+            Runs the groups loop of a filter until the batchs run out. Returns the filter and 
+            the metadata it stored
+            """
+            filter = self.get_test_filter(YEAR_FIELD, batchs)
+            filter.eof_to_receive = eof_to_receive
+            with tempfile.TemporaryDirectory() as directory:
+                filter.worker_dir = lambda: directory + '/'
+                self.assertTrue(filter.load_from_disk())
+                filter.loop_in_groups()
+                metadata = filter.metadata_handler.load_stored_metadata()
+                filter.close_files()
+                filter.logger.close()
+                filter.delta_logger.close()
+            return filter, metadata
+
+        def test_loop_in_groups_with_duplicated_batch(self):
+            batch = self.get_books_batch(1, 0, 0)
+            batchs = [batch, batch, self.get_books_batch(1, 1, 0)]
+            filter, (_last_sent_seq_num, pending_eof, last_received_batch) = self.run_loop_in_groups(batchs)
+            sent_titles = [msg.title for sent_batch in filter.communicator.sent for msg in sent_batch]
+            self.assertEqual(sent_titles, ["Titulo 0 0 1995", "Titulo 1 0 1995"])
+            self.assertEqual(filter.communicator.acked_until, 3)
+            self.assertEqual(last_received_batch, {SenderID(1,0,0): 0, SenderID(1,0,1): 0})
+            self.assertEqual(pending_eof, {})
+
+        def test_loop_in_groups_with_eof_in_group(self):
+            batchs = [self.get_books_batch(1, 0, 0), Batch(1, SenderID(1,0,1), 0, []), Batch(1, SenderID(1,0,2), 0, [])]
+            filter, (_last_sent_seq_num, pending_eof, last_received_batch) = self.run_loop_in_groups(batchs, eof_to_receive=2)
+            sent = filter.communicator.sent
+            self.assertEqual([batch.size() for batch in sent], [1, 0])
+            self.assertEqual(filter.communicator.acked_until, 3)
+            self.assertEqual(filter.pending_eof, {})
+            self.assertEqual(pending_eof, {})
+            self.assertNotIn(1, filter.client_contexts)
+            self.assertEqual(len(filter.string_table), 0)
+            self.assertEqual(len(last_received_batch), 3)
+
+        def test_group_results_are_sent_in_batchs(self):
+            authors = [f"Autor {i}" for i in range(40)]
+            books = [QueryMessage(BOOK_MSG_TYPE, title=f"Titulo {i}", authors=authors) for i in range(BATCH_SIZE)]
+            group = [Batch(1, SenderID(1,0,sender_num), 0, books) for sender_num in range(2)]
+            filter = self.get_test_filter(AUTHOR_FIELD)
+            self.assertEqual(filter.process_group(group), {})
+            sent = filter.communicator.sent
+            self.assertGreater(2 * len(books) * len(authors), AMOUNT_OF_MESSAGES_MASK)
+            self.assertTrue(all(batch != None and batch.size() <= BATCH_SIZE for batch in sent))
+            self.assertEqual(sum(batch.size() for batch in sent), 2 * len(books) * len(authors))
+            self.assertEqual(sent[-1][-1].authors, [authors[-1]])
+
+    class TestDeltaRecovery(TestCase):
+        def get_test_accumulator(self, directory, batchs=[]):
+            accumulator = AmountOfReviewByTitleAccumulator(SenderID(3,0,0), NextPools(['4.0'], ['1'], [None]), 1, 'review_count', '2', 'title')
+            accumulator.worker_dir = lambda: directory + '/'
+            accumulator.checkpoint_batches = 10
+            accumulator.communicator = TestCommunicator(batchs)
+            self.assertTrue(accumulator.load_from_disk())
+            return accumulator
+
+        def crash(self, worker):
+            """
+            Closes the files of worker without checkpointing, as if its process stopped
+            """
+            worker.close_files()
+            worker.logger.close()
+            worker.delta_logger.close()
+
+        def get_test_batchs(self):
+            books = [QueryMessage(BOOK_MSG_TYPE, title=title, authors=["Autor"]) for title in ["A", "B"]]
+            reviews = [QueryMessage(REVIEW_MSG_TYPE, title=title, rating=4.0) for title in ["A", "A", "B"]]
+            return Batch(1, SenderID(1,0,0), 0, books), Batch(1, SenderID(2,0,0), 0, reviews)
+
+        def process_and_crash(self, directory, batchs):
+            accumulator = self.get_test_accumulator(directory)
+            for batch in batchs:
+                self.assertTrue(accumulator.process_batch(batch))
+                self.assertTrue(accumulator.dump_to_disk(batch))
+            self.assertEqual(accumulator.batches_since_checkpoint, len(batchs))
+            self.crash(accumulator)
+
+        def amounts_of_reviews(self, accumulator):
+            context = accumulator.client_contexts[1]
+            return {title: accumulator.stored_value(context, row)[0] for title, row in context.rows.items()}
+
+        def test_crash_between_delta_append_and_checkpoint(self):
+            with tempfile.TemporaryDirectory() as directory:
+                self.process_and_crash(directory, self.get_test_batchs())
+                accumulator = self.get_test_accumulator(directory)
+                self.assertEqual(self.amounts_of_reviews(accumulator), {"A": 2, "B": 1})
+                self.assertEqual(accumulator.last_received_batch, {SenderID(1,0,0): 0, SenderID(2,0,0): 0})
+                self.assertEqual(accumulator.pending_checkpoint, {})
+                self.assertEqual(os.path.getsize(os.path.join(directory, DELTA_LOG_FILENAME)), 0)
+                self.crash(accumulator)
+
+        def test_torn_delta_tail_discards_its_batch(self):
+            books, reviews = self.get_test_batchs()
+            with tempfile.TemporaryDirectory() as directory:
+                self.process_and_crash(directory, [books, reviews])
+                with open(os.path.join(directory, DELTA_LOG_FILENAME), 'rb+') as deltas:
+                    deltas.truncate(os.path.getsize(deltas.name) - 3)
+                accumulator = self.get_test_accumulator(directory)
+                self.assertEqual(self.amounts_of_reviews(accumulator), {"A": 0, "B": 0})
+                self.assertEqual(accumulator.last_received_batch, {SenderID(1,0,0): 0})
+                self.assertFalse(accumulator.is_dup_batch(reviews))
+                self.crash(accumulator)
+
+        def test_duplicated_batch_is_rejected_after_replay(self):
+            books, reviews = self.get_test_batchs()
+            with tempfile.TemporaryDirectory() as directory:
+                self.process_and_crash(directory, [books, reviews])
+                accumulator = self.get_test_accumulator(directory, [reviews])
+                accumulator.loop()
+                self.assertEqual(accumulator.communicator.acked_until, 1)
+                self.assertEqual(self.amounts_of_reviews(accumulator), {"A": 2, "B": 1})
+                self.crash(accumulator)
+
+        def test_crash_after_delta_commit_of_last_eof(self):
+            books, reviews = self.get_test_batchs()
+            eof = Batch(1, SenderID(2,0,0), 1, [])
+            with tempfile.TemporaryDirectory() as directory:
+                self.process_and_crash(directory, [books, reviews, eof])
+                # The logs written after the deltas were not committed, so they may not be on disk
+                with open(os.path.join(directory, LOG_FILENAME), 'rb+') as log:
+                    log.truncate(0)
+                accumulator = self.get_test_accumulator(directory, [eof])
+                self.assertEqual(accumulator.pending_eof, {1: 0})
+                self.assertTrue(accumulator.initialize_based_on_last_execution())
+                accumulator.loop()
+                sent = accumulator.communicator.sent
+                self.assertEqual([[msg.title for msg in batch] for batch in sent], [["A"], []])
+                self.assertEqual(accumulator.communicator.acked_until, 1)
+                self.assertEqual(accumulator.pending_eof, {})
+                self.assertNotIn(1, accumulator.client_contexts)
+                self.assertEqual(accumulator.metadata_handler.load_stored_metadata()[1], {})
+                self.crash(accumulator)
+
+    class TestStorageBackend(TestCase):
+        def get_storage_class(self, env):
+            os.environ.update(env)
+            try:
+                return Filter(SenderID(2,0,0), None, 1, YEAR_FIELD, (1990, 1999), []).storage_class
+            finally:
+                for variable in env:
+                    del os.environ[variable]
+
+        def test_snapshot_backend_with_checkpoints(self):
+            self.assertEqual(self.get_storage_class({"STORAGE_BACKEND": SNAPSHOT_STORAGE_BACKEND, "CHECKPOINT_BATCHES": "100"}), SnapshotStorage)
+
+        def test_snapshot_backend_without_checkpoints_uses_files(self):
+            self.assertEqual(self.get_storage_class({"STORAGE_BACKEND": SNAPSHOT_STORAGE_BACKEND}), KeyValueStorage)
+
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""
+Compares the offset based Batch decoding against the previous one, that copied 
+the payload into a bytearray and removed the bytes of every field from its start.
+It also measures a filter like pass-through (decode, read the title and encode 
+again) with eager and lazy messages.
+
+Usage: python3 -m benchmarks.batch_decoding [books_file] [reviews_file]
+"""
+from benchmarks.datasets import load_books, load_reviews, query_messages, batches_of, timed
+from utils.Batch import Batch, HEADER_LEN
+from utils.QueryMessage import QueryMessage, ParametersGenerator
+from utils.auxiliar_functions import remove_bytes
+
+REPETITIONS = 5
+
+def legacy_message_from_bytes(byte_array):
+    msg_type = remove_bytes(byte_array, 1)[0]
+    generator = ParametersGenerator(byte_array)
+    fields = [generator.next() for _ in range(8)]
+    return QueryMessage(msg_type, *fields)
+
+def legacy_batch_from_bytes(byte_array):
+    client_id, sender_id, seq_num, amount_of_messages = Batch.get_header_fields_from_bytes(byte_array)
+    byte_array = bytearray(byte_array)[HEADER_LEN:]
+    messages = []
+    for _ in range(amount_of_messages):
+        if len(byte_array) == 0:
+            break
+        messages.append(legacy_message_from_bytes(byte_array))
+    return Batch(client_id, sender_id, seq_num, messages)
+
+def decode_all(decoder, encoded_batches):
+    return [decoder(batch_bytes) for batch_bytes in encoded_batches]
+
+def pass_through(encoded_batches, lazy):
+    for batch_bytes in encoded_batches:
+        batch = Batch.from_bytes(batch_bytes, lazy)
+        for message in batch:
+            message.title
+        batch.to_bytes()
+
+def run_pass_through(name, messages):
+    encoded_batches = [batch.to_bytes() for batch in batches_of(messages)]
+    eager_time, _ = timed(pass_through, encoded_batches, False, repetitions=REPETITIONS)
+    lazy_time, _ = timed(pass_through, encoded_batches, True, repetitions=REPETITIONS)
+    print(f"{name} pass-through")
+    print(f"    eager: {eager_time*1000:.1f} ms")
+    print(f"    lazy: {lazy_time*1000:.1f} ms ({eager_time/lazy_time:.1f}x)")
+
+def run(name, messages):
+    encoded_batches = [batch.to_bytes() for batch in batches_of(messages)]
+    legacy_time, legacy_batches = timed(decode_all, legacy_batch_from_bytes, encoded_batches, repetitions=REPETITIONS)
+    new_time, new_batches = timed(decode_all, Batch.from_bytes, encoded_batches, repetitions=REPETITIONS)
+    for legacy, new in zip(legacy_batches, new_batches):
+        assert legacy.to_bytes() == new.to_bytes()
+    print(f"{name}: {len(messages)} messages in {len(encoded_batches)} batches")
+    print(f"    legacy: {legacy_time*1000:.1f} ms")
+    print(f"    offset: {new_time*1000:.1f} ms ({legacy_time/new_time:.1f}x)")
+
+def main():
+    books = load_books()
+    reviews = load_reviews()
+    run("books query 1", query_messages(books, 1))
+    run("books query 5", query_messages(books, 5))
+    run("reviews query 3", query_messages(reviews, 3))
+    run("reviews query 5", query_messages(reviews, 5))
+    run_pass_through("books query 1", query_messages(books, 1))
+    run_pass_through("reviews query 5", query_messages(reviews, 5))
+
+if __name__ == '__main__':
+    main()
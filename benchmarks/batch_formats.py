@@ -0,0 +1,40 @@
+"""
+Compares the row and columnar batch formats: encoded size, encoding time and 
+decoding time for the messages the gateway sends to each query.
+
+Usage: python3 -m benchmarks.batch_formats [books_file] [reviews_file]
+"""
+from benchmarks.datasets import load_books, load_reviews, query_messages, batches_of, timed
+from utils.Batch import Batch, ROW_BATCH_FORMAT, COLUMNAR_BATCH_FORMAT
+
+REPETITIONS = 5
+
+def encode_all(batches, batch_format):
+    return [batch.to_bytes(batch_format) for batch in batches]
+
+def decode_all(encoded_batches):
+    return [Batch.from_bytes(batch_bytes) for batch_bytes in encoded_batches]
+
+def run(name, messages):
+    batches = batches_of(messages)
+    print(f"{name}: {len(messages)} messages in {len(batches)} batches")
+    results = {}
+    for batch_format in [ROW_BATCH_FORMAT, COLUMNAR_BATCH_FORMAT]:
+        encode_time, encoded_batches = timed(encode_all, batches, batch_format, repetitions=REPETITIONS)
+        decode_time, decoded_batches = timed(decode_all, encoded_batches, repetitions=REPETITIONS)
+        size = sum(len(batch_bytes) for batch_bytes in encoded_batches)
+        results[batch_format] = decoded_batches
+        print(f"    {batch_format}: {size/1024:.0f} KiB, encode {encode_time*1000:.1f} ms, decode {decode_time*1000:.1f} ms")
+    for row, columnar in zip(results[ROW_BATCH_FORMAT], results[COLUMNAR_BATCH_FORMAT]):
+        assert row.to_bytes() == columnar.to_bytes()
+
+def main():
+    books = load_books()
+    reviews = load_reviews()
+    run("books query 1", query_messages(books, 1))
+    run("books query 5", query_messages(books, 5))
+    run("reviews query 3", query_messages(reviews, 3))
+    run("reviews query 5", query_messages(reviews, 5))
+
+if __name__ == '__main__':
+    main()
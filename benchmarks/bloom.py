@@ -0,0 +1,65 @@
+"""
+Times the title check of the reviews of a filter (query 3 year filter), when a tenth of the
+titles passed the filter, looking every title up in the set of titles of the client against
+checking a title bloom filter first (TITLE_BLOOM_FILTER_BITS), over batches of reviews
+decoded lazily as the filter receives them. It reports the false positive rate observed and
+the expected one, and the memory of the set and of the bloom filter.
+
+Usage: python3 -m benchmarks.bloom [amount_of_titles ...]
+"""
+import sys
+from benchmarks.datasets import batches_of, timed
+from utils.Batch import Batch
+from utils.QueryMessage import QueryMessage, REVIEW_MSG_TYPE, YEAR_FIELD
+from utils.SenderID import SenderID
+from Workers.BloomFilter import NO_BLOOM_FILTER
+from Workers.Filters import Filter
+
+SIZES = [100000]
+AMOUNT_OF_REVIEWS = 200000
+PASSING_TITLES = 10
+BLOOM_FILTER_BITS = [NO_BLOOM_FILTER, 2**16, 2**20]
+REPETITIONS = 3
+
+def decode(batches_bytes):
+    return [Batch.from_bytes(batch_bytes, lazy=True) for batch_bytes in batches_bytes]
+
+def check_titles(filter, batches_bytes):
+    passed = 0
+    for batch in decode(batches_bytes):
+        for msg in batch:
+            if filter.title_in_context(batch.client_id, msg):
+                passed += 1
+    return passed
+
+def set_size(titles):
+    return sys.getsizeof(titles) + sum(sys.getsizeof(title) for title in titles)
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for amount_of_titles in sizes:
+        titles = [f"Title of the book number {i}" for i in range(amount_of_titles)]
+        reviews = [QueryMessage(REVIEW_MSG_TYPE, title=titles[(i * 7919) % amount_of_titles], rating=4.0) for i in range(AMOUNT_OF_REVIEWS)]
+        batches_bytes = [batch.to_bytes() for batch in batches_of(reviews)]
+        decode_time, _ = timed(decode, batches_bytes, repetitions=REPETITIONS)
+        print(f"{amount_of_titles} titles, {amount_of_titles // PASSING_TITLES} in the context, {AMOUNT_OF_REVIEWS} reviews")
+        expected_passed = None
+        for bits in BLOOM_FILTER_BITS:
+            filter = Filter(SenderID(3, 0, 0), None, 1, YEAR_FIELD, (1990, 1999), [YEAR_FIELD])
+            filter.title_bloom_filter_bits = bits
+            filter.client_contexts[0] = set()
+            for title in titles[::PASSING_TITLES]:
+                filter.add_to_context(0, title)
+            filter.client_context_storage_updates = {}
+            elapsed, passed = timed(check_titles, filter, batches_bytes, repetitions=REPETITIONS)
+            expected_passed = expected_passed or passed
+            assert passed == expected_passed
+            check_time = (elapsed - decode_time) / AMOUNT_OF_REVIEWS
+            if bits == NO_BLOOM_FILTER:
+                print(f"    set: {check_time*1e9:.0f} ns by review, set of {set_size(filter.client_contexts[0])/1024:.0f} KiB")
+                continue
+            bloom_filter = filter.title_bloom_filters[0]
+            print(f"    bloom filter of {bits} bits: {check_time*1e9:.0f} ns by review, {len(bloom_filter.bits)/1024:.0f} KiB, false positive rate {bloom_filter.observed_false_positive_rate():.4f} (expected {bloom_filter.expected_false_positive_rate():.4f})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Times the query 3 accumulator of the amount of reviews by title receiving every review of the
+books of the query, as the year filter sends them, against receiving the partials of the
+review combiner (COMBINE_REVIEWS), with the messages and bytes sent to it in each case.
+
+Usage: python3 -m benchmarks.combiner [books_file] [reviews_file]
+"""
+from benchmarks.datasets import load_books, load_reviews, query_messages, batches_of, timed
+from utils.Batch import Batch
+from utils.SenderID import SenderID
+from Workers.Accumulators import AmountOfReviewByTitleAccumulator
+from Workers.Combiner import combine_reviews
+
+AMOUNT_OF_BOOKS = 20000
+AMOUNT_OF_REVIEWS = 200000
+MIN_REVIEWS = '50'
+
+def combined_batches(batches):
+    return [Batch(batch.client_id, batch.sender_id, batch.seq_num, combine_reviews(batch.messages)) for batch in batches]
+
+def accumulate(batches):
+    accumulator = AmountOfReviewByTitleAccumulator(SenderID(1, 1, 1), None, 1, 'review_count', MIN_REVIEWS, 'title')
+    for batch in batches:
+        accumulator.process_batch_messages(batch, [])
+        accumulator.client_context_storage_updates = {}
+    return [(msg.title, msg.rating) for msg in accumulator.sorted_final_results(batches[0].client_id)]
+
+def sent(batches):
+    return sum(len(batch.messages) for batch in batches), sum(len(batch.to_bytes()) for batch in batches)
+
+def main():
+    books = query_messages(load_books(AMOUNT_OF_BOOKS), 3)
+    reviews = query_messages(load_reviews(AMOUNT_OF_REVIEWS), 3)
+    batches = batches_of(books) + batches_of(reviews)
+    print(f"{len(books)} books and {len(reviews)} reviews in {len(batches)} batches")
+    messages, size = sent(batches)
+    reviews_time, results = timed(accumulate, batches)
+    print(f"    reviews: {messages} messages, {size/1024:.0f} KiB, accumulator {reviews_time*1000:.0f} ms")
+    combine_time, partial_batches = timed(combined_batches, batches)
+    messages, size = sent(partial_batches)
+    elapsed, combined_results = timed(accumulate, partial_batches)
+    assert combined_results == results
+    print(f"    partials: {messages} messages, {size/1024:.0f} KiB, combiner {combine_time*1000:.0f} ms, accumulator {elapsed*1000:.0f} ms ({reviews_time/elapsed:.1f}x)")
+
+if __name__ == '__main__':
+    main()
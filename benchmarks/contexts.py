@@ -0,0 +1,140 @@
+"""
+Measures the context of the query 3 review count accumulator for several clients sending
+the same books and reviews, over synthesized books so every title is different: keeping a
+list with the amount of reviews, the ratings sum and the authors string of each title in a
+dict, as it used to, against the columnar context with the titles and authors interned in
+the string table of the worker. For each one it reports the memory of the contexts (traced
+and RSS growth, each in its own process), the time to accumulate the batches and the time
+of the title lookups of the reviews.
+
+Usage: python3 -m benchmarks.contexts
+"""
+import time
+import tracemalloc
+from multiprocessing import Process, Queue
+from benchmarks.datasets import batches_of
+from utils.Batch import Batch
+from utils.SenderID import SenderID
+from utils.QueryMessage import QueryMessage, BOOK_MSG_TYPE, REVIEW_MSG_TYPE, REVIEW_COUNT_MSG_TYPE
+from Workers.Accumulators import AmountOfReviewByTitleAccumulator
+from utils.auxiliar_functions import smalles_scale_for_str
+
+AMOUNT_OF_BOOKS = 100000
+AMOUNT_OF_REVIEWS = 200000
+AMOUNT_OF_AUTHORS = 20000
+AMOUNT_OF_CLIENTS = 4
+MIN_REVIEWS = '1000000'
+
+class DictAmountOfReviewByTitleAccumulator(AmountOfReviewByTitleAccumulator):
+    """
+    The accumulator as it was before the columnar context, also used by its tests as reference
+    """
+    def get_new_context(cls):
+        return {}
+
+    def accumulate(self, client_id, msg):
+        if msg.msg_type == BOOK_MSG_TYPE:
+            self.add_to_context(client_id, msg.msg_type, msg.title, msg.rating, ';'.join(msg.authors))
+        elif msg.msg_type in (REVIEW_MSG_TYPE, REVIEW_COUNT_MSG_TYPE):
+            if msg.title not in self.client_contexts[client_id]:
+                return None
+            amount_of_reviews = msg.year if msg.msg_type == REVIEW_COUNT_MSG_TYPE else 1
+            self.add_to_context(client_id, msg.msg_type, msg.title, msg.rating, amount_of_reviews=amount_of_reviews)
+            if 0 <= self.client_contexts[client_id][msg.title][0] - int(self.values) < amount_of_reviews:
+                print(f"[Worker {self.id}] Accumulated {self.values} of {msg.title} for client {client_id}")
+        return None
+
+    def add_to_context(self, client_id, msg_type, title, rating, authors=None, amount_of_reviews=1):
+        old_value = self.client_contexts[client_id].get(title, None)
+        if old_value != None:
+            old_value = old_value.copy()
+        if authors == None:
+            authors = old_value[2]
+        scale = max(smalles_scale_for_str(title),smalles_scale_for_str(authors))
+        if scale not in self.client_context_storage_updates:
+            self.client_context_storage_updates[scale] = {}
+        if title in self.client_context_storage_updates[scale]:
+            old_value = self.client_context_storage_updates[scale][title][0]
+        new_value = self.client_contexts[client_id].get(title, [0, 0.0, authors])
+        if msg_type != BOOK_MSG_TYPE:
+            new_value[0] += amount_of_reviews
+            new_value[1] += rating
+        self.client_context_storage_updates[scale][title] = (old_value, new_value)
+        self.client_contexts[client_id][title] = new_value
+
+    def sorted_final_results(self, client_id):
+        sorted_results = []
+        for title, accum in sorted(self.client_contexts[client_id].items()):
+            if accum[0] >= int(self.values):
+                authors = accum[2].split(';')
+                result = QueryMessage(msg_type=BOOK_MSG_TYPE, title=title, authors=authors, rating=accum[1] / accum[0])
+                sorted_results.append(result)
+        return sorted_results
+
+    def rebuild_string_table(self):
+        self.string_table.clear()
+
+    def add_previous_context(self, previous_context, client_id):
+        if client_id in self.client_contexts:
+            self.client_contexts[client_id].update(previous_context)
+        else:
+            self.client_contexts[client_id] = previous_context
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * 4096
+
+def accumulate(accumulator, batches_bytes):
+    for batch_bytes in batches_bytes:
+        accumulator.process_batch_messages(Batch.from_bytes(batch_bytes), [])
+        accumulator.client_context_storage_updates = {}
+
+def lookups(accumulator, batches_bytes):
+    reviews = [msg for batch_bytes in batches_bytes for msg in Batch.from_bytes(batch_bytes) if msg.msg_type == REVIEW_MSG_TYPE]
+    start = time.perf_counter()
+    for client_id, context in accumulator.client_contexts.items():
+        titles = getattr(context, 'rows', context)
+        for msg in reviews:
+            msg.title in titles
+    return (time.perf_counter() - start) / (len(reviews) * len(accumulator.client_contexts))
+
+def measure(accumulator_class, batches_bytes, with_tracing, results):
+    start_rss = rss()
+    if with_tracing:
+        tracemalloc.start()
+    accumulator = accumulator_class(SenderID(1, 1, 1), None, 1, 'review_count', MIN_REVIEWS, 'title')
+    start = time.perf_counter()
+    accumulate(accumulator, batches_bytes)
+    elapsed = time.perf_counter() - start
+    if with_tracing:
+        results.put(tracemalloc.get_traced_memory()[0])
+        return
+    results.put((rss() - start_rss, elapsed, lookups(accumulator, batches_bytes)))
+
+def in_process(accumulator_class, batches_bytes, with_tracing):
+    results = Queue()
+    process = Process(target=measure, args=(accumulator_class, batches_bytes, with_tracing, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def main():
+    titles = [f"Title of the book number {i}" for i in range(AMOUNT_OF_BOOKS)]
+    books = [QueryMessage(BOOK_MSG_TYPE, year=1990, title=title, authors=[f"Author number {i % AMOUNT_OF_AUTHORS}"]) for i, title in enumerate(titles)]
+    reviews = [QueryMessage(REVIEW_MSG_TYPE, title=titles[(i * i) % AMOUNT_OF_BOOKS], rating=float(1 + i % 5)) for i in range(AMOUNT_OF_REVIEWS)]
+    batches_bytes = []
+    for client_id in range(AMOUNT_OF_CLIENTS):
+        batches = batches_of(books, client_id=client_id) + batches_of(reviews, client_id=client_id)
+        batches_bytes.extend(batch.to_bytes() for batch in batches)
+    print(f"{AMOUNT_OF_CLIENTS} clients of {len(books)} books and {len(reviews)} reviews")
+    baseline = None
+    for name, accumulator_class in [("dict of lists", DictAmountOfReviewByTitleAccumulator), ("interned columns", AmountOfReviewByTitleAccumulator)]:
+        traced = in_process(accumulator_class, batches_bytes, True)
+        rss_growth, elapsed, lookup_time = in_process(accumulator_class, batches_bytes, False)
+        if baseline == None:
+            baseline = traced
+        print(f"    {name}: {traced/2**20:.1f} MiB traced ({baseline/traced:.1f}x), {rss_growth/2**20:.1f} MiB RSS, accumulate {elapsed*1000:.0f} ms, lookup {lookup_time*1e9:.0f} ns")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+from utils.Batch import Batch
+from utils.Book import Book
+from utils.Review import Review
+from utils.DatasetHandler import DatasetReader
+from utils.QueryMessage import BOOK_MSG_TYPE, REVIEW_MSG_TYPE
+from utils.SenderID import SenderID
+from utils.auxiliar_functions import append_extend
+
+DATA_PATH = 'data/'
+DEFAULT_BOOK_FILE = 'books20.csv'
+DEFAULT_REVIEW_FILE = 'reviews20.csv'
+SAMPLE_BOOK_FILE = 'utils/test.csv'
+BATCH_SIZE = 512
+BENCHMARK_SENDER_ID = SenderID(0, 0, 0)
+
+def dataset_paths():
+    """
+    Returns the books and reviews files to benchmark with. They can be passed 
+    as the first two arguments, otherwise the client's default files are used 
+    """
+    book_file = sys.argv[1] if len(sys.argv) > 1 else DATA_PATH + DEFAULT_BOOK_FILE
+    review_file = sys.argv[2] if len(sys.argv) > 2 else DATA_PATH + DEFAULT_REVIEW_FILE
+    return book_file, review_file
+
+def read_objects(path, object_type, object_class, amount):
+    if not os.path.exists(path):
+        print(f"[Benchmark] {path} not found")
+        return []
+    reader = DatasetReader(path)
+    objects = []
+    while len(objects) < amount:
+        lines = reader.read_lines(min(BATCH_SIZE, amount - len(objects)), object_type)
+        if len(lines) == 0:
+            break
+        for line in lines:
+            try:
+                objects.append(object_class.from_datasetline(line))
+            except Exception:
+                continue
+    reader.close()
+    return objects
+
+def load_books(amount=20000):
+    book_file, _ = dataset_paths()
+    books = read_objects(book_file, BOOK_MSG_TYPE, Book, amount)
+    if not books:
+        print(f"[Benchmark] Using {SAMPLE_BOOK_FILE} as books sample")
+        books = read_objects(SAMPLE_BOOK_FILE, BOOK_MSG_TYPE, Book, amount) * amount
+    return books[:amount]
+
+def load_reviews(amount=50000):
+    """
+    Loads reviews from the reviews dataset. If it is not available, reviews are 
+    synthesized over the titles of the books sample so the title distribution
+    is still skewed towards a few books
+    """
+    _, review_file = dataset_paths()
+    reviews = read_objects(review_file, REVIEW_MSG_TYPE, Review, amount)
+    if reviews:
+        return reviews
+    print(f"[Benchmark] Synthesizing reviews")
+    books = load_books(1000)
+    titles = [book.title for book in books if book.title] or ['Untitled']
+    for i in range(amount):
+        title = titles[(i * i) % len(titles)]
+        text = f"This book was {['great', 'not good', 'really boring', 'a nice read'][i % 4]}, review number {i}"
+        reviews.append(Review(str(i), title, '', '', '', '', str(float(1 + i % 5)), '', '', text))
+    return reviews
+
+def query_messages(objects, query_number):
+    methods = {
+        1: 'to_query1',
+        2: 'to_query2',
+        3: 'to_query3',
+        5: 'to_query5',
+    }
+    messages = []
+    for obj in objects:
+        message = getattr(obj, methods[query_number])()
+        if message:
+            append_extend(messages, message)
+    return messages
+
+def batches_of(messages, batch_size=BATCH_SIZE, client_id=0):
+    batches = []
+    for i in range(0, len(messages), batch_size):
+        batches.append(Batch(client_id, BENCHMARK_SENDER_ID, i // batch_size, messages[i:i+batch_size]))
+    return batches
+
+def timed(function, *args, repetitions=1):
+    """
+    Returns the best wall time out of repetitions executions of function(*args) and its result
+    """
+    best = None
+    result = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, result
@@ -0,0 +1,91 @@
+"""
+Compares logging the undo logs of batches as the previous log format did (prepare
+and count prepare bytes, and an fsync for every log) against framed records
+committed once per batch. It also times recovering the undo logs of the last
+batch from a long log, and converting a log in the previous format.
+
+Usage: python3 -m benchmarks.log
+"""
+import os
+import tempfile
+from benchmarks.datasets import timed
+from Persistance.log import LogReadWriter, ChangingFile, FinishedWriting, AckedBatch, LogType, LEGACY_PREPARE_BYTE, LEGACY_COUNT_PREPARE_BYTE
+
+AMOUNT_OF_BATCHES = 200
+KEYS_PER_BATCH = 20
+REPETITIONS = 3
+
+def batch_logs(batch_number):
+    keys = [f"title {batch_number} {i}" for i in range(KEYS_PER_BATCH)]
+    return [
+        ChangingFile("counts", keys, [[i, float(i)] for i in range(KEYS_PER_BATCH)]),
+        ChangingFile("top", [f"new title {batch_number}"], [None]),
+        FinishedWriting(),
+        AckedBatch(),
+    ]
+
+def legacy_log(file, log):
+    byte_array = log.get_log_bytes()
+    file.seek(0, os.SEEK_END)
+    file.write(bytes([LEGACY_PREPARE_BYTE]) * len(byte_array) + bytes([LEGACY_COUNT_PREPARE_BYTE]) * len(byte_array))
+    file.flush()
+    file.seek(-2*len(byte_array), os.SEEK_END)
+    file.write(byte_array)
+    file.flush()
+    size = file.seek(0, os.SEEK_END)
+    file.truncate(size - len(byte_array))
+    file.flush()
+    os.fsync(file.fileno())
+
+def log_legacy(path):
+    with open(path, 'wb+') as file:
+        for batch_number in range(AMOUNT_OF_BATCHES):
+            for log in batch_logs(batch_number):
+                legacy_log(file, log)
+
+def log_in_groups(path):
+    logger = LogReadWriter.new(path)
+    for batch_number in range(AMOUNT_OF_BATCHES):
+        for log in batch_logs(batch_number):
+            logger.log(log, commit=False)
+        logger.commit()
+    logger.close()
+
+def recover(path):
+    logger = LogReadWriter.new(path)
+    logs = logger.read_until_log_type(LogType.FinishedWriting)
+    logger.close()
+    return logs
+
+def convert(path, legacy_bytes):
+    with open(path, 'wb') as file:
+        file.write(legacy_bytes)
+    logger = LogReadWriter.new(path)
+    logs = logger.read_all_logs()
+    logger.close()
+    return logs
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, 'legacy.bin')
+        path = os.path.join(directory, 'log.bin')
+        amount_of_logs = AMOUNT_OF_BATCHES * len(batch_logs(0))
+        print(f"{AMOUNT_OF_BATCHES} batches, {amount_of_logs} logs")
+
+        legacy_time, _ = timed(log_legacy, legacy_path, repetitions=REPETITIONS)
+        print(f"    legacy logging: {legacy_time*1000:.1f} ms, {amount_of_logs/legacy_time:.0f} logs/s, {os.path.getsize(legacy_path)} bytes")
+        group_time, _ = timed(log_in_groups, path, repetitions=1)
+        print(f"    group commit logging: {group_time*1000:.1f} ms, {amount_of_logs/group_time:.0f} logs/s ({legacy_time/group_time:.1f}x), {os.path.getsize(path)} bytes")
+
+        recovery_time, logs = timed(recover, path, repetitions=REPETITIONS)
+        assert logs == [AckedBatch(), FinishedWriting()]
+        print(f"    recovering the last batch: {recovery_time*1000:.2f} ms")
+
+        with open(legacy_path, 'rb') as file:
+            legacy_bytes = file.read()
+        conversion_time, logs = timed(convert, path, legacy_bytes, repetitions=REPETITIONS)
+        assert len(logs) == amount_of_logs
+        print(f"    converting the legacy log: {conversion_time*1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
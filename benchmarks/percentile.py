@@ -0,0 +1,59 @@
+"""
+Times the query 5 percentile accumulator computing the titles over the 90th percentile of
+the mean sentiment polarity, for 10k, 100k and 1M titles: inserting every title in a sorted
+list with bisect.insort, as it used to, against the percentile engine, with and without
+the quantile sketch (PERCENTILE_SKETCH), and the error of the estimate of the sketch.
+
+Usage: python3 -m benchmarks.percentile [amount_of_titles ...]
+"""
+import sys
+import bisect
+import random
+from benchmarks.datasets import timed
+from Workers.Accumulators import BookAtribute
+from Workers.Percentile import PercentileEngine
+
+SIZES = [10000, 100000, 1000000]
+PERCENTILE = 90
+# Inserting in a sorted list is quadratic, so it is only timed up to this amount of titles
+MAX_INSORT_TITLES = 100000
+
+def insort_top(entries):
+    context = []
+    for title, msp in entries:
+        bisect.insort(context, BookAtribute(title, msp))
+    cutoff_index = int(len(context) * (PERCENTILE / 100))
+    top = []
+    for book_attr in context:
+        if book_attr >= context[cutoff_index]:
+            bisect.insort(top, book_attr)
+    return [book_attr.title for book_attr in top]
+
+def engine_top(entries, with_sketch):
+    engine = PercentileEngine.new(PERCENTILE, with_sketch)
+    for title, msp in entries:
+        engine.add(title, msp)
+    return [title for title, _ in engine.top()], engine
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    random.seed(0)
+    for amount_of_titles in sizes:
+        entries = [(f"Title of the book number {i}", random.uniform(-1, 1)) for i in range(amount_of_titles)]
+        print(f"{amount_of_titles} titles")
+        insort_time = None
+        if amount_of_titles <= MAX_INSORT_TITLES:
+            insort_time, insort_titles = timed(insort_top, entries)
+            print(f"    insort: {insort_time*1000:.0f} ms")
+        for with_sketch in [False, True]:
+            elapsed, (titles, engine) = timed(engine_top, entries, with_sketch)
+            if insort_time != None:
+                assert titles == insort_titles
+            speedup = f" ({insort_time/elapsed:.1f}x)" if insort_time != None else ""
+            print(f"    engine{' with sketch' if with_sketch else ''}: {elapsed*1000:.0f} ms{speedup}", end='')
+            if with_sketch:
+                print(f", cutoff {engine.cutoff():.4f}, estimated {engine.estimated_cutoff():.4f}", end='')
+            print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Times the polarity of the review texts of batches with each sentiment engine of the query 5
+accumulator (SENTIMENT_ENGINE), in the worker process, and checks that the polarities of the
+lexicon engine are within POLARITY_TOLERANCE of the ones of TextBlob, over the reviews and
+the golden reviews. Needs textblob and numpy.
+
+Usage: python3 -m benchmarks.polarity [books_file] [reviews_file]
+"""
+from benchmarks.datasets import load_reviews, timed, BATCH_SIZE
+from Workers.LexiconSentiment import default_lexicon, GOLDEN_REVIEWS, POLARITY_TOLERANCE
+from Workers.Sentiment import SentimentEngine, SENTIMENT_ANALYSERS, TEXTBLOB_SENTIMENT_ENGINE
+
+AMOUNT_OF_REVIEWS = 5000
+REPETITIONS = 3
+
+def analyse(engine, batches):
+    polarities = []
+    for texts in batches:
+        polarities.extend(engine.polarities(texts))
+    return polarities
+
+def main():
+    if default_lexicon() == None:
+        return
+    texts = [review.text for review in load_reviews(AMOUNT_OF_REVIEWS)]
+    texts += [texto for texto, _ in GOLDEN_REVIEWS]
+    batches = [texts[i:i+BATCH_SIZE] for i in range(0, len(texts), BATCH_SIZE)]
+    print(f"{len(texts)} reviews in {len(batches)} batches")
+    textblob_polarities = None
+    textblob_time = None
+    for sentiment_engine, analyser in SENTIMENT_ANALYSERS.items():
+        engine = SentimentEngine.new(1, analyser=analyser)
+        elapsed, polarities = timed(analyse, engine, batches, repetitions=REPETITIONS)
+        engine.close()
+        if sentiment_engine == TEXTBLOB_SENTIMENT_ENGINE:
+            textblob_polarities, textblob_time = polarities, elapsed
+        differences = [abs(polarity - expected) for polarity, expected in zip(polarities, textblob_polarities) if expected != None]
+        assert max(differences) <= POLARITY_TOLERANCE
+        print(f"    {sentiment_engine}: {elapsed*1000:.0f} ms, {len(texts)/elapsed:.0f} reviews/s ({textblob_time/elapsed:.1f}x), max difference {max(differences):.2g}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Times the polarity of the review texts of batches, as the query 5 accumulator computes
+it, in the worker process and with sentiment engines of several processes, and the hit rate
+of a polarity cache over the reviews. Needs textblob.
+
+Usage: python3 -m benchmarks.sentiment [books_file] [reviews_file]
+"""
+import os
+from benchmarks.datasets import load_reviews, timed, BATCH_SIZE
+from Workers.Sentiment import SentimentEngine
+
+AMOUNT_OF_REVIEWS = 5000
+PROCESSES = [1, 2, 4]
+POLARITY_CACHE_SIZE = 2**16
+
+def analyse(engine, batches):
+    polarities = []
+    for texts in batches:
+        polarities.extend(engine.polarities(texts))
+    return polarities
+
+def main():
+    try:
+        import textblob
+    except ImportError:
+        print("[Benchmark] textblob is not installed")
+        return
+    texts = [review.text for review in load_reviews(AMOUNT_OF_REVIEWS)]
+    batches = [texts[i:i+BATCH_SIZE] for i in range(0, len(texts), BATCH_SIZE)]
+    print(f"{len(texts)} reviews in {len(batches)} batches, {os.cpu_count()} cpus")
+    inline_polarities = None
+    inline_time = None
+    for processes in sorted(set(PROCESSES + [os.cpu_count()])):
+        engine = SentimentEngine.new(processes)
+        elapsed, polarities = timed(analyse, engine, batches)
+        engine.close()
+        if inline_polarities == None:
+            inline_polarities, inline_time = polarities, elapsed
+        assert polarities == inline_polarities
+        print(f"    {processes} processes: {elapsed*1000:.0f} ms, {len(texts)/elapsed:.0f} reviews/s ({inline_time/elapsed:.1f}x)")
+    engine = SentimentEngine.new(1, POLARITY_CACHE_SIZE)
+    elapsed, polarities = timed(analyse, engine, batches)
+    assert polarities == inline_polarities
+    print(f"    polarity cache: {elapsed*1000:.0f} ms ({inline_time/elapsed:.1f}x)", end=', ')
+    engine.cache.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares the previous sharding (sha256 hexdigest parsed as an int, lists rebuilt 
+for every message) against the Sharder with each of the SHARD_HASHES, over the 
+titles of the books and reviews sent to query 3 and the authors sent to query 2.
+It also prints how evenly each hash spreads the messages, and the sha256 Sharder 
+with a routing cache of each of ROUTING_CACHE_SIZES.
+
+Usage: python3 -m benchmarks.sharding [books_file] [reviews_file]
+"""
+import hashlib
+from benchmarks.datasets import load_books, load_reviews, query_messages, batches_of, timed
+from utils.Batch import Batch
+from CommunicationMiddleware.sharding import SHARD_HASHES, SHA256_SHARD_HASH, Sharder
+
+REPETITIONS = 5
+AMOUNTS_OF_SHARDS = [3, 5]
+ROUTING_CACHE_SIZES = [2**10, 2**16]
+
+def legacy_sharded_batchs(batch, shard_by, amount_of_shards):
+    hashed_messages = {}
+    for msg in batch:
+        string_to_hash = msg.get_attribute_to_hash(shard_by)
+        hash_object = hashlib.sha256(string_to_hash.lower().encode())
+        msg_destination = int(hash_object.hexdigest(), 16) % amount_of_shards
+        hashed_messages[msg_destination] = hashed_messages.get(msg_destination, []) + [msg]
+    return {w:Batch(batch.client_id, batch.sender_id, batch.seq_num, messages) for w, messages in hashed_messages.items()}
+
+def shard_all(shard_function, batches, shard_by, amount_of_shards):
+    return [shard_function(batch, shard_by, amount_of_shards) for batch in batches]
+
+def destinations(sharded_batchs):
+    return [{w: [m.to_bytes() for m in b] for w, b in sharded.items()} for sharded in sharded_batchs]
+
+def spread(sharded_batchs, amount_of_shards):
+    sizes = [0] * amount_of_shards
+    for sharded in sharded_batchs:
+        for w, batch in sharded.items():
+            sizes[w] += batch.size()
+    return max(sizes) / (sum(sizes) / amount_of_shards)
+
+def run(name, messages, shard_by):
+    batches = batches_of(messages)
+    for amount_of_shards in AMOUNTS_OF_SHARDS:
+        print(f"{name}: {len(messages)} messages by {shard_by} into {amount_of_shards} shards")
+        legacy_time, legacy = timed(shard_all, legacy_sharded_batchs, batches, shard_by, amount_of_shards, repetitions=REPETITIONS)
+        print(f"    legacy: {legacy_time*1000:.1f} ms, max/mean load {spread(legacy, amount_of_shards):.3f}")
+        for shard_hash in SHARD_HASHES:
+            sharder = Sharder.new(shard_hash)
+            shard_time, sharded = timed(shard_all, sharder.shard, batches, shard_by, amount_of_shards, repetitions=REPETITIONS)
+            if shard_hash == SHA256_SHARD_HASH:
+                assert destinations(sharded) == destinations(legacy)
+            print(f"    {shard_hash}: {shard_time*1000:.1f} ms ({legacy_time/shard_time:.1f}x), max/mean load {spread(sharded, amount_of_shards):.3f}")
+        for routing_cache_size in ROUTING_CACHE_SIZES:
+            sharder = Sharder.new(SHA256_SHARD_HASH, routing_cache_size)
+            shard_time, sharded = timed(shard_all, sharder.shard, batches, shard_by, amount_of_shards, repetitions=REPETITIONS)
+            assert destinations(sharded) == destinations(legacy)
+            hits, misses, _size = sharder.routing_cache_stats()
+            print(f"    sha256 + cache of {routing_cache_size}: {shard_time*1000:.1f} ms ({legacy_time/shard_time:.1f}x), {hits/(hits+misses):.1%} hit rate")
+
+def main():
+    books = load_books()
+    reviews = load_reviews()
+    run("books query 3", query_messages(books, 3), 'title')
+    run("reviews query 3", query_messages(reviews, 3), 'title')
+    run("books query 2", query_messages(books, 2), 'authors')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Times how long a restarted worker takes to load the context of a client with each storage
+backend, for contexts of 10k, 100k and 1M titles. The context is the one of the query 3
+review count accumulator: the amount of reviews, the ratings sum and the authors of each title.
+The time is the one of Worker.load_all_context, from opening the context files to having
+the client context rebuilt. It also times loading the contexts of several clients with 
+different amounts of loader threads (CONTEXT_LOADERS).
+
+Usage: python3 -m benchmarks.startup [amount_of_titles ...]
+"""
+import os
+import sys
+import tempfile
+from benchmarks.datasets import timed
+from Persistance.KeyValueStorage import STORAGE_BACKENDS
+from Workers.Accumulators import AmountOfReviewByTitleAccumulator
+from Workers.Worker import info_from_filename
+from utils.SenderID import SenderID
+from utils.auxiliar_functions import smalles_scale_for_str
+
+SIZES = [10000, 100000, 1000000]
+CLIENT_ID = 1
+REPETITIONS = 3
+AMOUNT_OF_CLIENTS = 8
+TITLES_BY_CLIENT = 50000
+CONTEXT_LOADERS = [1, 2, 4, 8]
+
+class BenchmarkAccumulator(AmountOfReviewByTitleAccumulator):
+    def __init__(self, directory, storage_class):
+        super().__init__(SenderID(1, 1, 1), None, 1, 'review_count', 1, 'title')
+        self.directory = directory
+        self.storage_class = storage_class
+
+    def worker_dir(self):
+        return self.directory
+
+def write_context(worker, amount_of_titles, client_id=CLIENT_ID):
+    updates = {}
+    for i in range(amount_of_titles):
+        title = f"Title of the book number {i}"
+        authors = f"Author {i % 1000};Other author {i % 7}"
+        scale = max(smalles_scale_for_str(title), smalles_scale_for_str(authors))
+        updates.setdefault(scale, {})[title] = [i % 50, float(i % 500) / 2, authors]
+    for scale, scale_updates in updates.items():
+        filename = worker.context_filename(client_id, scale)
+        path = worker.worker_dir() + filename
+        storage = worker.open_context_storage(path, info_from_filename(filename)[1])
+        storage.apply(list(scale_updates.keys()), list(scale_updates.values()))
+        storage.close()
+
+def load(worker):
+    worker.load_all_context()
+    for storages in worker.client_contexts_storage.values():
+        for storage in storages.values():
+            storage.close()
+    return worker.client_contexts
+
+def load_clients(storage_class):
+    with tempfile.TemporaryDirectory() as directory:
+        worker = BenchmarkAccumulator(directory + '/', storage_class)
+        for client_id in range(AMOUNT_OF_CLIENTS):
+            write_context(worker, TITLES_BY_CLIENT, client_id)
+        amount_of_files = len(os.listdir(directory))
+        print(f"{AMOUNT_OF_CLIENTS} clients of {TITLES_BY_CLIENT} titles, {amount_of_files} files")
+        for context_loaders in CONTEXT_LOADERS:
+            worker.context_loaders = context_loaders
+            load_time, client_contexts = timed(load, worker, repetitions=REPETITIONS)
+            assert len(client_contexts) == AMOUNT_OF_CLIENTS
+            print(f"    {context_loaders} loaders: {load_time*1000:.0f} ms")
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for amount_of_titles in sizes:
+        print(f"{amount_of_titles} titles")
+        for backend, storage_class in STORAGE_BACKENDS.items():
+            with tempfile.TemporaryDirectory() as directory:
+                worker = BenchmarkAccumulator(directory + '/', storage_class)
+                write_context(worker, amount_of_titles)
+                size = sum(os.path.getsize(os.path.join(directory, filename)) for filename in os.listdir(directory))
+                load_time, client_contexts = timed(load, worker, repetitions=REPETITIONS)
+                assert len(client_contexts[CLIENT_ID]) == amount_of_titles
+                print(f"    {backend}: {load_time*1000:.0f} ms, {amount_of_titles/load_time:.0f} titles/s, {size} bytes")
+    for backend, storage_class in STORAGE_BACKENDS.items():
+        print(backend, end=': ')
+        load_clients(storage_class)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares the storage backends, fixed width and records, on a large accumulator context: the amount
+of reviews and ratings sum by title, as query 3 accumulates them. For each backend
+it times storing every title one batch of updates at a time, with store_all and 
+with apply, loading the whole context and removing a tenth of the titles one at a 
+time and with a single apply. If the reviews have less than 
+MIN_TITLES titles, as the synthesized ones, they are spread over MIN_TITLES titles.
+
+Usage: python3 -m benchmarks.storage [books_file] [reviews_file]
+"""
+import os
+import tempfile
+from benchmarks.datasets import load_reviews, timed, BATCH_SIZE
+from Persistance.KeyValueStorage import STORAGE_BACKENDS
+
+KEY_SIZE = 128
+U32_BYTES = 4
+FLOAT_BYTES = 4
+REPETITIONS = 3
+MIN_TITLES = 10000
+
+def context_updates(reviews):
+    spread_titles = len(set(review.title for review in reviews)) < MIN_TITLES
+    counts = {}
+    updates = []
+    for i in range(0, len(reviews), BATCH_SIZE):
+        batch_updates = {}
+        for j, review in enumerate(reviews[i:i+BATCH_SIZE]):
+            if not review.title:
+                continue
+            title = review.title
+            if spread_titles:
+                title = f"{title} {((i + j) * 7919) % MIN_TITLES}"
+            amount, ratings_sum = counts.get(title, (0, 0.0))
+            counts[title] = (amount + 1, ratings_sum + float(review.score or 0))
+            batch_updates[title] = list(counts[title])
+        updates.append(batch_updates)
+    return updates
+
+def open_storage(storage_class, path):
+    return storage_class.new(path, str, KEY_SIZE, [int, float], [U32_BYTES, FLOAT_BYTES])
+
+def store_updates(storage_class, path, updates):
+    if os.path.exists(path):
+        os.remove(path)
+    storage = open_storage(storage_class, path)
+    for batch_updates in updates:
+        storage.store_all(list(batch_updates.keys()), list(batch_updates.values()))
+    storage.close()
+
+def apply_updates(storage_class, path, updates):
+    if os.path.exists(path):
+        os.remove(path)
+    storage = open_storage(storage_class, path)
+    for batch_updates in updates:
+        storage.apply(list(batch_updates.keys()), list(batch_updates.values()))
+    storage.close()
+
+def load(storage_class, path):
+    storage = open_storage(storage_class, path)
+    entries = storage.get_all_entries()
+    storage.close()
+    return entries
+
+def remove_keys(storage_class, path, keys):
+    storage = open_storage(storage_class, path)
+    storage.get_all_entries()
+    for key in keys:
+        storage.remove(key)
+    storage.close()
+
+def apply_removals(storage_class, path, keys):
+    storage = open_storage(storage_class, path)
+    storage.get_all_entries()
+    storage.apply(keys, [None] * len(keys))
+    storage.close()
+
+def main():
+    updates = context_updates(load_reviews())
+    amount_of_updates = sum(len(batch_updates) for batch_updates in updates)
+    with tempfile.TemporaryDirectory() as directory:
+        for backend, storage_class in STORAGE_BACKENDS.items():
+            path = os.path.join(directory, backend + '.bin')
+            store_time, _ = timed(store_updates, storage_class, path, updates, repetitions=1)
+            apply_time, _ = timed(apply_updates, storage_class, path, updates, repetitions=1)
+            load_time, entries = timed(load, storage_class, path, repetitions=REPETITIONS)
+            print(f"{backend}: {len(entries)} titles, {os.path.getsize(path)} bytes")
+            print(f"    storing {amount_of_updates} updates in {len(updates)} batches: {store_time*1000:.1f} ms with store_all, {apply_time*1000:.1f} ms with apply")
+            print(f"    loading: {load_time*1000:.1f} ms")
+            keys_to_remove = list(entries.keys())[::10]
+            remove_time, _ = timed(remove_keys, storage_class, path, keys_to_remove, repetitions=1)
+            apply_updates(storage_class, path, updates)
+            apply_removals_time, _ = timed(apply_removals, storage_class, path, keys_to_remove, repetitions=1)
+            assert load(storage_class, path).keys() == entries.keys() - set(keys_to_remove)
+            print(f"    removing {len(keys_to_remove)} titles: {remove_time*1000:.1f} ms one at a time, {apply_removals_time*1000:.1f} ms with apply")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Times the query 4 top rating accumulator keeping the WORKER_VALUE titles with the best mean
+rating, over batches of titles whose ratings tend to grow, so the top changes often. It
+compares the accumulator pushing every title to a heap of BookAtribute and adding every
+insert and eviction to the context storage updates, as it used to, against the top-K
+operator, that only adds the keys added and evicted by each batch. It also times the final
+stage merging the runs of the partial stages, against offering them unsorted.
+
+Usage: python3 -m benchmarks.topk [amount_of_titles ...]
+"""
+import sys
+import heapq
+import random
+from benchmarks.datasets import timed, batches_of
+from Workers.TopK import TopK
+from Workers.Accumulators import Accumulator, RatingByTitleAccumulator, BookAtribute, CONTEXT_FLOAT_BYTES
+from utils.QueryMessage import QueryMessage, BOOK_MSG_TYPE
+from utils.SenderID import SenderID
+from utils.auxiliar_functions import smalles_scale_for_str
+
+SIZES = [100000, 1000000]
+K = 10
+PARTIAL_STAGES = 4
+MERGE_K = 10000
+
+class HeapRatingByTitleAccumulator(Accumulator):
+    def get_new_context(cls):
+        return []
+
+    def accumulate(self, client_id, msg):
+        if msg.rating == None or msg.title == None:
+            return
+        if len(self.client_contexts[client_id]) < int(self.values):
+            self.add_to_context(client_id, msg.title, msg.rating)
+        elif self.client_contexts[client_id][0].attribute < msg.rating:
+            self.remove_smallest_from_context(client_id)
+            self.add_to_context(client_id, msg.title, msg.rating)
+
+    def add_to_context(self, client_id, title, rating):
+        scale = smalles_scale_for_str(title)
+        if scale not in self.client_context_storage_updates:
+            self.client_context_storage_updates[scale] = {}
+        self.client_context_storage_updates[scale][title] = (None, [rating])
+        heapq.heappush(self.client_contexts[client_id], BookAtribute(title, rating))
+
+    def remove_smallest_from_context(self, client_id):
+        old_book_attribute = heapq.heappop(self.client_contexts[client_id])
+        scale = smalles_scale_for_str(old_book_attribute.title)
+        if scale not in self.client_context_storage_updates:
+            self.client_context_storage_updates[scale] = {}
+        self.client_context_storage_updates[scale][old_book_attribute.title] = ([old_book_attribute.attribute], None)
+
+    def sorted_final_results(self, client_id):
+        results = []
+        while len(self.client_contexts[client_id]) > 0:
+            result = heapq.heappop(self.client_contexts[client_id])
+            results.append(QueryMessage(BOOK_MSG_TYPE, title=result.title, rating=result.attribute))
+        return sorted(results, key=lambda q: q.title)
+
+    def get_context_storage_types(self, scale_of_update_file):
+        return [float], [CONTEXT_FLOAT_BYTES]
+
+    def add_previous_context(self, previous_context, client_id):
+        pass
+
+def accumulate(accumulator_class, batches):
+    accumulator = accumulator_class(SenderID(1, 1, 1), None, 1, 'rating', str(K), 'title')
+    writes = 0
+    for batch in batches:
+        accumulator.process_batch_messages(batch, [])
+        writes += sum(len(updates) for updates in accumulator.client_context_storage_updates.values())
+        accumulator.client_context_storage_updates = {}
+    results = [(msg.title, msg.rating) for msg in accumulator.sorted_final_results(batches[0].client_id)]
+    return results, writes
+
+def merge_runs(runs, merge):
+    top = TopK(MERGE_K)
+    for run in runs:
+        if merge:
+            top.merge(run)
+        else:
+            top.offer_all(run)
+    return top.sorted_by_key()
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    random.seed(0)
+    for amount_of_titles in sizes:
+        messages = [QueryMessage(BOOK_MSG_TYPE, title=f"Title of the book number {i}", rating=random.uniform(1, 5) + i / amount_of_titles) for i in range(amount_of_titles)]
+        batches = batches_of(messages)
+        print(f"{amount_of_titles} titles, top {K}")
+        heap_time, (heap_results, heap_writes) = timed(accumulate, HeapRatingByTitleAccumulator, batches)
+        print(f"    heap: {heap_time*1000:.0f} ms, {heap_writes} writes")
+        elapsed, (results, writes) = timed(accumulate, RatingByTitleAccumulator, batches)
+        assert results == heap_results
+        print(f"    top-K: {elapsed*1000:.0f} ms ({heap_time/elapsed:.1f}x), {writes} writes")
+        runs = []
+        for stage in range(PARTIAL_STAGES):
+            partial = TopK(MERGE_K)
+            partial.offer_all((msg.title, msg.rating) for msg in messages[stage::PARTIAL_STAGES])
+            runs.append(partial.sorted_by_value())
+        unsorted_runs = [sorted(run) for run in runs]
+        offer_time, offer_results = timed(merge_runs, unsorted_runs, False)
+        merge_time, merge_results = timed(merge_runs, runs, True)
+        assert merge_results == offer_results
+        print(f"    final stage of {PARTIAL_STAGES} partial top {MERGE_K}: unsorted {offer_time*1000:.0f} ms, runs {merge_time*1000:.0f} ms ({offer_time/merge_time:.1f}x)")
+
+if __name__ == '__main__':
+    main()
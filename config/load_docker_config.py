@@ -11,11 +11,29 @@ KILLER_CONFIG_FILE = "config/config_killer.ini"
 FILTER_TYPE = 'filter'
 ACCUMULATOR_TYPE = 'accumulator'
 REVIEW_TEXT_FIELD = 'review_text'
+REVIEW_COUNT_FIELD = 'review_count'
+TITLE_FIELD = 'title'
 FORWARD_TO_SEPARATOR = ','
 QUERY_POOL_SEPARATOR = '.'
 GATEWAY = 'Gateway'
 QUERIES = 5
 DISTRIBUTE_BY_DEFAULT = ''
+BATCH_FORMAT_DEFAULT = 'row'
+SHARD_HASH_DEFAULT = 'sha256'
+SHARD_CACHE_SIZE_DEFAULT = ''
+PUBLISH_WINDOW_DEFAULT = ''
+CONSUME_GROUP_SIZE_DEFAULT = ''
+STORAGE_BACKEND_DEFAULT = ''
+CHECKPOINT_BATCHES_DEFAULT = ''
+CHECKPOINT_SECONDS_DEFAULT = ''
+CONTEXT_LOADERS_DEFAULT = ''
+SENTIMENT_PROCESSES_DEFAULT = ''
+POLARITY_CACHE_SIZE_DEFAULT = ''
+PERSIST_POLARITY_CACHE_DEFAULT = ''
+SENTIMENT_ENGINE_DEFAULT = ''
+PERCENTILE_SKETCH_DEFAULT = ''
+COMBINE_REVIEWS_DEFAULT = ''
+TITLE_BLOOM_FILTER_BITS_DEFAULT = ''
 
 FILENAME = 'docker-compose-dev.yaml'
 RABBIT = """  rabbitmq:
@@ -67,6 +85,70 @@ class Pool():
         self.distribute_by = config_pool["DISTRIBUTE_BY"]
       except:
         self.distribute_by = DISTRIBUTE_BY_DEFAULT
+      try:
+        self.batch_format = config_pool["BATCH_FORMAT"]
+      except:
+        self.batch_format = BATCH_FORMAT_DEFAULT
+      try:
+        self.shard_hash = config_pool["SHARD_HASH"]
+      except:
+        self.shard_hash = SHARD_HASH_DEFAULT
+      try:
+        self.shard_cache_size = config_pool["SHARD_CACHE_SIZE"]
+      except:
+        self.shard_cache_size = SHARD_CACHE_SIZE_DEFAULT
+      try:
+        self.publish_window = config_pool["PUBLISH_WINDOW"]
+      except:
+        self.publish_window = PUBLISH_WINDOW_DEFAULT
+      try:
+        self.consume_group_size = config_pool["CONSUME_GROUP_SIZE"]
+      except:
+        self.consume_group_size = CONSUME_GROUP_SIZE_DEFAULT
+      try:
+        self.storage_backend = config_pool["STORAGE_BACKEND"]
+      except:
+        self.storage_backend = STORAGE_BACKEND_DEFAULT
+      try:
+        self.checkpoint_batches = config_pool["CHECKPOINT_BATCHES"]
+      except:
+        self.checkpoint_batches = CHECKPOINT_BATCHES_DEFAULT
+      try:
+        self.checkpoint_seconds = config_pool["CHECKPOINT_SECONDS"]
+      except:
+        self.checkpoint_seconds = CHECKPOINT_SECONDS_DEFAULT
+      try:
+        self.context_loaders = config_pool["CONTEXT_LOADERS"]
+      except:
+        self.context_loaders = CONTEXT_LOADERS_DEFAULT
+      try:
+        self.sentiment_processes = config_pool["SENTIMENT_PROCESSES"]
+      except:
+        self.sentiment_processes = SENTIMENT_PROCESSES_DEFAULT
+      try:
+        self.polarity_cache_size = config_pool["POLARITY_CACHE_SIZE"]
+      except:
+        self.polarity_cache_size = POLARITY_CACHE_SIZE_DEFAULT
+      try:
+        self.persist_polarity_cache = config_pool["PERSIST_POLARITY_CACHE"]
+      except:
+        self.persist_polarity_cache = PERSIST_POLARITY_CACHE_DEFAULT
+      try:
+        self.sentiment_engine = config_pool["SENTIMENT_ENGINE"]
+      except:
+        self.sentiment_engine = SENTIMENT_ENGINE_DEFAULT
+      try:
+        self.percentile_sketch = config_pool["PERCENTILE_SKETCH"]
+      except:
+        self.percentile_sketch = PERCENTILE_SKETCH_DEFAULT
+      try:
+        self.combine_reviews = config_pool["COMBINE_REVIEWS"]
+      except:
+        self.combine_reviews = COMBINE_REVIEWS_DEFAULT
+      try:
+        self.title_bloom_filter_bits = config_pool["TITLE_BLOOM_FILTER_BITS"]
+      except:
+        self.title_bloom_filter_bits = TITLE_BLOOM_FILTER_BITS_DEFAULT
       self.accumulate_by = None
       if self.worker_type == ACCUMULATOR_TYPE:
         self.accumulate_by = config_pool["ACCUMULATE_BY"]
@@ -94,12 +176,39 @@ class QueryConfig():
     def pool_distribute_by(self, pool_num):
       return self.query_pools[pool_num].distribute_by
 
+    def pool_batch_format(self, pool_num):
+      return self.query_pools[pool_num].batch_format
+
+    def pool_shard_hash(self, pool_num):
+      return self.query_pools[pool_num].shard_hash
+
+    def pool_accumulates_review_count(self, pool_num):
+      pool = self.query_pools[pool_num]
+      return pool.worker_type == ACCUMULATOR_TYPE and pool.worker_field == REVIEW_COUNT_FIELD and pool.accumulate_by == TITLE_FIELD
+
+    def pool_combine_reviews(self, queries, pool):
+      """
+      Returns the COMBINE_REVIEWS of pool if every pool it forwards to is a review count by title
+      accumulator, the only one that reads the combined reviews, or the default otherwise
+      """
+      if pool.combine_reviews == COMBINE_REVIEWS_DEFAULT:
+        return COMBINE_REVIEWS_DEFAULT
+      for next_pool in pool.forward_to.split(FORWARD_TO_SEPARATOR):
+        if next_pool != GATEWAY:
+          query_num, pool_num = next_pool.split(QUERY_POOL_SEPARATOR)
+          if queries[int(query_num)].pool_accumulates_review_count(int(pool_num)):
+            continue
+        print(f"Ignoring COMBINE_REVIEWS of pool {self.query_number}.{pool.pool_number}: {next_pool} is not a {REVIEW_COUNT_FIELD} accumulator by {TITLE_FIELD}")
+        return COMBINE_REVIEWS_DEFAULT
+      return pool.combine_reviews
+
     def to_docker_string(self, queries, eof_to_receive):
         result = ""
         workers_containers = []
         for p, pool in enumerate(self.query_pools):
+            combine_reviews = self.pool_combine_reviews(queries, pool)
             for i in range(pool.worker_amount):
-                next_pool_workers, shard_by = get_next_pool_foward_info(queries, pool.forward_to) 
+                next_pool_workers, shard_by, batch_formats, shard_hashes = get_next_pool_foward_info(queries, pool.forward_to) 
                 worker_id = f"{self.query_number}.{pool.pool_number}.{i}"
                 worker_container = f'{pool.worker_type}{worker_id}'
                 workers_containers.append(worker_container) 
@@ -121,6 +230,22 @@ class QueryConfig():
       - NEXT_POOL_WORKERS={next_pool_workers}
       - FORWARD_TO={pool.forward_to}
       - SHARD_BY={shard_by}
+      - NEXT_POOL_FORMATS={batch_formats}
+      - NEXT_POOL_SHARD_HASHES={shard_hashes}
+      - SHARD_CACHE_SIZE={pool.shard_cache_size}
+      - PUBLISH_WINDOW={pool.publish_window}
+      - CONSUME_GROUP_SIZE={pool.consume_group_size}
+      - STORAGE_BACKEND={pool.storage_backend}
+      - CHECKPOINT_BATCHES={pool.checkpoint_batches}
+      - CHECKPOINT_SECONDS={pool.checkpoint_seconds}
+      - CONTEXT_LOADERS={pool.context_loaders}
+      - SENTIMENT_PROCESSES={pool.sentiment_processes}
+      - POLARITY_CACHE_SIZE={pool.polarity_cache_size}
+      - PERSIST_POLARITY_CACHE={pool.persist_polarity_cache}
+      - SENTIMENT_ENGINE={pool.sentiment_engine}
+      - PERCENTILE_SKETCH={pool.percentile_sketch}
+      - COMBINE_REVIEWS={combine_reviews}
+      - TITLE_BLOOM_FILTER_BITS={pool.title_bloom_filter_bits}
       - WORKER_FIELD={pool.worker_field}
       - WORKER_VALUE={pool.worker_value}"""
                 if pool.worker_type == ACCUMULATOR_TYPE:
@@ -156,7 +281,7 @@ def process_gateway(queries, eof_to_receive, file):
   config = config["DEFAULT"]
   book_queries = config["BOOK_QUERIES"]
   review_queries = config["REVIEW_QUERIES"]
-  forward_to, next_pool_workers, shard_by = get_forward_gateway(queries, book_queries, review_queries)
+  forward_to, next_pool_workers, shard_by, batch_formats, shard_hashes = get_forward_gateway(queries, book_queries, review_queries)
   gateway_str = f"""  gateway:
     build:
       context: ./
@@ -172,6 +297,10 @@ def process_gateway(queries, eof_to_receive, file):
       - REVIEW_QUERIES={config["REVIEW_QUERIES"]}
       - FORWARD_TO={forward_to}
       - SHARD_BY={shard_by}
+      - NEXT_POOL_FORMATS={batch_formats}
+      - NEXT_POOL_SHARD_HASHES={shard_hashes}
+      - SHARD_CACHE_SIZE={config.get("SHARD_CACHE_SIZE", SHARD_CACHE_SIZE_DEFAULT)}
+      - PUBLISH_WINDOW={config.get("PUBLISH_WINDOW", PUBLISH_WINDOW_DEFAULT)}
       - NEXT_POOL_WORKERS={next_pool_workers}
       - EOF_TO_RECEIVE={eof_to_receive[GATEWAY]}
     volumes:
@@ -191,17 +320,21 @@ def get_forward_gateway(queries, book_queries, review_queries):
     forward_to.append(f"{query_name}.0")
   forward_to = ",".join(forward_to)
 
-  next_pool_workers, shard_by = get_next_pool_foward_info(queries, forward_to)
-  return forward_to, next_pool_workers, shard_by
+  next_pool_workers, shard_by, batch_formats, shard_hashes = get_next_pool_foward_info(queries, forward_to)
+  return forward_to, next_pool_workers, shard_by, batch_formats, shard_hashes
     
 def get_next_pool_foward_info(queries, forward_to):
   next_pools = forward_to.split(FORWARD_TO_SEPARATOR)
   next_pool_workers = []
   shard_by = []
+  batch_formats = []
+  shard_hashes = []
   for next_pool in next_pools:
     if next_pool == GATEWAY:
       next_pool_workers.append(str(1))
       shard_by.append(DISTRIBUTE_BY_DEFAULT)
+      batch_formats.append(BATCH_FORMAT_DEFAULT)
+      shard_hashes.append(SHARD_HASH_DEFAULT)
     else:
       query_num, pool_num = next_pool.split(QUERY_POOL_SEPARATOR)
       query = queries[int(query_num)]
@@ -209,8 +342,10 @@ def get_next_pool_foward_info(queries, forward_to):
       next_pool_workers.append(str(worker_amount))
       pool_shard_by = query.pool_distribute_by(int(pool_num))
       shard_by.append(pool_shard_by)
+      batch_formats.append(query.pool_batch_format(int(pool_num)))
+      shard_hashes.append(query.pool_shard_hash(int(pool_num)))
 
-  return ','.join(next_pool_workers), ','.join(shard_by)
+  return ','.join(next_pool_workers), ','.join(shard_by), ','.join(batch_formats), ','.join(shard_hashes)
 
 def write_queries(file, queries, eof_to_receive):
   all_containers = []
@@ -1,7 +1,9 @@
 import socket
+import struct
 from utils.SenderID import SenderID, SENDER_ID_BYTES
-from utils.auxiliar_functions import integer_to_big_endian_byte_array, byte_array_to_big_endian_integer, recv_exactly, remove_bytes
-from utils.QueryMessage import QueryMessage, query_result_headers
+from utils.auxiliar_functions import integer_to_big_endian_byte_array, recv_exactly
+from utils.QueryMessage import QueryMessage, LazyQueryMessage, query_result_headers
+from utils.ColumnarBatch import columns_to_bytes, messages_from_columns
 import unittest
 from unittest import TestCase
 
@@ -10,6 +12,14 @@ AMOUNT_OF_MESSAGES_BYTES = 2
 SEQ_NUM_BYTES = 4
 AMOUNT_OF_SEQ_NUMS = 2**(8*SEQ_NUM_BYTES)
 HEADER_LEN = AMOUNT_OF_CLIENT_ID_BYTES + SEQ_NUM_BYTES + SENDER_ID_BYTES + AMOUNT_OF_MESSAGES_BYTES  
+# client_id, sender_id (query, pool, sender_num), seq_num, amount_of_messages
+HEADER_STRUCT = struct.Struct('>IHHIIH')
+ROW_BATCH_FORMAT = 'row'
+COLUMNAR_BATCH_FORMAT = 'columnar'
+BATCH_FORMATS = [ROW_BATCH_FORMAT, COLUMNAR_BATCH_FORMAT]
+# The highest bit of amount_of_messages marks batchs whose messages are encoded in columnar layout
+COLUMNAR_FLAG = 0x8000
+AMOUNT_OF_MESSAGES_MASK = COLUMNAR_FLAG - 1
 
 class Batch():
     def __init__(self, client_id, sender_id, seq_num, messages):
@@ -23,38 +33,55 @@ class Batch():
         return Batch(client_id, sender_id, SeqNumGenerator.next_seq_num(), messages)
 
     @classmethod
-    def from_bytes(cls, byte_array):
+    def from_bytes(cls, byte_array, lazy=False):
+        """
+        Decodes a batch in any of the BATCH_FORMATS. If lazy is True the messages of row batchs 
+        are LazyQueryMessages that reference byte_array, so it must not be modified afterwards
+        """
         client_id, sender_id, seq_num, amount_of_messages = cls.get_header_fields_from_bytes(byte_array)
         if client_id == None:
             return None
         if amount_of_messages == 0:
             return Batch(client_id, sender_id, seq_num, [])
-        byte_array = byte_array[HEADER_LEN:]
+        if cls.is_columnar(byte_array):
+            return cls.from_columnar_bytes(byte_array, client_id, sender_id, seq_num, amount_of_messages)
+        message_class = LazyQueryMessage if lazy else QueryMessage
         messages = []
-        for _ in range(amount_of_messages):
-            if len(byte_array) == 0:
-                break
-            message = QueryMessage.from_bytes(byte_array)
-            if not message:
+        view = memoryview(byte_array)
+        try:
+            offset = HEADER_LEN
+            for _ in range(amount_of_messages):
+                if offset >= len(view):
+                    break
+                message, offset = message_class.from_buffer(view, offset)
+                if not message:
+                    return None
+                messages.append(message) 
+        finally:
+            if not lazy:
+                view.release()
+        return Batch(client_id, sender_id, seq_num, messages)
+
+    @classmethod
+    def from_columnar_bytes(cls, byte_array, client_id, sender_id, seq_num, amount_of_messages):
+        with memoryview(byte_array) as view:
+            try:
+                messages = messages_from_columns(view, HEADER_LEN, amount_of_messages)
+            except ValueError as e:
+                print(f"[Batch] Invalid columnar batch: {e}")
                 return None
-            messages.append(message) 
         return Batch(client_id, sender_id, seq_num, messages)
     
     @classmethod
     def get_header_fields_from_bytes(cls, byte_array):
         if byte_array == None or len(byte_array) < HEADER_LEN:
             return None, None, None, None
-        byte_array = bytearray(byte_array)
-        client_id = byte_array_to_big_endian_integer(remove_bytes(byte_array, AMOUNT_OF_CLIENT_ID_BYTES))
-        sender_id = SenderID.from_bytes(byte_array)
-        if not sender_id:
-            return None, None, None, None
-        seq_num = byte_array_to_big_endian_integer(remove_bytes(byte_array, SEQ_NUM_BYTES))
-        amount_of_messages = byte_array_to_big_endian_integer(remove_bytes(byte_array, AMOUNT_OF_MESSAGES_BYTES))
+        client_id, query, pool_id, sender_num, seq_num, amount_of_messages = HEADER_STRUCT.unpack_from(byte_array)
+        return client_id, SenderID(query, pool_id, sender_num), seq_num, amount_of_messages & AMOUNT_OF_MESSAGES_MASK
 
-        #client_id = byte_array_to_big_endian_integer(byte_array[:AMOUNT_OF_CLIENT_ID_BYTES])
-        #amount_of_messages = byte_array[AMOUNT_OF_CLIENT_ID_BYTES]
-        return client_id, sender_id, seq_num, amount_of_messages
+    @classmethod
+    def is_columnar(cls, byte_array):
+        return byte_array[HEADER_LEN - AMOUNT_OF_MESSAGES_BYTES] & (COLUMNAR_FLAG >> 8) != 0
 
     @classmethod
     def from_socket(cls, sock, data_class=None):
@@ -75,11 +102,24 @@ class Batch():
     def eof(cls, client_id, sender_id):
         return Batch(client_id, sender_id, SeqNumGenerator.next_seq_num(), [])
         
-    def to_bytes(self):
+    def to_bytes(self, batch_format=ROW_BATCH_FORMAT):
+        """
+        Encodes the batch in batch_format. Empty batchs are always encoded in row format.
+        Raises ValueError if it has more than AMOUNT_OF_MESSAGES_MASK messages
+        """
+        columnar = batch_format == COLUMNAR_BATCH_FORMAT and not self.is_empty()
+        amount_of_messages = len(self.messages)
+        if amount_of_messages > AMOUNT_OF_MESSAGES_MASK:
+            raise ValueError(f"Batch of {amount_of_messages} messages, the most a batch can have is {AMOUNT_OF_MESSAGES_MASK}")
+        if columnar:
+            amount_of_messages |= COLUMNAR_FLAG
         byte_array = integer_to_big_endian_byte_array(self.client_id, AMOUNT_OF_CLIENT_ID_BYTES)
         byte_array.extend(self.sender_id.to_bytes())
         byte_array.extend(integer_to_big_endian_byte_array(self.seq_num, SEQ_NUM_BYTES))
-        byte_array.extend(integer_to_big_endian_byte_array(len(self.messages), AMOUNT_OF_MESSAGES_BYTES))
+        byte_array.extend(integer_to_big_endian_byte_array(amount_of_messages, AMOUNT_OF_MESSAGES_BYTES))
+        if columnar:
+            byte_array.extend(columns_to_bytes(self.messages))
+            return byte_array
         for i, message in enumerate(self.messages):
             byte_array.extend(message.to_bytes())
         return byte_array
@@ -185,6 +225,45 @@ if __name__ == '__main__':
             batch = Batch.from_bytes(self.test_expected_batch_bytes())
             self.assertEqual(batch.to_bytes(), self.test_expected_batch_bytes())
 
+        def test_batch_from_bytes_object(self):
+            batch = Batch.from_bytes(bytes(self.test_expected_batch_bytes()))
+            self.assertEqual(batch.sender_id, SenderID(1,1,1))
+            self.assertEqual(batch.seq_num, 2)
+            expected_messages = [self.test_book_message1(), self.test_book_message2()]
+            self.assertEqual([m.to_bytes() for m in batch], [m.to_bytes() for m in expected_messages])
+
+        def test_lazy_batch_from_bytes(self):
+            batch = Batch.from_bytes(self.test_expected_batch_bytes(), lazy=True)
+            self.assertEqual(batch[0].title, 'titulo')
+            self.assertEqual(batch.to_bytes(), self.test_expected_batch_bytes())
+
+        def test_truncated_batch_from_bytes(self):
+            batch = Batch.from_bytes(self.test_expected_batch_bytes()[:-3])
+            self.assertEqual(batch, None)
+
+        def test_columnar_batch_round_trip(self):
+            batch = Batch(0, SenderID(1,1,1), 2, [self.test_book_message1(), self.test_book_message2()])
+            columnar_bytes = batch.to_bytes(COLUMNAR_BATCH_FORMAT)
+            self.assertTrue(Batch.is_columnar(columnar_bytes))
+            decoded = Batch.from_bytes(columnar_bytes)
+            self.assertEqual(decoded.sender_id, SenderID(1,1,1))
+            self.assertEqual(decoded.seq_num, 2)
+            self.assertEqual(decoded.to_bytes(), self.test_expected_batch_bytes())
+
+        def test_empty_columnar_batch_is_row_batch(self):
+            batch = Batch(0, SenderID(1,1,1), 2, [])
+            self.assertEqual(batch.to_bytes(COLUMNAR_BATCH_FORMAT), self.test_expected_empty_batch_bytes())
+
+        def test_truncated_columnar_batch(self):
+            batch = Batch(0, SenderID(1,1,1), 2, [self.test_book_message1(), self.test_book_message2()])
+            self.assertEqual(Batch.from_bytes(batch.to_bytes(COLUMNAR_BATCH_FORMAT)[:-3]), None)
+
+        def test_oversized_batch_to_bytes(self):
+            batch = Batch(0, SenderID(1,1,1), 2, [self.test_book_message2()] * (AMOUNT_OF_MESSAGES_MASK + 1))
+            for batch_format in BATCH_FORMATS:
+                with self.assertRaises(ValueError):
+                    batch.to_bytes(batch_format)
+
         def test_seq_num_generator(self):
             batch1 = Batch.eof(1, SenderID(1,1,1))
             batch2 = Batch.eof(1, SenderID(1,1,1))
@@ -0,0 +1,146 @@
+from array import array
+from itertools import accumulate
+import sys
+import unittest
+from unittest import TestCase
+from utils.QueryMessage import QueryMessage, SEPARATOR, AMOUNT_OF_FIXED_FIELDS, LIST_VARIABLE_FIELDS, MESSAGE_VALUE_FIELDS, BOOK_MSG_TYPE, REVIEW_MSG_TYPE
+
+"""
+Columnar layout of the messages of a batch, after the batch header (n = amount of messages):
+    msg_types: n bytes
+    presence bitmaps: one of ceil(n/8) bytes for each field, bit i is set if message i has the field
+    year: u16 array with the present values
+    rating, mean_sentiment_polarity: f32 arrays with the present values
+    title, authors, publisher, categories, review_text: u16 array with the encoded length
+        of each present value, followed by the utf-8 blob with all of them
+Arrays are little endian. As in the row format, a field is present if its value is truthy
+"""
+
+ARRAY_TYPECODES = ['H', 'f', 'f']
+LENGTHS_TYPECODE = 'H'
+BYTE_ORDER = 'little'
+AMOUNT_OF_FIELDS = len(MESSAGE_VALUE_FIELDS)
+
+def bitmap_len(amount_of_messages):
+    return (amount_of_messages + 7) // 8
+
+def array_to_bytes(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder != BYTE_ORDER:
+        values.byteswap()
+    return values.tobytes()
+
+def array_from_buffer(typecode, buffer, offset, amount):
+    values = array(typecode)
+    end = offset + amount * values.itemsize
+    if end > len(buffer):
+        raise ValueError("Truncated columnar batch")
+    values.frombytes(buffer[offset:end])
+    if sys.byteorder != BYTE_ORDER:
+        values.byteswap()
+    return values, end
+
+def encode_column_value(field, value):
+    if field - AMOUNT_OF_FIXED_FIELDS in LIST_VARIABLE_FIELDS:
+        value = SEPARATOR.join(value)
+    return value.encode()
+
+def columns_to_bytes(messages):
+    byte_array = bytearray(message.msg_type for message in messages)
+    columns = list(zip(*[message.fields_to_list() for message in messages]))
+    present_values = []
+    for column in columns:
+        bitmap = 0
+        values = []
+        for i, value in enumerate(column):
+            if value:
+                bitmap |= 1 << i
+                values.append(value)
+        byte_array.extend(bitmap.to_bytes(bitmap_len(len(messages)), BYTE_ORDER))
+        present_values.append(values)
+
+    for field, values in enumerate(present_values):
+        if field < AMOUNT_OF_FIXED_FIELDS:
+            byte_array.extend(array_to_bytes(ARRAY_TYPECODES[field], values))
+        else:
+            encoded_values = [encode_column_value(field, value) for value in values]
+            byte_array.extend(array_to_bytes(LENGTHS_TYPECODE, map(len, encoded_values)))
+            byte_array.extend(b''.join(encoded_values))
+    return byte_array
+
+def decode_strings(buffer, offset, amount):
+    lengths, offset = array_from_buffer(LENGTHS_TYPECODE, buffer, offset, amount)
+    if amount == 0:
+        return [], offset
+    ends = list(accumulate(lengths))
+    blob_end = offset + ends[-1]
+    if blob_end > len(buffer):
+        raise ValueError("Truncated columnar batch")
+    blob = str(buffer[offset:blob_end], 'utf-8')
+    strings = []
+    start = 0
+    if len(blob) == ends[-1]:
+        # Only single byte characters, so byte offsets are also string offsets
+        for end in ends:
+            strings.append(blob[start:end])
+            start = end
+    else:
+        for end in ends:
+            strings.append(str(buffer[offset + start:offset + end], 'utf-8'))
+            start = end
+    return strings, blob_end
+
+def messages_from_columns(buffer, offset, amount_of_messages):
+    """
+    Decodes amount_of_messages messages in columnar layout starting at offset.
+    Raises ValueError if the buffer does not hold them
+    """
+    if offset + amount_of_messages + AMOUNT_OF_FIELDS * bitmap_len(amount_of_messages) > len(buffer):
+        raise ValueError("Truncated columnar batch")
+    msg_types = buffer[offset:offset + amount_of_messages]
+    offset += amount_of_messages
+    rows_with_field = []
+    for _field in range(AMOUNT_OF_FIELDS):
+        bitmap = int.from_bytes(buffer[offset:offset + bitmap_len(amount_of_messages)], BYTE_ORDER)
+        offset += bitmap_len(amount_of_messages)
+        rows_with_field.append([i for i in range(amount_of_messages) if (bitmap >> i) & 1])
+
+    columns = []
+    for field, rows in enumerate(rows_with_field):
+        if field < AMOUNT_OF_FIXED_FIELDS:
+            values, offset = array_from_buffer(ARRAY_TYPECODES[field], buffer, offset, len(rows))
+        else:
+            values, offset = decode_strings(buffer, offset, len(rows))
+            if field - AMOUNT_OF_FIXED_FIELDS in LIST_VARIABLE_FIELDS:
+                values = [value.split(SEPARATOR) for value in values]
+        column = [None] * amount_of_messages
+        for row, value in zip(rows, values):
+            column[row] = value
+        columns.append(column)
+
+    return [QueryMessage(msg_type, *fields) for msg_type, fields in zip(msg_types, zip(*columns))]
+
+class TestColumnarBatch(TestCase):
+    def messages(self):
+        return [
+            QueryMessage(BOOK_MSG_TYPE, year=1990, title='titulo', authors=['autor1', 'autor2'], categories=['Fiction']),
+            QueryMessage(REVIEW_MSG_TYPE, rating=4.0, title='título con acentos', review_text='reseña'),
+            QueryMessage(REVIEW_MSG_TYPE, title='titulo', mean_sentiment_polarity=0.5),
+            QueryMessage(BOOK_MSG_TYPE),
+        ]
+
+    def test_columns_round_trip(self):
+        messages = self.messages()
+        byte_array = columns_to_bytes(messages)
+        decoded = messages_from_columns(memoryview(bytes(byte_array)), 0, len(messages))
+        self.assertEqual([m.to_bytes() for m in decoded], [m.to_bytes() for m in messages])
+        self.assertEqual([m.msg_type for m in decoded], [m.msg_type for m in messages])
+
+    def test_truncated_columns(self):
+        messages = self.messages()
+        byte_array = columns_to_bytes(messages)
+        with self.assertRaises(ValueError):
+            messages_from_columns(memoryview(bytes(byte_array[:-2])), 0, len(messages))
+
+if __name__ == '__main__':
+    unittest.main()
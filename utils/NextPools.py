@@ -1,16 +1,24 @@
 import os
 from utils.auxiliar_functions import QUERY_SEPARATOR, get_env_list
 from utils.QueryMessage import ALL_MESSAGE_FIELDS
+from utils.Batch import BATCH_FORMATS, ROW_BATCH_FORMAT
+from CommunicationMiddleware.sharding import SHARD_HASHES, DEFAULT_SHARD_HASH
 
 GATEWAY_QUEUE_NAME = "Gateway"
 NPW_POS = 0
 SB_POS = 1
+BF_POS = 2
+SH_POS = 3
 
 class NextPools():
-    def __init__(self, next_pools_id, next_pool_workers, shard_by):
+    def __init__(self, next_pools_id, next_pool_workers, shard_by, batch_formats=None, shard_hashes=None):
         self.pools = {}
+        if batch_formats == None:
+            batch_formats = [ROW_BATCH_FORMAT] * len(next_pools_id)
+        if shard_hashes == None:
+            shard_hashes = [DEFAULT_SHARD_HASH] * len(next_pools_id)
         for i in range(len(next_pools_id)):
-            self.pools[next_pools_id[i]] = (next_pool_workers[i], shard_by[i])
+            self.pools[next_pools_id[i]] = (next_pool_workers[i], shard_by[i], batch_formats[i], shard_hashes[i])
         
     @classmethod
     def from_env(cls):
@@ -24,11 +32,33 @@ class NextPools():
                 elif not shard_by[i] in ALL_MESSAGE_FIELDS:
                     print(f"[Worker] Invalid Distribute_by field: {r}")
                     return None                
-            return NextPools(next_pools_id, next_pool_workers, shard_by)
+            batch_formats = cls.optional_env_list("NEXT_POOL_FORMATS", len(next_pools_id), ROW_BATCH_FORMAT, BATCH_FORMATS)
+            shard_hashes = cls.optional_env_list("NEXT_POOL_SHARD_HASHES", len(next_pools_id), DEFAULT_SHARD_HASH, SHARD_HASHES)
+            if batch_formats == None or shard_hashes == None:
+                return None
+            return NextPools(next_pools_id, next_pool_workers, shard_by, batch_formats, shard_hashes)
         except Exception as r:
             print(f"[Worker] Failed converting fowarding info: {r}")
             return None
 
+    @classmethod
+    def optional_env_list(cls, env_name, amount_of_pools, default, valid_values):
+        """
+        Returns the value of env_name for each next pool, default for the pools 
+        without one or for all of them if env_name is not set
+        """
+        values = os.getenv(env_name)
+        if not values:
+            return [default] * amount_of_pools
+        values = values.split(QUERY_SEPARATOR)
+        for i in range(len(values)):
+            if values[i] == '':
+                values[i] = default
+            elif not values[i] in valid_values:
+                print(f"[Worker] Invalid {env_name} value: {values[i]}")
+                return None
+        return values
+
     def worker_ids(self):
         worker_ids = {}
         for pool_id, next_pool_workers, _shard_by in self:
@@ -39,8 +69,17 @@ class NextPools():
             worker_ids[pool_id] = l
         return worker_ids
     
+    def contains_pool(self, pool):
+        return pool in self.pools
+
     def shard_by_of_pool(self, pool):
         return self.pools[pool][SB_POS]
+
+    def batch_format_of_pool(self, pool):
+        return self.pools[pool][BF_POS]
+
+    def shard_hash_of_pool(self, pool):
+        return self.pools[pool][SH_POS]
     
     def __iter__(self):
         for pool, values in self.pools.items():
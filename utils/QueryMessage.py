@@ -11,6 +11,8 @@ QUERY2_RESULT = 3
 QUERY3_RESULT = 4
 QUERY4_RESULT = 5
 QUERY5_RESULT = 6
+# Reviews of a title folded by a combiner: year holds the amount of reviews and rating the sum of their ratings
+REVIEW_COUNT_MSG_TYPE = 7
 
 SEPARATOR = ","
 MSG_TYPE_BYTES = 1
@@ -26,6 +28,16 @@ MSP_BYTES = 4
 FIXED_PART_HEADER_LEN = MSG_TYPE_BYTES + PARAMETERS_BYTES
 
 PARAMETER_LENS = [YEAR_BYTES, RATING_BYTES, MSP_BYTES, TITLE_LEN_BYTES, AUTHORS_LEN_BYTES, PUBLISHER_LEN_BYTES, CATEGORIES_LEN_BYTES, REVIEW_TEXT_LEN_BYTES]
+VARIABLE_LEN_BYTES = PARAMETER_LENS[3:]
+AMOUNT_OF_FIXED_FIELDS = 3
+
+YEAR_PARAMETER = 0b1
+RATING_PARAMETER = 0b10
+MSP_PARAMETER = 0b100
+
+YEAR_STRUCT = struct.Struct('>H')
+FLOAT_STRUCT = struct.Struct('f')
+LEN_FORMATS = {1: 'B', 2: 'H'}
 
 MSG_TYPE_FIELD = 'msg_type' 
 YEAR_FIELD = 'year'
@@ -37,6 +49,90 @@ PUBLISHER_FIELD = 'publisher'
 CATEGORIES_FIELD = 'categories'
 REVIEW_TEXT_FIELD = 'review_text'
 ALL_MESSAGE_FIELDS = (MSG_TYPE_FIELD, YEAR_FIELD, RATING_FIELD, MSP_FIELD, TITLE_FIELD, AUTHOR_FIELD, PUBLISHER_FIELD, CATEGORIES_FIELD, REVIEW_TEXT_FIELD)
+# In the order of the parameters bits
+MESSAGE_VALUE_FIELDS = ALL_MESSAGE_FIELDS[1:]
+TITLE_PARAMETER_INDEX = MESSAGE_VALUE_FIELDS.index(TITLE_FIELD)
+
+def variable_lengths_struct(variable_parameters):
+    fmt = '>'
+    for i, len_bytes in enumerate(VARIABLE_LEN_BYTES):
+        if variable_parameters & (1 << i):
+            fmt += LEN_FORMATS[len_bytes]
+    return struct.Struct(fmt)
+
+def present_variable_fields(variable_parameters):
+    return tuple(i for i in range(len(VARIABLE_LEN_BYTES)) if variable_parameters & (1 << i))
+
+# Indexed by the variable fields bits of the parameters byte (parameters >> AMOUNT_OF_FIXED_FIELDS)
+VARIABLE_LENGTHS_STRUCTS = [variable_lengths_struct(p) for p in range(2**len(VARIABLE_LEN_BYTES))]
+PRESENT_VARIABLE_FIELDS = [present_variable_fields(p) for p in range(2**len(VARIABLE_LEN_BYTES))]
+LIST_VARIABLE_FIELDS = (1, 3) # authors and categories, relative to the variable fields
+
+def fixed_fields_layout(parameters):
+    layout = []
+    position = 0
+    for field in range(AMOUNT_OF_FIXED_FIELDS):
+        if parameters & (1 << field):
+            layout.append((field, position, position + PARAMETER_LENS[field]))
+            position += PARAMETER_LENS[field]
+    return tuple(layout), position
+
+# Indexed by the fixed fields bits of the parameters byte
+FIXED_FIELDS_LAYOUTS = [fixed_fields_layout(p) for p in range(2**AMOUNT_OF_FIXED_FIELDS)]
+FIXED_FIELDS_MASK = 2**AMOUNT_OF_FIXED_FIELDS - 1
+
+def message_spans(buffer, offset):
+    """
+    Parses the header of the message that starts at offset. Returns its msg_type,
+    the (start, end) positions of the value of every field inside of buffer, or None
+    for the absent ones, and the offset where the message ends. 
+    If the message is not complete in buffer the spans are None
+    """
+    try:
+        msg_type = buffer[offset]
+        parameters = buffer[offset + MSG_TYPE_BYTES]
+        offset += FIXED_PART_HEADER_LEN
+        spans = [None] * len(PARAMETER_LENS)
+        fixed_fields, fixed_fields_len = FIXED_FIELDS_LAYOUTS[parameters & FIXED_FIELDS_MASK]
+        for field, start, end in fixed_fields:
+            spans[field] = (offset + start, offset + end)
+        offset += fixed_fields_len
+
+        variable_parameters = parameters >> AMOUNT_OF_FIXED_FIELDS
+        lengths_struct = VARIABLE_LENGTHS_STRUCTS[variable_parameters]
+        lengths = lengths_struct.unpack_from(buffer, offset)
+        offset += lengths_struct.size
+        for field, length in zip(PRESENT_VARIABLE_FIELDS[variable_parameters], lengths):
+            if length:
+                spans[AMOUNT_OF_FIXED_FIELDS + field] = (offset, offset + length)
+            offset += length
+    except (IndexError, struct.error):
+        return None, None, offset
+    if offset > len(buffer):
+        return None, None, offset
+    return msg_type, spans, offset
+
+def decode_field(buffer, field, span):
+    if span == None:
+        return None
+    start, end = span
+    if field == 0:
+        return YEAR_STRUCT.unpack_from(buffer, start)[0]
+    if field < AMOUNT_OF_FIXED_FIELDS:
+        return FLOAT_STRUCT.unpack_from(buffer, start)[0]
+    value = str(buffer[start:end], 'utf-8')
+    if field - AMOUNT_OF_FIXED_FIELDS in LIST_VARIABLE_FIELDS:
+        return value.split(SEPARATOR)
+    return value
+
+def encode_field(field, value):
+    if field == 0:
+        return YEAR_STRUCT.pack(value)
+    if field < AMOUNT_OF_FIXED_FIELDS:
+        return FLOAT_STRUCT.pack(value)
+    if field - AMOUNT_OF_FIXED_FIELDS in LIST_VARIABLE_FIELDS:
+        value = SEPARATOR.join(value)
+    return value.encode()
 
 class QueryMessage():
     def __init__(self, msg_type, year=None, rating=None, mean_sentiment_polarity= None, title=None, authors=None, publisher=None, categories=None, review_text=None):
@@ -51,25 +147,59 @@ class QueryMessage():
         self.review_text = review_text
         
     @classmethod
-    def from_bytes(self, byte_array):
-        if len(byte_array) < 2:
-            return None
-        msg_type = remove_bytes(byte_array, 1)[0]
+    def from_bytes(cls, byte_array):
+        """
+        Decodes the message at the start of byte_array. If byte_array is a bytearray 
+        the bytes of the message are removed from it
+        """
+        with memoryview(byte_array) as view:
+            message, offset = cls.from_buffer(view)
+        if message and isinstance(byte_array, bytearray):
+            del byte_array[:offset]
+        return message
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        """
+        Decodes the message that starts at offset without copying the buffer.
+        Returns the message and the offset where it ends. If it could not be 
+        decoded (None, offset) is returned
+        """
         try:
-            generator = ParametersGenerator(byte_array)
-            year = generator.next()
-            rating = generator.next()
-            msp = generator.next()
-            title = generator.next()
-            authors = generator.next()
-            publisher = generator.next()
-            categories = generator.next()
-            review_text = generator.next()
-        except:
-            return None
-        
-        return QueryMessage(msg_type, year, rating, msp, title, authors, publisher, categories, review_text) 
-    
+            msg_type = buffer[offset]
+            parameters = buffer[offset + MSG_TYPE_BYTES]
+            offset += FIXED_PART_HEADER_LEN
+            year = rating = msp = None
+            if parameters & YEAR_PARAMETER:
+                year = YEAR_STRUCT.unpack_from(buffer, offset)[0]
+                offset += YEAR_BYTES
+            if parameters & RATING_PARAMETER:
+                rating = FLOAT_STRUCT.unpack_from(buffer, offset)[0]
+                offset += RATING_BYTES
+            if parameters & MSP_PARAMETER:
+                msp = FLOAT_STRUCT.unpack_from(buffer, offset)[0]
+                offset += MSP_BYTES
+
+            variable_parameters = parameters >> AMOUNT_OF_FIXED_FIELDS
+            lengths_struct = VARIABLE_LENGTHS_STRUCTS[variable_parameters]
+            lengths = lengths_struct.unpack_from(buffer, offset)
+            offset += lengths_struct.size
+
+            values = [None] * len(VARIABLE_LEN_BYTES)
+            for field, length in zip(PRESENT_VARIABLE_FIELDS[variable_parameters], lengths):
+                end = offset + length
+                if end > len(buffer):
+                    return None, offset
+                if length:
+                    values[field] = str(buffer[offset:end], 'utf-8')
+                    if field in LIST_VARIABLE_FIELDS:
+                        values[field] = values[field].split(SEPARATOR)
+                offset = end
+        except (IndexError, struct.error, UnicodeDecodeError):
+            return None, offset
+
+        return QueryMessage(msg_type, year, rating, msp, *values), offset
+
     @classmethod
     def from_socket(cls, socket):
         fixed_part_header  = recv_exactly(socket, FIXED_PART_HEADER_LEN)
@@ -168,6 +298,11 @@ class QueryMessage():
 
     def contains_in_title(self, word):
         return word.lower() in self.title.lower()
+
+    def title_bytes(self):
+        if self.title == None:
+            return None
+        return encode_field(TITLE_PARAMETER_INDEX, self.title)
     
     def decade(self):
         if self.year == None:
@@ -197,6 +332,110 @@ class QueryMessage():
     def __eq__(self, other):
         return self.fields_to_list() == other.fields_to_list()
     
+class LazyQueryMessage(QueryMessage):
+    """
+    QueryMessage backed by the bytes it was received in. Each field is decoded
+    the first time it is accessed, and the fields that were not modified are 
+    forwarded as the original bytes when the message is serialized again
+    """
+    def __init__(self, msg_type, buffer, spans, span):
+        self.msg_type = msg_type
+        self._buffer = buffer
+        self._spans = spans
+        self._span = span
+        self._values = {}
+        self._modified = set()
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        """
+        The message keeps a reference to buffer, so it must not be modified while
+        the message is being used
+        """
+        msg_type, spans, end = message_spans(buffer, offset)
+        if spans == None:
+            return None, offset
+        return LazyQueryMessage(msg_type, buffer, spans, (offset, end)), end
+
+    def _get_field(self, field):
+        if field not in self._values:
+            self._values[field] = decode_field(self._buffer, field, self._spans[field])
+        return self._values[field]
+    
+    def _set_field(self, field, value):
+        self._values[field] = value
+        self._modified.add(field)
+
+    def _field_bytes(self, field):
+        if field in self._modified:
+            value = self._values[field]
+            if not value:
+                return None
+            return encode_field(field, value)
+        span = self._spans[field]
+        if span == None:
+            return None
+        return self._buffer[span[0]:span[1]]
+
+    def title_bytes(self):
+        """
+        The title as received, without decoding it
+        """
+        return self._field_bytes(TITLE_PARAMETER_INDEX)
+
+    def to_bytes(self):
+        if not self._modified:
+            start, end = self._span
+            byte_array = bytearray([self.msg_type])
+            byte_array.extend(self._buffer[start + MSG_TYPE_BYTES:end])
+            return byte_array
+
+        parameters = 0
+        fixed_fields = bytearray()
+        lengths = bytearray()
+        variable_fields = bytearray()
+        for field in range(len(PARAMETER_LENS)):
+            field_bytes = self._field_bytes(field)
+            if field_bytes == None:
+                continue
+            parameters |= 1 << field
+            if field < AMOUNT_OF_FIXED_FIELDS:
+                fixed_fields.extend(field_bytes)
+            else:
+                lengths.extend(integer_to_big_endian_byte_array(len(field_bytes), PARAMETER_LENS[field]))
+                variable_fields.extend(field_bytes)
+        
+        byte_array = bytearray([self.msg_type, parameters])
+        byte_array.extend(fixed_fields)
+        byte_array.extend(lengths)
+        byte_array.extend(variable_fields)
+        return byte_array
+
+    def copy(self):
+        message = LazyQueryMessage(self.msg_type, self._buffer, self._spans, self._span)
+        message._values = dict(self._values)
+        message._modified = set(self._modified)
+        return message
+
+    def copy_droping_fields(self, fields_to_drop):
+        message = self.copy()
+        for field in fields_to_drop:
+            setattr(message, field, None)
+        return message
+    
+    def copy_keeping_fields(self, fields_to_keep):
+        message = self.copy()
+        for field in MESSAGE_VALUE_FIELDS:
+            if not field in fields_to_keep:
+                setattr(message, field, None)
+        return message
+
+def lazy_field_property(field):
+    return property(lambda self: self._get_field(field), lambda self, value: self._set_field(field, value))
+
+for i, field_name in enumerate(MESSAGE_VALUE_FIELDS):
+    setattr(LazyQueryMessage, field_name, lazy_field_property(i))
+    
 def query_to_query_result(query):
     switch = {
         1: QUERY1_RESULT,
@@ -385,6 +624,55 @@ class TestMessage(TestCase):
         self.assertEqual(msg.to_bytes(), self.test_book_message_to_bytes())
         self.assertEqual(len(msg_bytes), 0)
 
+    def test_message_from_buffer_with_offset(self):
+        msg = QueryMessage(REVIEW_MSG_TYPE, rating=4.0, title='titulo', review_text='review del texto')
+        other = QueryMessage(BOOK_MSG_TYPE, year=1990, authors=['autor1', 'autor2'], categories=['Fiction'])
+        buffer = bytes(msg.to_bytes() + other.to_bytes())
+        decoded_msg, offset = QueryMessage.from_buffer(buffer)
+        decoded_other, end = QueryMessage.from_buffer(buffer, offset)
+        self.assertEqual(decoded_msg, msg)
+        self.assertEqual(decoded_other, other)
+        self.assertEqual(decoded_other.msg_type, BOOK_MSG_TYPE)
+        self.assertEqual(end, len(buffer))
+    
+    def test_truncated_message_from_buffer(self):
+        msg_bytes = self.test_book_message_to_bytes()
+        msg, _offset = QueryMessage.from_buffer(bytes(msg_bytes[:-1]))
+        self.assertEqual(msg, None)
+
+    def test_lazy_message_forwards_original_bytes(self):
+        msg_bytes = bytes(self.test_book_message_to_bytes())
+        msg, end = LazyQueryMessage.from_buffer(msg_bytes)
+        self.assertEqual(end, len(msg_bytes))
+        self.assertEqual(msg.title, 'titulo')
+        self.assertEqual(msg.authors, ['autor1', 'autor2'])
+        self.assertEqual(msg.publisher, None)
+        msg.msg_type = QUERY1_RESULT
+        self.assertEqual(msg.to_bytes(), bytearray([QUERY1_RESULT]) + msg_bytes[1:])
+
+    def test_lazy_message_to_bytes_with_modified_fields(self):
+        msg = QueryMessage(REVIEW_MSG_TYPE, year=1990, rating=4.0, title='titulo', categories=['Fiction', 'Drama'], review_text='review del texto')
+        lazy_msg, _end = LazyQueryMessage.from_buffer(bytes(msg.to_bytes()))
+        lazy_msg = lazy_msg.copy_droping_fields([CATEGORIES_FIELD])
+        lazy_msg.title = 'otro titulo'
+        expected = QueryMessage(REVIEW_MSG_TYPE, year=1990, rating=4.0, title='otro titulo', review_text='review del texto')
+        self.assertEqual(lazy_msg.to_bytes(), expected.to_bytes())
+        self.assertEqual(QueryMessage.from_bytes(lazy_msg.to_bytes()), expected)
+
+    def test_lazy_message_copy_keeping_fields(self):
+        msg = QueryMessage(BOOK_MSG_TYPE, year=1990, title='titulo', authors=['autor1'], publisher='editorial')
+        lazy_msg, _end = LazyQueryMessage.from_buffer(bytes(msg.to_bytes()))
+        expected = QueryMessage(BOOK_MSG_TYPE, title='titulo', authors=['autor1'])
+        self.assertEqual(lazy_msg.copy_keeping_fields([TITLE_FIELD, AUTHOR_FIELD]).to_bytes(), expected.to_bytes())
+        self.assertEqual(lazy_msg.publisher, 'editorial')
+
+    def test_lazy_message_title_bytes(self):
+        msg = QueryMessage(REVIEW_MSG_TYPE, rating=4.0, title='título', review_text='review del texto')
+        lazy_msg, _end = LazyQueryMessage.from_buffer(bytes(msg.to_bytes()))
+        self.assertEqual(bytes(lazy_msg.title_bytes()), 'título'.encode())
+        self.assertEqual(msg.title_bytes(), 'título'.encode())
+        self.assertEqual(QueryMessage(REVIEW_MSG_TYPE).title_bytes(), None)
+
     def test_copy_dropping_fields(self):
         msg = QueryMessage(BOOK_MSG_TYPE, year=1990, title='titulo')
         expected_msg = QueryMessage(BOOK_MSG_TYPE, year=1990)
@@ -2,7 +2,9 @@ import os
 import random
 import time
 
-from Persistance.KeyValueStorage import KeyValueStorage
+from Persistance.KeyValueStorage import KeyValueStorage, MmapKeyValueStorage
+from Persistance.RecordStorage import RecordStorage
+from Persistance.SnapshotStorage import SnapshotStorage
 from Persistance.log import LogReadWriter
 from Persistance.MetadataHandler import MetadataHandler
 try:
@@ -34,6 +36,9 @@ def set_classes_as_faulty_if_needed(classes):
         for c in classes:
             set_class_as_faulty(c)
         set_class_as_faulty(KeyValueStorage)
+        set_class_as_faulty(MmapKeyValueStorage)
+        set_class_as_faulty(RecordStorage)
+        set_class_as_faulty(SnapshotStorage)
         set_class_as_faulty(LogReadWriter)
 
 def burst(cls, method_name):